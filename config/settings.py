@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 import os
+from datetime import timedelta
 from pathlib import Path
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -24,6 +27,25 @@ SECRET_KEY = 'django-insecure-r9e+y6ro#_3!edtg+z@^si$ygq_$&cz#6f#ti6vizr)uw(p5qh
 
 STRIPE_PUBLIC_KEY = os.getenv('STRIPE_PUBLIC_KEY')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
+STRIPE_CLIENT = 'main.stripe_client.HttpxStripeClient'
+STRIPE_CURRENCY = 'usd'
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+STRIPE_TIMEOUT = 10
+STRIPE_CONNECT_TIMEOUT = 3
+STRIPE_MAX_CONNECTIONS = 20
+STRIPE_MAX_CONCURRENCY = 50
+STRIPE_PAGE_SIZE = 100
+STRIPE_SYNC_MAX_RETRIES = 5
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
+STRIPE_WEBHOOK_TOLERANCE = 5 * 60
+STRIPE_EVENTS_BATCH_SIZE = 500
+STRIPE_EVENTS_MAX_BATCHES = 20
+STRIPE_EVENTS_DRAIN_DELAY = 5
+STRIPE_RECONCILIATION_WINDOW = timedelta(days=1)
+STRIPE_RECONCILIATION_SLICE = timedelta(hours=1)
+STRIPE_RECONCILIATION_DELAY = timedelta(hours=1)
+STRIPE_RECONCILIATION_BATCH_SIZE = 1000
+CHECKOUT_DOMAIN = os.getenv('CHECKOUT_DOMAIN', 'http://127.0.0.1:8000')
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -136,16 +158,29 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+THUMBNAIL_WIDTHS = (160, 480, 960)
+THUMBNAIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+THUMBNAIL_QUALITY = 80
+
+CHUNKED_UPLOAD_DIR = BASE_DIR / 'tmp' / 'uploads'
+CHUNKED_UPLOAD_MAX_SIZE = 100 * 1024 * 1024
+CHUNKED_UPLOAD_READ_SIZE = 64 * 1024
+CHUNKED_UPLOAD_TTL = timedelta(days=1)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
+AUTH_USER_CACHE_TIMEOUT = 5 * 60
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-      'rest_framework_simplejwt.authentication.JWTAuthentication',
+      'users.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -163,6 +198,25 @@ CSRF_TRUSTED_ORIGINS = [
 CORS_ALLOW_ALL_ORIGINS = False
 
 
+ALLOWED_LINK_DOMAINS = ['youtube.com', 'youtu.be']
+
+APPROXIMATE_COUNT_THRESHOLD = 10000
+APPROXIMATE_COUNT_TTL = 60
+RESPONSE_CACHE_TIMEOUT = 5 * 60
+SUBSCRIPTIONS_CACHE_TIMEOUT = 24 * 60 * 60
+EXPORT_CHUNK_SIZE = 2000
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_REPORTED_REJECTS = 100
+# Postgres text search configuration of course and lesson texts
+SEARCH_CONFIG = 'russian'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
+
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 
@@ -170,6 +224,22 @@ CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_TIMEZONE = "Australia/Tasmania"
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    # picks up the inbox when the drain scheduled by a webhook was lost
+    'drain-stripe-events': {
+        'task': 'main.tasks.process_stripe_events',
+        'schedule': crontab(minute='*/5'),
+    },
+    'reconcile-stripe-payments': {
+        'task': 'main.tasks.reconcile_stripe_payments',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'delete-stale-uploads': {
+        'task': 'main.tasks.delete_stale_upload_sessions',
+        'schedule': crontab(minute=30),
+    },
+}
 
 EMAIL_HOST = 'smtp.yandex.ru'
 EMAIL_PORT = 465
@@ -179,3 +249,6 @@ EMAIL_USE_SSL = True
 
 SERVER_EMAIL = EMAIL_HOST_USER
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+
+NOTIFICATION_CHUNK_SIZE = 500
+NOTIFICATION_COALESCE_WINDOW = 5 * 60
@@ -20,10 +20,14 @@ from django.urls import path, include
 from rest_framework import permissions
 
 from drf_yasg.views import get_schema_view
+from django.conf import settings
+from django.conf.urls.static import static
 from drf_yasg import openapi
 import stripe
 from main.views import (
     CreateCheckoutSessionView,
+    AsyncCreateCheckoutSessionView,
+    StripeWebhookView,
     SuccessView,
     CancelView,
 )
@@ -41,6 +45,8 @@ schema_view = get_schema_view(
     permission_classes=(permissions.AllowAny,),
 )
 
+stripe.api_key = settings.STRIPE_SECRET_KEY
+
 
 def charge(request):
     if request.method == 'POST':
@@ -64,5 +70,8 @@ urlpatterns = [
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('cancel/', CancelView.as_view(), name='cancel'),
     path('success/', SuccessView.as_view(), name='success'),
-    path('create-checkout-session/<pk>/', CreateCheckoutSessionView.as_view(), name='create-checkout-session')
-]
+    path('create-checkout-session/<pk>/', CreateCheckoutSessionView.as_view(), name='create-checkout-session'),
+    path('async/create-checkout-session/<pk>/', AsyncCreateCheckoutSessionView.as_view(),
+         name='async-create-checkout-session'),
+    path('stripe/webhook/', StripeWebhookView.as_view(), name='stripe-webhook'),
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,224 @@
+import hashlib
+import time
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag, urlencode
+from redis import Redis
+from redis.client import Pipeline
+from rest_framework import status
+from rest_framework.response import Response
+
+from main.models import Subscription
+from users.models import UserRoles
+
+
+def version_key(model) -> str:
+    return f'response_cache:version:{model._meta.label_lower}'
+
+
+def stats_key(name: str, outcome: str) -> str:
+    return f'response_cache:{outcome}:{name}'
+
+
+def get_versions(models: Iterable) -> List[str]:
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, str(time.time_ns()), None)
+            versions[key] = cache.get(key)
+    return [str(versions[key]) for key in keys]
+
+
+def bump_version(model) -> None:
+    cache.set(version_key(model), str(time.time_ns()), None)
+
+
+@lru_cache(maxsize=None)
+def get_redis_client(location: str) -> Redis:
+    return Redis.from_url(location)
+
+
+def get_redis_pipeline(key: str) -> Tuple[Optional[str], Optional[Pipeline]]:
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if not isinstance(backend, RedisCache):
+        return None, None
+    servers = settings.CACHES[DEFAULT_CACHE_ALIAS]['LOCATION']
+    if isinstance(servers, str):
+        servers = servers.split(',')
+    # RedisCache writes to the first server
+    return backend.make_and_validate_key(key), get_redis_client(servers[0]).pipeline()
+
+
+def append_to_list(key: str, value: str, timeout: int) -> None:
+    redis_key, pipeline = get_redis_pipeline(key)
+    if pipeline is not None:
+        pipeline.rpush(redis_key, value).expire(redis_key, timeout).execute()
+        return
+    # single-process caches (locmem in tests) have no atomic list
+    values = cache.get(key, [])
+    cache.set(key, values + [value], timeout)
+
+
+def pop_list(key: str) -> List[str]:
+    """Returns and removes everything append_to_list stored, values appended meanwhile are not lost."""
+    redis_key, pipeline = get_redis_pipeline(key)
+    if pipeline is not None:
+        values, _ = pipeline.lrange(redis_key, 0, -1).delete(redis_key).execute()
+        return [value.decode() for value in values]
+    values = cache.get(key, [])
+    cache.delete(key)
+    return values
+
+
+def subscriptions_version_key(user_id: int) -> str:
+    return f'subscriptions:version:{user_id}'
+
+
+def subscriptions_key(user_id: int, version: str) -> str:
+    return f'subscriptions:{user_id}:{version}'
+
+
+def get_subscriptions_version(user_id: int) -> str:
+    key = subscriptions_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, str(time.time_ns()), settings.SUBSCRIPTIONS_CACHE_TIMEOUT)
+        version = cache.get(key)
+    return str(version)
+
+
+def get_subscribed_course_ids(user_id: int) -> Set[int]:
+    # the version is read before the rows: a set loaded before a toggle is stored under the old version
+    key = subscriptions_key(user_id, get_subscriptions_version(user_id))
+    course_ids = cache.get(key)
+    if course_ids is None:
+        course_ids = set(
+            Subscription.objects.filter(user_id=user_id, is_subscribed=True).values_list('course_id', flat=True)
+        )
+        cache.set(key, course_ids, settings.SUBSCRIPTIONS_CACHE_TIMEOUT)
+    return course_ids
+
+
+def invalidate_subscribed_course_ids(user_id: int) -> None:
+    # a new version rather than a delete, a reader that loaded the old rows can't store them under it,
+    # and only after commit, so readers of the new version see the change
+    transaction.on_commit(lambda: cache.set(
+        subscriptions_version_key(user_id), str(time.time_ns()), settings.SUBSCRIPTIONS_CACHE_TIMEOUT
+    ))
+
+
+def increment_stat(name: str, outcome: str) -> None:
+    key = stats_key(name, outcome)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_response_cache_stats(name: str) -> Dict[str, int]:
+    return {
+        'hits': cache.get(stats_key(name, 'hits'), 0),
+        'misses': cache.get(stats_key(name, 'misses'), 0),
+    }
+
+
+class CachedResponseMixin:
+    """
+    Caches list/retrieve response data per endpoint, scope and query params.
+    Entries are dropped when any model from cache_dependencies is saved or deleted (see main.signals).
+    """
+    cache_dependencies = ()
+
+    def get_response_cache_scope(self) -> str:
+        user = self.request.user
+        if user.role == UserRoles.MODERATOR:
+            return UserRoles.MODERATOR
+        return f'owner:{user.pk}'
+
+    def get_response_cache_key(self, request) -> str:
+        raw_key = ':'.join([
+            self.__class__.__name__,
+            self.get_response_cache_scope(),
+            request.get_host(),
+            request.path,
+            urlencode(sorted(request.query_params.lists()), doseq=True),
+            *get_versions(self.cache_dependencies),
+        ])
+        return 'response_cache:' + hashlib.md5(raw_key.encode()).hexdigest()
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        name = self.__class__.__name__
+        key = self.get_response_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            increment_stat(name, 'hits')
+            return Response(data)
+
+        increment_stat(name, 'misses')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """
+    ETag/Last-Modified for list and retrieve, answered with 304 before anything is serialized.
+    Validators combine MAX(updated_at) and the row count with the cache_dependencies versions,
+    so changes in related models and deletions are noticed too. Use together with CachedResponseMixin.
+    """
+
+    def get_conditional_queryset(self):
+        return self.filter_queryset(self.get_queryset())
+
+    def get_validators(self, queryset) -> Tuple[Optional[str], Optional[int]]:
+        aggregate = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+        if not aggregate['count']:
+            return None, None
+        versions = get_versions(self.cache_dependencies)
+        last_modified = max(
+            [int(aggregate['last_modified'].timestamp())] + [int(version) // 10 ** 9 for version in versions]
+        )
+        raw_etag = ':'.join([
+            self.get_response_cache_scope(),
+            str(aggregate['count']),
+            aggregate['last_modified'].isoformat(),
+            *versions,
+        ])
+        return quote_etag(hashlib.md5(raw_etag.encode()).hexdigest()), last_modified
+
+    def conditional_response(self, handler, queryset, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(queryset)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, self.get_conditional_queryset(), request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.get_conditional_queryset().filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return self.conditional_response(super().retrieve, queryset, request, *args, **kwargs)
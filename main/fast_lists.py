@@ -0,0 +1,100 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, SlugRelatedField
+from rest_framework.response import Response
+
+# fields whose to_representation returns values() output unchanged
+PLAIN_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.ChoiceField)
+
+
+def file_url_converter(field: serializers.FileField, storage) -> Callable[[str], Optional[str]]:
+    request = field.context.get('request')
+
+    def convert(name):
+        if not name:
+            return None
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+    return convert
+
+
+class RowMapper:
+    """
+    Turns .values() rows into the dicts serializer.data would produce for the same objects.
+    Built once per request from the serializer's bound fields: every field becomes a values() key and
+    an optional converter, so a row costs a dict lookup and at most one call per field.
+    """
+
+    def __init__(self, columns: List[Tuple[str, str, Optional[Callable]]], extra_keys: Iterable[str] = ()):
+        self.columns = columns
+        self.keys = list(dict.fromkeys([key for _, key, _ in columns] + list(extra_keys)))
+
+    @classmethod
+    def compile(cls, serializer: serializers.ModelSerializer,
+                extra_keys: Iterable[str] = ()) -> Optional['RowMapper']:
+        """None when a field can't be read from values(), e.g. a SerializerMethodField or nested serializer."""
+        model = serializer.Meta.model
+        columns = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, (serializers.BaseSerializer, ManyRelatedField)) or '.' in field.source:
+                return None
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                return None
+            if not model_field.concrete:
+                return None
+
+            if isinstance(field, SlugRelatedField):
+                columns.append((name, f'{field.source}__{field.slug_field}', None))
+            elif isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None:
+                columns.append((name, field.source, None))
+            elif isinstance(field, serializers.FileField):
+                columns.append((name, field.source, file_url_converter(field, model_field.storage)))
+            elif isinstance(field, PLAIN_FIELDS) and not isinstance(field, serializers.MultipleChoiceField):
+                columns.append((name, field.source, None))
+            elif isinstance(field, serializers.RelatedField):
+                return None
+            else:
+                columns.append((name, field.source, field.to_representation))
+        return cls(columns, extra_keys)
+
+    def map(self, rows: Iterable[Dict]) -> List[Dict]:
+        columns = self.columns
+        return [
+            {
+                name: row[key] if convert is None or row[key] is None else convert(row[key])
+                for name, key, convert in columns
+            }
+            for row in rows
+        ]
+
+
+class FastListMixin:
+    """
+    Read-only list responses built from .values() rows by a RowMapper instead of serializer instances.
+    Falls back to the serializer when it has fields the mapper can't compile. fast_list_keys are loaded
+    in addition to the serialized columns, e.g. the ordering read by the cursor paginator.
+    """
+    fast_list = True
+    fast_list_keys = ()
+
+    def get_row_mapper(self) -> Optional[RowMapper]:
+        if not self.fast_list:
+            return None
+        return RowMapper.compile(self.get_serializer(), extra_keys=self.fast_list_keys)
+
+    def list(self, request, *args, **kwargs):
+        mapper = self.get_row_mapper()
+        if mapper is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).values(*mapper.keys)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(mapper.map(page))
+        return Response(mapper.map(queryset))
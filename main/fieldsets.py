@@ -0,0 +1,101 @@
+from typing import Dict, Iterable, List, Optional, Set
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import QuerySet
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import Field
+from rest_framework.relations import SlugRelatedField
+
+
+def split_field_names(value: str) -> List[str]:
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def trim_queryset(queryset: QuerySet, fields: Dict[str, Field], fieldset: Optional[Set[str]],
+                  always_load: Iterable[str] = ()) -> QuerySet:
+    """
+    Loads the columns the serializer fields in fieldset read (all of them for None) and joins the relations
+    their SlugRelatedFields display, so omitted relations cost neither a join nor a query per row.
+    """
+    model = queryset.model
+    load = {'pk', *always_load}
+    # the ordering is read back from instances by the cursor paginator
+    load.update(name.lstrip('-') for name in queryset.query.order_by if isinstance(name, str) and '__' not in name)
+    relations = []
+    for name, field in fields.items():
+        if fieldset is not None and name not in fieldset:
+            continue
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            # SerializerMethodFields and annotations
+            continue
+        if not model_field.concrete:
+            continue
+        load.add(model_field.name)
+        if isinstance(field, SlugRelatedField) and model_field.is_relation:
+            relations.append(model_field.name)
+            load.add(f'{model_field.name}__{field.slug_field}')
+
+    if fieldset is None:
+        # select_related() without arguments would follow every foreign key
+        return queryset.select_related(*relations) if relations else queryset
+    queryset = queryset.select_related(None)
+    if relations:
+        queryset = queryset.select_related(*relations)
+    return queryset.only(*load)
+
+
+class SparseFieldsetMixin:
+    """
+    ?fields=a,b keeps only the listed fields of a list response, ?exclude=c drops fields from it.
+    The serializer (see SparseFieldsetSerializerMixin) skips the other fields and the queryset loads only
+    the columns the remaining ones read. fieldset_always_load lists columns read from instances outside
+    the serializer, e.g. by the cursor paginator.
+    """
+    fieldset_always_load = ()
+
+    def get_fieldset(self) -> Optional[Set[str]]:
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = self.parse_fieldset()
+        return self._fieldset
+
+    def parse_fieldset(self) -> Optional[Set[str]]:
+        params = self.request.query_params
+        if self.request.method != 'GET' or getattr(self, 'action', 'list') != 'list':
+            return None
+        if 'fields' not in params and 'exclude' not in params:
+            return None
+
+        available = list(self.get_serializer_class()().fields)
+        requested = split_field_names(params['fields']) if 'fields' in params else available
+        excluded = split_field_names(params.get('exclude', ''))
+        unknown = set(requested).union(excluded).difference(available)
+        if unknown:
+            raise ValidationError({'fields': f'Неизвестные поля: {", ".join(sorted(unknown))}'})
+        return {name for name in requested if name not in excluded}
+
+    def includes_field(self, name: str) -> bool:
+        fieldset = self.get_fieldset()
+        return fieldset is None or name in fieldset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fieldset'] = self.get_fieldset()
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields = self.get_serializer_class()().fields
+        return trim_queryset(queryset, fields, self.get_fieldset(), self.fieldset_always_load)
+
+
+class SparseFieldsetSerializerMixin:
+    """Drops the fields missing from context['fieldset'], filled in by SparseFieldsetMixin."""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.context.get('fieldset')
+        if fieldset is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in fieldset}
@@ -0,0 +1,154 @@
+import csv
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from main.models import Course, Lesson, Payment
+from main.signals import invalidate_bulk_changes
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class RowError(Exception):
+    pass
+
+
+def iter_rows(stream: TextIO, file_format: str) -> Iterator[Dict]:
+    if file_format == 'csv':
+        yield from csv.DictReader(stream)
+    elif file_format == 'jsonl':
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as error:
+                    yield {'_error': f'Некорректный JSON: {error}'}
+    else:
+        raise ValueError(f'Неизвестный формат: {file_format}')
+
+
+def group_pks(pairs: Iterable[Tuple[Hashable, int]]) -> Dict[Hashable, List[int]]:
+    grouped = defaultdict(list)
+    for key, pk in pairs:
+        grouped[key].append(pk)
+    return grouped
+
+
+def parse_amount(value) -> int:
+    # int() would truncate 12.9 and accept true, amounts are whole numbers written as such
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    raise RowError(f'Некорректная сумма "{value}"')
+
+
+class PaymentImporter:
+    """
+    Imports payments from CSV/JSONL rows with the columns date, amount, method, user, owner (emails),
+    course (course_name) and lesson (lesson_name). References are resolved through maps loaded once,
+    rows are inserted with bulk_create per batch, so an interrupted import can continue from report['offset'].
+    Names are not unique: a lesson is looked up within the row's course, and a name shared by several
+    courses or lessons rejects the row instead of picking one of them.
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, offset: int = 0, reject_file: Optional[TextIO] = None):
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.offset = offset
+        self.reject_file = reject_file
+        self.methods = {method for method, _ in Payment.METHOD_CHOICES}
+        self.users = group_pks(User.objects.values_list('email', 'pk'))
+        self.courses = group_pks((name, pk) for pk, name in Course.objects.values_list('pk', 'course_name'))
+        lessons = list(Lesson.objects.values_list('pk', 'course_id', 'lesson_name'))
+        self.lessons = group_pks((name, pk) for pk, _, name in lessons)
+        self.course_lessons = group_pks(((course_id, name), pk) for pk, course_id, name in lessons)
+        self.rejects: List[Dict] = []
+
+    def resolve(self, lookup: Dict[Hashable, List[int]], row: Dict, column: str,
+                key: Optional[Hashable] = None) -> Optional[int]:
+        value = row.get(column)
+        if value in (None, ''):
+            return None
+        pks = lookup.get(value if key is None else key)
+        if not pks:
+            raise RowError(f'{column} "{value}" не найден')
+        if len(pks) > 1:
+            raise RowError(f'{column} "{value}" неоднозначен: найдено {len(pks)}')
+        return pks[0]
+
+    def build_payment(self, row: Dict) -> Payment:
+        if not isinstance(row, dict):
+            raise RowError('Строка должна быть объектом')
+        if '_error' in row:
+            raise RowError(row['_error'])
+        if row.get('method') not in self.methods:
+            raise RowError(f'Неизвестный способ оплаты "{row.get("method")}"')
+        date = parse_datetime(str(row.get('date') or ''))
+        if date is None:
+            raise RowError(f'Некорректная дата "{row.get("date")}"')
+        amount = parse_amount(row.get('amount'))
+
+        user_id = self.resolve(self.users, row, 'user')
+        course_id = self.resolve(self.courses, row, 'course')
+        if course_id is None:
+            lesson_id = self.resolve(self.lessons, row, 'lesson')
+        else:
+            lesson_id = self.resolve(self.course_lessons, row, 'lesson', key=(course_id, row.get('lesson')))
+        return Payment(
+            date=date,
+            amount=amount,
+            method=row['method'],
+            user_id=user_id,
+            owner_id=self.resolve(self.users, row, 'owner') or user_id,
+            course_id=course_id,
+            lesson_id=lesson_id,
+        )
+
+    def reject(self, line: int, row: Dict, error: str) -> None:
+        rejected = {'line': line, 'error': error, 'row': row}
+        if self.reject_file is not None:
+            self.reject_file.write(json.dumps(rejected, ensure_ascii=False, default=str) + '\n')
+        if len(self.rejects) < settings.IMPORT_MAX_REPORTED_REJECTS:
+            self.rejects.append(rejected)
+
+    def run(self, rows: Iterator[Dict]) -> Dict:
+        started = time.monotonic()
+        imported = rejected = 0
+        offset = self.offset
+        batch: List[Payment] = []
+
+        for line, row in enumerate(rows):
+            if line < self.offset:
+                continue
+            offset = line + 1
+            try:
+                batch.append(self.build_payment(row))
+            except RowError as error:
+                self.reject(line, row, str(error))
+                rejected += 1
+            if len(batch) >= self.batch_size:
+                Payment.objects.bulk_create(batch)
+                imported += len(batch)
+                batch = []
+                logger.info(f'Импортировано {imported} платежей, можно продолжить со смещения {offset}')
+
+        if batch:
+            Payment.objects.bulk_create(batch)
+            imported += len(batch)
+        invalidate_bulk_changes(Payment)
+
+        seconds = time.monotonic() - started
+        return {
+            'imported': imported,
+            'rejected': rejected,
+            'offset': offset,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round((imported + rejected) / seconds) if seconds else None,
+            'rejects': self.rejects,
+        }
@@ -0,0 +1,44 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import BaseCommand
+
+from main.stripe_client import HttpxStripeClient
+from main.stripe_stub import StubStripeServer
+
+
+class Command(BaseCommand):
+    help = 'Сравнение пропускной способности синхронного и асинхронного создания сессий оплаты на локальном stub Stripe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.2, help='Задержка ответа Stripe, секунды')
+        parser.add_argument('--workers', type=int, default=8, help='Число синхронных воркеров')
+        parser.add_argument('--concurrency', type=int, default=50, help='Лимит одновременных запросов async')
+
+    def handle(self, *args, **options):
+        params = {'mode': 'payment', 'line_items': [{'price': 'price_test', 'quantity': 1}]}
+        total = options['requests']
+
+        with StubStripeServer(latency=options['latency']) as server:
+            client = HttpxStripeClient(
+                api_base=server.url,
+                max_connections=max(options['workers'], options['concurrency']),
+                max_concurrency=options['concurrency'],
+            )
+
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                list(executor.map(lambda _: client.create_checkout_session(params), range(total)))
+            self.report(f'sync, {options["workers"]} воркеров', total, time.monotonic() - started)
+
+            async def checkout_many():
+                await asyncio.gather(*(client.acreate_checkout_session(params) for _ in range(total)))
+
+            started = time.monotonic()
+            asyncio.run(checkout_many())
+            self.report(f'async, лимит {options["concurrency"]}', total, time.monotonic() - started)
+
+    def report(self, name, total, seconds):
+        self.stdout.write(f'{name}: {total} сессий за {seconds:.2f} с, {total / seconds:.1f} сессий/с')
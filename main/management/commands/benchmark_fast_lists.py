@@ -0,0 +1,61 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from main.models import Course, Lesson, Payment
+from main.views import LessonListAPIView, PaymentListAPIView
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Время списков уроков и платежей через сериализатор и через values() с RowMapper, на временных данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # everything is created in a transaction that is rolled back at the end,
+        # requests come from APIRequestFactory whose host is testserver
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+            user = User.objects.create(email='benchmark-fast-lists@example.com', first_name='Benchmark')
+            course = Course.objects.create(course_name='Benchmark', course_description='Benchmark', owner=user)
+            lessons = Lesson.objects.bulk_create([
+                Lesson(course=course, owner=user, lesson_name=f'Урок {index}', content_hash=str(index),
+                       lesson_description='Описание урока ' * 20, video_url='https://youtu.be/abc',
+                       lesson_preview=f'main/lesson/{index}.png')
+                for index in range(options['rows'])
+            ])
+            Payment.objects.bulk_create([
+                Payment(user=user, owner=user, course=course, lesson=lesson, date=timezone.now(), amount=100,
+                        method='CASH')
+                for lesson in lessons
+            ])
+
+            rows = options['rows']
+            for name, view, url in (
+                ('уроки', LessonListAPIView, f'/lesson/?per_page={rows}'),
+                ('платежи', PaymentListAPIView, f'/payments/?cursor=&per_page={rows}'),
+            ):
+                slow = self.measure(view.as_view(fast_list=False), url, user, options['repeat'])
+                fast = self.measure(view.as_view(fast_list=True), url, user, options['repeat'])
+                self.stdout.write(f'{name}, {rows} строк: сериализатор {slow * 1000:.1f} мс, '
+                                  f'values() {fast * 1000:.1f} мс, ускорение x{slow / fast:.1f}')
+            transaction.set_rollback(True)
+
+    def measure(self, view, url, user, repeat) -> float:
+        factory = APIRequestFactory()
+        timings = []
+        for attempt in range(repeat):
+            # a distinct query string per attempt keeps the response cache out of the measurement
+            request = factory.get(f'{url}&attempt={attempt}')
+            force_authenticate(request, user=user)
+            started = time.perf_counter()
+            view(request).render()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return timings[len(timings) // 2]
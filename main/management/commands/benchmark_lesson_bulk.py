@@ -0,0 +1,73 @@
+import time
+from unittest.mock import patch
+
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from main.models import Course, Lesson
+from main.views import LessonBulkAPIView, LessonCreateAPIView, LessonUpdateAPIView
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Время и число запросов: создание и изменение уроков одним bulk-запросом и по одному, на временных данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lessons', type=int, default=100)
+
+    def handle(self, *args, **options):
+        # everything is created in a transaction that is rolled back at the end, requests come from
+        # APIRequestFactory whose host is testserver, notifications are left out of the measurement
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']), \
+                patch('main.views.schedule_update_notification'):
+            self.factory = APIRequestFactory()
+            self.user = User.objects.create(email='benchmark-lesson-bulk@example.com')
+            course = Course.objects.create(course_name='Benchmark lesson bulk', course_description='Benchmark',
+                                           owner=self.user)
+            total = options['lessons']
+            data = [
+                {'course': course.course_name, 'lesson_name': f'Урок {prefix} {index}',
+                 'lesson_description': 'Описание урока'}
+                for prefix in ('single', 'bulk')
+                for index in range(total)
+            ]
+
+            create = LessonCreateAPIView.as_view()
+            single = self.measure(lambda: [
+                create(self.request('post', '/lesson/create/', item)) for item in data[:total]
+            ])
+            bulk = self.measure(lambda: LessonBulkAPIView.as_view()(
+                self.request('post', '/lesson/bulk/', data[total:])
+            ))
+            self.report('создание', total, single, bulk)
+
+            lessons = list(Lesson.objects.filter(course=course).values_list('pk', flat=True))
+            update = LessonUpdateAPIView.as_view()
+            single = self.measure(lambda: [
+                update(self.request('patch', f'/lesson/update/{pk}/', {'lesson_name': f'Изменен {pk}'}), pk=pk)
+                for pk in lessons[:total]
+            ])
+            bulk = self.measure(lambda: LessonBulkAPIView.as_view()(self.request(
+                'patch', '/lesson/bulk/', [{'id': pk, 'lesson_name': f'Изменен {pk}'} for pk in lessons[total:]]
+            )))
+            self.report('изменение', total, single, bulk)
+            transaction.set_rollback(True)
+
+    def request(self, method, url, data):
+        request = getattr(self.factory, method)(url, data, format='json')
+        force_authenticate(request, user=self.user)
+        return request
+
+    def measure(self, run):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - started
+        return seconds, len(context.captured_queries)
+
+    def report(self, name, total, single, bulk):
+        self.stdout.write(f'{name}, {total} уроков: по одному {single[0] * 1000:.1f} мс и {single[1]} запросов, '
+                          f'bulk {bulk[0] * 1000:.1f} мс и {bulk[1]} запросов, ускорение x{single[0] / bulk[0]:.1f}')
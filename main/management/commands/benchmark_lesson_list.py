@@ -0,0 +1,54 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from main.models import Course, Lesson
+from main.views import LessonListAPIView
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Размер ответа и время списка уроков целиком и с ?fields=/?exclude=, на временных данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lessons', type=int, default=200)
+        parser.add_argument('--description-size', type=int, default=5000, help='Длина описания урока, символов')
+        parser.add_argument('--per-page', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--fieldsets', nargs='+', default=['', 'fields=id,lesson_name', 'exclude=lesson_description'])
+
+    def handle(self, *args, **options):
+        # everything is created in a transaction that is rolled back at the end,
+        # requests come from APIRequestFactory whose host is testserver
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+            user = User.objects.create(email='benchmark-lesson-list@example.com')
+            course = Course.objects.create(course_name='Benchmark', course_description='Benchmark', owner=user)
+            Lesson.objects.bulk_create([
+                Lesson(course=course, owner=user, lesson_name=f'Урок {index}', content_hash=str(index),
+                       lesson_description='x' * options['description_size'])
+                for index in range(options['lessons'])
+            ])
+            for fieldset in options['fieldsets']:
+                self.measure(user, fieldset, options)
+            transaction.set_rollback(True)
+
+    def measure(self, user, fieldset, options):
+        factory = APIRequestFactory()
+        view = LessonListAPIView.as_view()
+        timings = []
+        size = 0
+        for attempt in range(options['repeat']):
+            # a distinct query string per attempt keeps the response cache out of the measurement
+            request = factory.get(f'/lesson/?per_page={options["per_page"]}&attempt={attempt}&{fieldset}')
+            force_authenticate(request, user=user)
+            started = time.perf_counter()
+            response = view(request)
+            response.render()
+            timings.append(time.perf_counter() - started)
+            size = len(response.content)
+        timings.sort()
+        self.stdout.write(f'{fieldset or "все поля"}: {size / 1024:.1f} КБ, '
+                          f'медиана {timings[len(timings) // 2] * 1000:.1f} мс, минимум {timings[0] * 1000:.1f} мс')
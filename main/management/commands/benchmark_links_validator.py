@@ -0,0 +1,28 @@
+import timeit
+
+from django.core.management import BaseCommand
+
+from main.validators import LinksValidator
+
+
+class Command(BaseCommand):
+    help = 'Замер времени LinksValidator на больших описаниях уроков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        validator = LinksValidator(fields=['lesson_name', 'lesson_description', 'video_url'])
+        chunk = 'Описание урока со ссылкой https://www.youtube.com/watch?v=abc и обычным текстом. '
+        # long chains of labels that never end in a top-level domain, the worst case for the pattern
+        worst_chunk = 'a1.'
+        for size in options['sizes']:
+            for name, text in (('текст', chunk), ('худший случай', worst_chunk)):
+                lesson = {
+                    'lesson_name': 'Урок',
+                    'lesson_description': text * max(size // len(text), 1) + '-',
+                    'video_url': 'https://youtu.be/abc',
+                }
+                best = min(timeit.repeat(lambda: validator(lesson), number=1, repeat=options['repeat']))
+                self.stdout.write(f'{size} символов, {name}: {best * 1000:.2f} мс')
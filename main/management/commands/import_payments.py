@@ -0,0 +1,39 @@
+import json
+from pathlib import Path
+
+from django.core.management import BaseCommand, CommandError
+
+from main.importers import PaymentImporter, iter_rows
+
+
+class Command(BaseCommand):
+    help = 'Импорт платежей из CSV/JSONL файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='по умолчанию берется из расширения файла')
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--offset', type=int, default=0, help='сколько строк пропустить при продолжении импорта')
+        parser.add_argument('--rejects', help='файл для отклоненных строк (JSONL)')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.')
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError(f'Неизвестный формат: {file_format}')
+
+        reject_file = open(options['rejects'], 'a', encoding='utf-8') if options['rejects'] else None
+        try:
+            with path.open(encoding='utf-8', newline='') as stream:
+                importer = PaymentImporter(
+                    batch_size=options['batch_size'],
+                    offset=options['offset'],
+                    reject_file=reject_file,
+                )
+                report = importer.run(iter_rows(stream, file_format))
+        finally:
+            if reject_file is not None:
+                reject_file.close()
+
+        report.pop('rejects')
+        self.stdout.write(json.dumps(report))
@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand
+
+from main.models import Course
+from main.stripe_catalog import sync_catalog
+from main.tasks import sync_stripe_catalog
+
+
+class Command(BaseCommand):
+    help = 'Создание и обновление продуктов и цен Stripe для курсов, изменившихся с последней синхронизации'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, nargs='+', help='id курсов, по умолчанию все устаревшие')
+        parser.add_argument('--background', action='store_true', help='поставить синхронизацию в очередь Celery')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            sync_stripe_catalog.delay()
+            self.stdout.write('Синхронизация поставлена в очередь')
+            return
+        courses = Course.objects.filter(pk__in=options['course']) if options['course'] else None
+        self.stdout.write(f'Синхронизировано курсов: {sync_catalog(courses)}')
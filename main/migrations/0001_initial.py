@@ -0,0 +1,80 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Course',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_name', models.CharField(max_length=200, verbose_name='Название')),
+                ('course_preview', models.ImageField(blank=True, null=True, upload_to='main/course/', verbose_name='Превью')),
+                ('course_description', models.TextField(verbose_name='Описание')),
+                ('cost', models.DecimalField(decimal_places=2, default=50000, max_digits=10, verbose_name='Стоимость курса')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Время обновления')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'курс',
+                'verbose_name_plural': 'курсы',
+            },
+        ),
+        migrations.CreateModel(
+            name='Lesson',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lesson_name', models.CharField(max_length=200, verbose_name='Название')),
+                ('lesson_description', models.TextField(verbose_name='Описание')),
+                ('lesson_preview', models.ImageField(blank=True, null=True, upload_to='main/lesson/', verbose_name='Превью')),
+                ('video_url', models.URLField(blank=True, null=True, verbose_name='Ссылка на видео')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Время обновления')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.course', verbose_name='курс')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'урок',
+                'verbose_name_plural': 'уроки',
+            },
+        ),
+        migrations.CreateModel(
+            name='Subscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_subscribed', models.BooleanField(default=False, verbose_name='ok подписки')),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to='main.course', verbose_name='курс')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='пользователь')),
+            ],
+            options={
+                'verbose_name': 'Подписка',
+                'verbose_name_plural': 'Подписки',
+            },
+        ),
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField(verbose_name='Дата оплаты')),
+                ('amount', models.PositiveIntegerField(verbose_name='Сумма оплаты')),
+                ('method', models.CharField(choices=[('CASH', 'Наличные'), ('TRANSFER', 'Перевод на счет')], max_length=40, verbose_name='Способ оплаты')),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.course', verbose_name='Оплата курса')),
+                ('lesson', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.lesson', verbose_name='Оплата урока')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'платеж',
+                'verbose_name_plural': 'платежи',
+            },
+        ),
+    ]
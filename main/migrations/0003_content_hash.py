@@ -0,0 +1,39 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    for model_name, fields in (('Course', ('course_name', 'course_description')),
+                               ('Lesson', ('lesson_name', 'lesson_description'))):
+        model = apps.get_model('main', model_name)
+        batch = []
+        for instance in model.objects.only('pk', *fields).iterator(chunk_size=2000):
+            name, description = (getattr(instance, field) for field in fields)
+            instance.content_hash = hashlib.sha256(f'{name}\x00{description}'.encode()).hexdigest()
+            batch.append(instance)
+            if len(batch) >= 2000:
+                model.objects.bulk_update(batch, ['content_hash'])
+                batch = []
+        model.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, null=True, verbose_name='Хеш названия и описания'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, null=True, verbose_name='Хеш названия и описания'),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def rename_duplicates(apps, schema_editor):
+    # the old validator never worked, so equal name + description pairs may exist: the oldest row keeps its name,
+    # the others get their id appended, rows are not deleted because lessons and payments point to them
+    for model_name, (name_field, description_field) in (('Course', ('course_name', 'course_description')),
+                                                        ('Lesson', ('lesson_name', 'lesson_description'))):
+        model = apps.get_model('main', model_name)
+        max_length = model._meta.get_field(name_field).max_length
+        duplicates = list(model.objects.values('content_hash').annotate(
+            first_id=Min('id'),
+            total=Count('id'),
+        ).filter(total__gt=1))
+        for duplicate in duplicates:
+            instances = model.objects.filter(content_hash=duplicate['content_hash']).exclude(id=duplicate['first_id'])
+            for instance in instances.only('pk', name_field, description_field):
+                suffix = f' (#{instance.pk})'
+                name = getattr(instance, name_field)[:max_length - len(suffix)] + suffix
+                setattr(instance, name_field, name)
+                description = getattr(instance, description_field)
+                instance.content_hash = hashlib.sha256(f'{name}\x00{description}'.encode()).hexdigest()
+                instance.save(update_fields=[name_field, 'content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='course',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, verbose_name='Хеш названия и описания'),
+        ),
+        migrations.AlterField(
+            model_name='lesson',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, verbose_name='Хеш названия и описания'),
+        ),
+        migrations.AddConstraint(
+            model_name='course',
+            constraint=models.UniqueConstraint(fields=('content_hash',), name='course_content_hash_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='lesson',
+            constraint=models.UniqueConstraint(fields=('content_hash',), name='lesson_content_hash_unique'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicate_subscriptions(apps, schema_editor):
+    Subscription = apps.get_model('main', 'Subscription')
+    duplicates = Subscription.objects.values('user_id', 'course_id').annotate(
+        last_id=Max('id'),
+        total=Count('id'),
+    ).filter(total__gt=1)
+    for duplicate in duplicates.iterator():
+        Subscription.objects.filter(
+            user_id=duplicate['user_id'],
+            course_id=duplicate['course_id'],
+        ).exclude(id=duplicate['last_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_content_hash_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_subscriptions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_access_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='stripe_price_id',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, verbose_name='Цена Stripe'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='stripe_product_id',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, verbose_name='Продукт Stripe'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='stripe_synced_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Версия курса в Stripe'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='stripe_unit_amount',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Сумма цены Stripe'),
+        ),
+    ]
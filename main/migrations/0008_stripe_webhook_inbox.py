@@ -0,0 +1,40 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_stripe_catalog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True, unique=True, verbose_name='Сессия оплаты Stripe'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='method',
+            field=models.CharField(choices=[('CASH', 'Наличные'), ('TRANSFER', 'Перевод на счет'), ('STRIPE', 'Оплата через Stripe')], max_length=40, verbose_name='Способ оплаты'),
+        ),
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='Событие Stripe')),
+                ('type', models.CharField(max_length=100, verbose_name='Тип события')),
+                ('payload', models.JSONField(verbose_name='Событие')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Время получения')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Время обработки')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Ошибка обработки')),
+            ],
+            options={
+                'verbose_name': 'событие Stripe',
+                'verbose_name_plural': 'события Stripe',
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='stripe_event_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_stripe_webhook_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_start', models.DateTimeField(verbose_name='Начало периода')),
+                ('window_end', models.DateTimeField(verbose_name='Конец периода')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Время запуска')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Время завершения')),
+                ('sessions_checked', models.PositiveIntegerField(default=0, verbose_name='Проверено сессий Stripe')),
+                ('payments_checked', models.PositiveIntegerField(default=0, verbose_name='Проверено платежей')),
+                ('discrepancies_count', models.PositiveIntegerField(default=0, verbose_name='Найдено расхождений')),
+            ],
+            options={
+                'verbose_name': 'сверка со Stripe',
+                'verbose_name_plural': 'сверки со Stripe',
+            },
+        ),
+        migrations.CreateModel(
+            name='PaymentDiscrepancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('missing_payment', 'Оплата в Stripe без платежа'), ('missing_session', 'Платеж без оплаты в Stripe'), ('amount_mismatch', 'Суммы не совпадают')], max_length=20, verbose_name='Тип расхождения')),
+                ('stripe_session_id', models.CharField(max_length=255, verbose_name='Сессия оплаты Stripe')),
+                ('stripe_amount', models.PositiveIntegerField(blank=True, null=True, verbose_name='Сумма в Stripe')),
+                ('payment_amount', models.PositiveIntegerField(blank=True, null=True, verbose_name='Сумма платежа')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.payment', verbose_name='Платеж')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discrepancies', to='main.reconciliationrun', verbose_name='Сверка')),
+            ],
+            options={
+                'verbose_name': 'расхождение со Stripe',
+                'verbose_name_plural': 'расхождения со Stripe',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_stripe_reconciliation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='course_preview_thumbnails',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Уменьшенные превью'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='lesson_preview_thumbnails',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Уменьшенные превью'),
+        ),
+    ]
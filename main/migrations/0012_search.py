@@ -0,0 +1,65 @@
+# Generated by Django 4.2.5 on 2026-10-18 12:01
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+SEARCH_FIELDS = {
+    'course': ('course_name', 'course_description'),
+    'lesson': ('lesson_name', 'lesson_description'),
+}
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        for model_name, (name, description) in SEARCH_FIELDS.items():
+            model = apps.get_model('main', model_name)
+            model.objects.update(
+                search_vector=SearchVector(name, weight='A', config=settings.SEARCH_CONFIG)
+                + SearchVector(description, weight='B', config=settings.SEARCH_CONFIG)
+            )
+            schema_editor.execute(
+                f'CREATE INDEX {model_name}_search_vector_idx ON main_{model_name} USING gin (search_vector)'
+            )
+    else:
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE main_search USING fts5('
+            'name, description, kind UNINDEXED, object_id UNINDEXED, tokenize = "unicode61 remove_diacritics 2")'
+        )
+        for model_name, (name, description) in SEARCH_FIELDS.items():
+            schema_editor.execute(
+                f'INSERT INTO main_search (name, description, kind, object_id) '
+                f'SELECT {name}, {description}, %s, id FROM main_{model_name}',
+                [model_name],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for model_name in SEARCH_FIELDS:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {model_name}_search_vector_idx')
+    else:
+        schema_editor.execute('DROP TABLE IF EXISTS main_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.5 on 2026-10-18 12:17
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def amounts_to_cents(apps, schema_editor):
+    PaymentDiscrepancy = apps.get_model('main', 'PaymentDiscrepancy')
+    PaymentDiscrepancy.objects.update(stripe_amount=F('stripe_amount') * 100, payment_amount=F('payment_amount') * 100)
+
+
+def amounts_to_units(apps, schema_editor):
+    PaymentDiscrepancy = apps.get_model('main', 'PaymentDiscrepancy')
+    PaymentDiscrepancy.objects.update(stripe_amount=F('stripe_amount') / 100, payment_amount=F('payment_amount') / 100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentdiscrepancy',
+            name='payment_amount',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Сумма платежа, в минимальных единицах валюты'),
+        ),
+        migrations.AlterField(
+            model_name='paymentdiscrepancy',
+            name='stripe_amount',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Сумма в Stripe, в минимальных единицах валюты'),
+        ),
+        migrations.RunPython(amounts_to_cents, amounts_to_units),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.5 on 2026-10-18 12:35
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_synced_names(apps, schema_editor):
+    # products synced from the current version of the course carry its name
+    Course = apps.get_model('main', 'Course')
+    Course.objects.filter(stripe_product_id__isnull=False, stripe_synced_at__gte=F('updated_at')).update(
+        stripe_product_name=F('course_name'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_payment_amount_decimal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='stripe_product_name',
+            field=models.CharField(blank=True, editable=False, max_length=200, null=True, verbose_name='Название продукта Stripe'),
+        ),
+        migrations.RunPython(fill_synced_names, migrations.RunPython.noop),
+    ]
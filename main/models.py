@@ -1,16 +1,55 @@
+import hashlib
+import uuid
+
 from django.conf import settings
+from django.core.validators import MinValueValidator
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from users.models import NULLABLE
-from typing import List, Optional
+from typing import List, Optional, Tuple
+
+
+def make_content_hash(name: str, description: str) -> str:
+    return hashlib.sha256(f'{name}\x00{description}'.encode()).hexdigest()
 
 
-class Course(models.Model):
-    course_name = models.CharField(max_length=200, related_name='subscriptions', verbose_name='Название')
+class ContentHashModel(models.Model):
+    """Keeps a sha256 of name + description so uniqueness checks don't compare long texts."""
+    content_fields: Tuple[str, str] = ()
+    content_hash = models.CharField(max_length=64, editable=False, verbose_name='Хеш названия и описания')
+
+    class Meta:
+        abstract = True
+
+    def refresh_content_hash(self) -> None:
+        self.content_hash = make_content_hash(*(getattr(self, field) for field in self.content_fields))
+
+    def save(self, *args, **kwargs):
+        self.refresh_content_hash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(self.content_fields).intersection(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'content_hash'}
+        super().save(*args, **kwargs)
+
+
+class Course(ContentHashModel):
+    course_name = models.CharField(max_length=200, verbose_name='Название')
     course_preview = models.ImageField(upload_to='main/course/', verbose_name='Превью', **NULLABLE)
+    course_preview_thumbnails = models.JSONField(default=dict, editable=False, verbose_name='Уменьшенные превью')
     course_description = models.TextField(verbose_name='Описание')
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, **NULLABLE)
     cost = models.DecimalField(max_digits=10, decimal_places=2, default=50000, verbose_name='Стоимость курса')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Время обновления')
+    stripe_product_id = models.CharField(max_length=100, editable=False, verbose_name='Продукт Stripe', **NULLABLE)
+    stripe_price_id = models.CharField(max_length=100, editable=False, verbose_name='Цена Stripe', **NULLABLE)
+    stripe_unit_amount = models.PositiveIntegerField(editable=False, verbose_name='Сумма цены Stripe', **NULLABLE)
+    stripe_product_name = models.CharField(max_length=200, editable=False, verbose_name='Название продукта Stripe',
+                                           **NULLABLE)
+    stripe_synced_at = models.DateTimeField(editable=False, verbose_name='Версия курса в Stripe', **NULLABLE)
+    # kept up to date by main.search.index_objects, the GIN index is Postgres-only and lives in migration 0012
+    search_vector = SearchVectorField(editable=False, verbose_name='Поисковый вектор', **NULLABLE)
+
+    content_fields = ('course_name', 'course_description')
 
     def __str__(self):
         return f'{self.course_name}'
@@ -18,6 +57,28 @@ class Course(models.Model):
     class Meta:
         verbose_name = 'курс'
         verbose_name_plural = 'курсы'
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='course_updated_at_id_idx'),
+            models.Index(fields=['owner', 'updated_at'], name='course_owner_updated_at_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash'], name='course_content_hash_unique'),
+        ]
+
+    @property
+    def unit_amount(self) -> int:
+        # Stripe takes amounts in the smallest currency unit
+        return int(self.cost * 100)
+
+    def differs_from_stripe(self) -> bool:
+        # only the name and the price reach Stripe, other saves (previews, descriptions) leave it current
+        return not self.stripe_price_id or self.stripe_unit_amount != self.unit_amount \
+            or self.stripe_product_name != self.course_name
+
+    def has_current_stripe_price(self) -> bool:
+        # stripe_synced_at keeps the updated_at the catalog was synced from, any later save makes the price stale
+        return bool(self.stripe_price_id) and self.stripe_synced_at is not None \
+            and self.stripe_synced_at >= self.updated_at
 
     @classmethod
     def get_all_courses(cls) -> List['Course']:
@@ -31,14 +92,18 @@ class Course(models.Model):
             return None
 
 
-class Lesson(models.Model):
+class Lesson(ContentHashModel):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, verbose_name='курс')
     lesson_name = models.CharField(max_length=200, verbose_name='Название')
     lesson_description = models.TextField(verbose_name='Описание')
     lesson_preview = models.ImageField(upload_to='main/lesson/', verbose_name='Превью', **NULLABLE)
+    lesson_preview_thumbnails = models.JSONField(default=dict, editable=False, verbose_name='Уменьшенные превью')
     video_url = models.URLField(verbose_name='Ссылка на видео', **NULLABLE)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, **NULLABLE)
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Время обновления')
+    search_vector = SearchVectorField(editable=False, verbose_name='Поисковый вектор', **NULLABLE)
+
+    content_fields = ('lesson_name', 'lesson_description')
 
     def __str__(self):
         return f'{self.lesson_name}'
@@ -46,8 +111,15 @@ class Lesson(models.Model):
     class Meta:
         verbose_name = 'урок'
         verbose_name_plural = 'уроки'
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='lesson_updated_at_id_idx'),
+            models.Index(fields=['owner', 'updated_at'], name='lesson_owner_updated_at_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash'], name='lesson_content_hash_unique'),
+        ]
 
-        @classmethod
+    @classmethod
     def get_all_lessons(cls) -> List['Lesson']:
         return cls.objects.all()
 
@@ -64,15 +136,19 @@ class Payment(models.Model):
     METHOD_CHOICES = (
         ('CASH', 'Наличные'),
         ('TRANSFER', 'Перевод на счет'),
+        ('STRIPE', 'Оплата через Stripe'),
     )
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, verbose_name='Пользователь',
-                             **NULLABLE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, related_name='payments',
+                             verbose_name='Пользователь', **NULLABLE)
     date = models.DateTimeField(verbose_name='Дата оплаты')
     course = models.ForeignKey(Course, on_delete=models.SET_NULL, **NULLABLE, verbose_name='Оплата курса')
     lesson = models.ForeignKey(Lesson, on_delete=models.SET_NULL, **NULLABLE, verbose_name='Оплата урока')
-    amount = models.PositiveIntegerField(verbose_name='Сумма оплаты')
+    amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)],
+                                 verbose_name='Сумма оплаты')
     method = models.CharField(max_length=40, choices=METHOD_CHOICES, verbose_name='Способ оплаты')
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, **NULLABLE)
+    stripe_session_id = models.CharField(max_length=255, unique=True, editable=False,
+                                         verbose_name='Сессия оплаты Stripe', **NULLABLE)
 
     def __str__(self):
         return f'Платеж от {self.user} на сумму {self.amount}'
@@ -80,11 +156,17 @@ class Payment(models.Model):
     class Meta:
         verbose_name = 'платеж'
         verbose_name_plural = 'платежи'
+        indexes = [
+            models.Index(fields=['date', 'id'], name='payment_date_id_idx'),
+            models.Index(fields=['owner', 'date'], name='payment_owner_date_idx'),
+            models.Index(fields=['course', 'date'], name='payment_course_date_idx'),
+        ]
 
 
 class Subscription(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name="пользователь")
-    course = models.ForeignKey(Course, on_delete=models.CASCADE, verbose_name='курс', **NULLABLE)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='subscriptions', verbose_name='курс',
+                               **NULLABLE)
     is_subscribed = models.BooleanField(default=False, verbose_name='ok подписки')
 
     def __str__(self):
@@ -93,8 +175,104 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        indexes = [
+            models.Index(fields=['course', 'is_subscribed'], name='subscription_course_active_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'course'], name='subscription_user_course_unique'),
+        ]
 
     @classmethod
     def get_all_course_subscriptions(cls) -> List['Lesson']:
 
         return cls.objects.all()
+
+
+class StripeEvent(models.Model):
+    """Inbox of received Stripe webhook events, drained in batches by main.tasks.process_stripe_events."""
+    event_id = models.CharField(max_length=255, unique=True, verbose_name='Событие Stripe')
+    type = models.CharField(max_length=100, verbose_name='Тип события')
+    payload = models.JSONField(verbose_name='Событие')
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name='Время получения')
+    processed_at = models.DateTimeField(verbose_name='Время обработки', **NULLABLE)
+    error = models.TextField(verbose_name='Ошибка обработки', **NULLABLE)
+
+    def __str__(self):
+        return f'{self.type} {self.event_id}'
+
+    class Meta:
+        verbose_name = 'событие Stripe'
+        verbose_name_plural = 'события Stripe'
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True),
+                         name='stripe_event_pending_idx'),
+        ]
+
+
+class ReconciliationRun(models.Model):
+    window_start = models.DateTimeField(verbose_name='Начало периода')
+    window_end = models.DateTimeField(verbose_name='Конец периода')
+    started_at = models.DateTimeField(auto_now_add=True, verbose_name='Время запуска')
+    finished_at = models.DateTimeField(verbose_name='Время завершения', **NULLABLE)
+    sessions_checked = models.PositiveIntegerField(default=0, verbose_name='Проверено сессий Stripe')
+    payments_checked = models.PositiveIntegerField(default=0, verbose_name='Проверено платежей')
+    discrepancies_count = models.PositiveIntegerField(default=0, verbose_name='Найдено расхождений')
+
+    def __str__(self):
+        return f'Сверка {self.window_start} - {self.window_end}'
+
+    class Meta:
+        verbose_name = 'сверка со Stripe'
+        verbose_name_plural = 'сверки со Stripe'
+
+
+class PaymentDiscrepancy(models.Model):
+    MISSING_PAYMENT = 'missing_payment'
+    MISSING_SESSION = 'missing_session'
+    AMOUNT_MISMATCH = 'amount_mismatch'
+    KIND_CHOICES = (
+        (MISSING_PAYMENT, 'Оплата в Stripe без платежа'),
+        (MISSING_SESSION, 'Платеж без оплаты в Stripe'),
+        (AMOUNT_MISMATCH, 'Суммы не совпадают'),
+    )
+    run = models.ForeignKey(ReconciliationRun, on_delete=models.CASCADE, related_name='discrepancies',
+                            verbose_name='Сверка')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Тип расхождения')
+    stripe_session_id = models.CharField(max_length=255, verbose_name='Сессия оплаты Stripe')
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, verbose_name='Платеж', **NULLABLE)
+    # both in the smallest currency unit, so a difference in cents is visible
+    stripe_amount = models.PositiveIntegerField(verbose_name='Сумма в Stripe, в минимальных единицах валюты', **NULLABLE)
+    payment_amount = models.PositiveIntegerField(verbose_name='Сумма платежа, в минимальных единицах валюты', **NULLABLE)
+
+    def __str__(self):
+        return f'{self.get_kind_display()}: {self.stripe_session_id}'
+
+    class Meta:
+        verbose_name = 'расхождение со Stripe'
+        verbose_name_plural = 'расхождения со Stripe'
+
+
+class UploadSession(models.Model):
+    """Chunked upload in progress, the received bytes live in CHUNKED_UPLOAD_DIR until attached."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions',
+                              verbose_name='Пользователь')
+    filename = models.CharField(max_length=255, verbose_name='Имя файла')
+    size = models.PositiveBigIntegerField(verbose_name='Размер файла')
+    offset = models.PositiveBigIntegerField(default=0, verbose_name='Получено байт')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Время создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Время обновления')
+
+    def __str__(self):
+        return f'{self.filename}: {self.offset} из {self.size}'
+
+    @property
+    def is_complete(self) -> bool:
+        return self.offset == self.size
+
+    class Meta:
+        verbose_name = 'загрузка файла'
+        verbose_name_plural = 'загрузки файлов'
+        indexes = [
+            models.Index(fields=['updated_at'], name='upload_session_updated_at_idx'),
+        ]
@@ -1,7 +1,173 @@
-from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+
+def table_count_key(model) -> str:
+    return f'table_count:{model._meta.label_lower}'
+
+
+def get_approximate_count(model, using='default'):
+    """
+    Row count estimate for an unfiltered table, or None when the table is small enough to count exactly.
+    Postgres reads the planner statistics from pg_class, other backends cache an exact count.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        count = row[0] if row else None
+    else:
+        count = cache.get(table_count_key(model))
+        if count is None:
+            count = model._default_manager.using(using).count()
+            cache.set(table_count_key(model), count, settings.APPROXIMATE_COUNT_TTL)
+    if count is None or count < settings.APPROXIMATE_COUNT_THRESHOLD:
+        return None
+    return count
+
+
+class ApproximatePage(Page):
+    """Page whose neighbours are known from the rows fetched for it rather than from the estimated count."""
+
+    def __init__(self, object_list, number, paginator, has_next: bool):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1
+
+
+class ApproximateCountDjangoPaginator(DjangoPaginator):
+    """
+    An estimated count is only displayed: with it page numbers are checked against the rows that exist,
+    per_page + 1 of them are fetched to tell whether a next page follows.
+    """
+    approximate = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            count = get_approximate_count(queryset.model, using=queryset.db)
+            if count is not None:
+                self.approximate = True
+                return count
+        return super().count
+
+    def validate_number(self, number):
+        # reading the count decides whether it is an estimate
+        self.count  # noqa: B018
+        if not self.approximate:
+            return super().validate_number(number)
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.approximate:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        return ApproximatePage(rows[:self.per_page], number, self, has_next=len(rows) > self.per_page)
 
 
 class LessonsPaginator(PageNumberPagination):
     page_size = 20
     page_size_query_param = 'per_page'
     max_page_size = 200
+
+
+class ApproximateCountPaginator(LessonsPaginator):
+    django_paginator_class = ApproximateCountDjangoPaginator
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['approximate'] = self.page.paginator.approximate
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['approximate'] = {'type': 'boolean', 'example': False}
+        return response_schema
+
+
+class UpdatedAtCursorPaginator(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'per_page'
+    max_page_size = 200
+    ordering = ('-updated_at', '-id')
+
+
+class PaymentCursorPaginator(UpdatedAtCursorPaginator):
+    ordering = ('-date', '-id')
+
+
+class CursorOrPageNumberPaginator(BasePagination):
+    """
+    Keyset pagination when the request carries ?cursor= (an empty value selects the first page),
+    page_number_class otherwise. page_number_class = None keeps the list unpaginated.
+    """
+    page_number_class = ApproximateCountPaginator
+    cursor_class = UpdatedAtCursorPaginator
+
+    def __init__(self):
+        self.paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_class.cursor_query_param in request.query_params:
+            self.paginator = self.cursor_class()
+        elif self.page_number_class is not None:
+            self.paginator = self.page_number_class()
+        else:
+            return None
+        return self.paginator.paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.cursor_class().get_paginated_response_schema(schema)
+
+    def get_paginators(self):
+        paginators = [self.cursor_class()]
+        if self.page_number_class is not None:
+            paginators.append(self.page_number_class())
+        return paginators
+
+    def get_schema_fields(self, view):
+        fields = {}
+        for paginator in self.get_paginators():
+            for field in paginator.get_schema_fields(view):
+                fields.setdefault(field.name, field)
+        return list(fields.values())
+
+    def get_schema_operation_parameters(self, view):
+        parameters = {}
+        for paginator in self.get_paginators():
+            for parameter in paginator.get_schema_operation_parameters(view):
+                parameters.setdefault(parameter['name'], parameter)
+        return list(parameters.values())
+
+
+class PaymentsPaginator(CursorOrPageNumberPaginator):
+    page_number_class = None
+    cursor_class = PaymentCursorPaginator
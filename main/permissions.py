@@ -1,4 +1,5 @@
 from rest_framework.permissions import BasePermission, SAFE_METHODS
+from main.models import Course, Lesson
 from users.models import UserRoles
 
 
@@ -15,10 +16,22 @@ class IsCourseOwner(BasePermission):
         return obj.owner == request.user
 
 
+def get_course_ownership(request):
+    """Ids of courses the user owns or has lessons in, loaded once per request."""
+    if not hasattr(request, '_course_ownership'):
+        owned = Course.objects.filter(owner=request.user).values_list('pk', flat=True)
+        with_lessons = Lesson.objects.filter(owner=request.user).values_list('course_id', flat=True)
+        request._course_ownership = set(owned.union(with_lessons))
+    return request._course_ownership
+
+
 class IsCourseOrLessonOwner(BasePermission):
+    """Expects obj.course to be loaded with select_related('course')."""
 
     def has_object_permission(self, request, view, obj):
-        return obj.course.owner == request.user or obj.course.lesson_set.filter(owner=request.user).exists()
+        if obj.course.owner_id == request.user.pk or obj.owner_id == request.user.pk:
+            return True
+        return obj.course_id in get_course_ownership(request)
 
 
 class IsPaymentOwner(BasePermission):
@@ -0,0 +1,47 @@
+import csv
+import json
+from typing import Dict, Iterable, Iterator, List
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+
+class Echo:
+    """File-like object that returns what is written instead of buffering it, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+class StreamRenderer(BaseRenderer):
+    """Renders rows lazily through stream(), render() covers regular (e.g. error) responses."""
+    charset = 'utf-8'
+
+    def stream(self, rows: Iterable[Dict], header: List[str]) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = [data]
+        header = list(data[0]) if data else []
+        return ''.join(self.stream(data, header)).encode(self.charset)
+
+
+class CSVStreamRenderer(StreamRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows: Iterable[Dict], header: List[str]) -> Iterator[str]:
+        writer = csv.writer(Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow([row[column] for column in header])
+
+
+class NDJSONStreamRenderer(StreamRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def stream(self, rows: Iterable[Dict], header: List[str]) -> Iterator[str]:
+        for row in rows:
+            yield json.dumps({column: row[column] for column in header}, cls=DjangoJSONEncoder) + '\n'
@@ -0,0 +1,147 @@
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, IntegerField, Value
+from django.utils.functional import cached_property
+
+from main.models import Course, Lesson
+
+# kind in the results -> model and its (name, description) fields
+SEARCH_TARGETS = {
+    'course': (Course, ('course_name', 'course_description')),
+    'lesson': (Lesson, ('lesson_name', 'lesson_description')),
+}
+SEARCH_KINDS = {model: kind for kind, (model, _) in SEARCH_TARGETS.items()}
+
+# SQLite has no tsvector, documents live in an FTS5 table created by migration 0012
+FTS_TABLE = 'main_search'
+
+
+def uses_fts() -> bool:
+    return connection.vendor != 'postgresql'
+
+
+def build_search_vector(fields: Tuple[str, str]) -> SearchVector:
+    name, description = fields
+    return SearchVector(name, weight='A', config=settings.SEARCH_CONFIG) \
+        + SearchVector(description, weight='B', config=settings.SEARCH_CONFIG)
+
+
+def index_objects(model, pks: Iterable[int]) -> None:
+    """Refreshes the search documents of the given rows with one statement per backend table."""
+    pks = list(pks)
+    if not pks:
+        return
+    kind = SEARCH_KINDS[model]
+    name, description = SEARCH_TARGETS[kind][1]
+    if not uses_fts():
+        # update() leaves updated_at alone and sends no post_save
+        model.objects.filter(pk__in=pks).update(search_vector=build_search_vector((name, description)))
+        return
+
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE kind = %s AND object_id IN ({placeholders})', [kind, *pks])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (name, description, kind, object_id) '
+            f'SELECT {name}, {description}, %s, id FROM {model._meta.db_table} WHERE id IN ({placeholders})',
+            [kind, *pks],
+        )
+
+
+def unindex_objects(model, pks: Iterable[int]) -> None:
+    pks = list(pks)
+    if not pks or not uses_fts():
+        return
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE kind = %s AND object_id IN ({placeholders})',
+                       [SEARCH_KINDS[model], *pks])
+
+
+def fts_match_expression(text: str) -> Optional[str]:
+    # every word is quoted, so FTS5 operators typed by the user are searched as plain words
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+class SearchResults:
+    """
+    Ranked courses and lessons matching `text`, as a lazy sequence for django.core.paginator:
+    count() and slicing each run one query, so a page never loads more rows than it shows.
+    owner limits the results to that user's courses and lessons, None searches everything.
+    """
+
+    def __init__(self, text: str, owner=None, kinds: Optional[List[str]] = None):
+        self.text = text
+        self.owner = owner
+        self.kinds = kinds or list(SEARCH_TARGETS)
+
+    def get_queryset(self):
+        query = SearchQuery(self.text, search_type='websearch', config=settings.SEARCH_CONFIG)
+        querysets = []
+        for kind in self.kinds:
+            model, (name, description) = SEARCH_TARGETS[kind]
+            queryset = model.objects.filter(search_vector=query)
+            if self.owner is not None:
+                queryset = queryset.filter(owner=self.owner)
+            # Lesson.course is a field, the annotation needs a name of its own
+            lesson_course = F('course_id') if model is Lesson else Value(None, output_field=IntegerField())
+            querysets.append(queryset.annotate(
+                kind=Value(kind),
+                name=F(name),
+                description=F(description),
+                lesson_course=lesson_course,
+                rank=SearchRank(F('search_vector'), query),
+            ).values('kind', 'id', 'name', 'description', 'lesson_course', 'rank'))
+        queryset = querysets[0].union(*querysets[1:], all=True) if len(querysets) > 1 else querysets[0]
+        return queryset.order_by('-rank', 'kind', 'id')
+
+    def get_fts_sql(self, columns: str) -> Tuple[str, list]:
+        sql = f'SELECT {columns} FROM {FTS_TABLE} ' \
+              f'LEFT JOIN main_course ON kind = \'course\' AND main_course.id = object_id ' \
+              f'LEFT JOIN main_lesson ON kind = \'lesson\' AND main_lesson.id = object_id ' \
+              f'WHERE {FTS_TABLE} MATCH %s AND kind IN ({", ".join(["%s"] * len(self.kinds))})'
+        params = [fts_match_expression(self.text), *self.kinds]
+        if self.owner is not None:
+            sql += ' AND COALESCE(main_course.owner_id, main_lesson.owner_id) = %s'
+            params.append(self.owner.pk)
+        return sql, params
+
+    @cached_property
+    def is_empty(self) -> bool:
+        return fts_match_expression(self.text) is None
+
+    def count(self) -> int:
+        if self.is_empty:
+            return 0
+        if not uses_fts():
+            return self.get_queryset().count()
+        sql, params = self.get_fts_sql('COUNT(*)')
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()[0]
+
+    def __getitem__(self, page: slice) -> List[Dict]:
+        if self.is_empty:
+            return []
+        if not uses_fts():
+            return list(self.get_queryset()[page])
+
+        # bm25() is lower for better matches, names weigh twice as much as descriptions
+        bm25 = f'bm25({FTS_TABLE}, 2.0, 1.0)'
+        sql, params = self.get_fts_sql(
+            f'kind, object_id AS id, name, description, main_lesson.course_id AS lesson_course, -{bm25} AS rank'
+        )
+        # FTS5 has a hidden column called rank, order by the expression itself
+        sql += f' ORDER BY {bm25}, kind, object_id LIMIT %s OFFSET %s'
+        params += [page.stop - page.start, page.start]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -1,50 +1,196 @@
+from typing import List
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.encoding import smart_str
 from rest_framework import serializers
-from main.models import Course, Lesson, Payment, Subscription
+from main.models import Course, Lesson, Payment, Subscription, UploadSession
 from rest_framework.relations import SlugRelatedField
-from main.validators import LinksValidator
+from main.caching import get_subscribed_course_ids
+from main.fieldsets import SparseFieldsetSerializerMixin
+from main.models import make_content_hash
+from main.validators import LinksValidator, UniqueContentValidator
 
 from users.models import User
 
 
-class CourseSerializer(serializers.ModelSerializer):
-    lessons_count = serializers.IntegerField(source='lesson_set.count', read_only=True)
+class ThumbnailsField(serializers.ReadOnlyField):
+    """<field>_thumbnails as {width: {format: url}}, filled in by main.tasks.generate_thumbnails."""
+
+    def get_url(self, name):
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def to_representation(self, value):
+        return {
+            width: {extension: self.get_url(name) for extension, name in formats.items()}
+            for width, formats in (value or {}).get('renditions', {}).items()
+        }
+
+
+class CourseSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    course_preview_thumbnails = ThumbnailsField()
+    lessons_count = serializers.SerializerMethodField()
     lessons = serializers.SerializerMethodField()
+    is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
         model = Course
-        fields = '__all__'
+        exclude = ['content_hash', 'search_vector', 'stripe_product_id', 'stripe_price_id', 'stripe_unit_amount',
+                   'stripe_synced_at']
         validators = [
-            LinksValidator(fields=['name', 'description']),
-            serializers.UniqueTogetherValidator(fields=['name', 'description'], queryset=Course.objects.all())
+            LinksValidator(fields=['course_name', 'course_description']),
+            UniqueContentValidator(queryset=Course.objects.all())
         ]
 
-        def get_lessons(self, course):
-            return LessonListSerializer(Lesson.objects.filter(course=course), many=True).data
+    def get_lessons_count(self, course):
+        # CourseViewSet.get_queryset annotates the count, fall back to a query otherwise
+        if hasattr(course, 'lessons_count'):
+            return course.lessons_count
+        return course.lesson_set.count()
 
-        def get_is_subscribed(self, obj):
-            user = self.context['request'].user
-            return Subscription.objects.filter(user=user, course=obj).exists()
+    def get_lessons(self, course):
+        return LessonListSerializer(course.lesson_set.all(), many=True).data
 
+    def get_is_subscribed(self, course):
+        # CourseViewSet passes the cached set of the user's subscriptions
+        subscribed_course_ids = self.context.get('subscribed_course_ids')
+        if subscribed_course_ids is None:
+            subscribed_course_ids = get_subscribed_course_ids(self.context['request'].user.pk)
+        return course.pk in subscribed_course_ids
 
-class LessonSerializer(serializers.ModelSerializer):
-    course = SlugRelatedField(slug_field='name', queryset=Course.objects.all())
+
+class LessonSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    course = SlugRelatedField(slug_field='course_name', queryset=Course.objects.all())
+    lesson_preview_thumbnails = ThumbnailsField()
 
     class Meta:
         model = Lesson
-        fields = '__all__'
+        exclude = ['content_hash', 'search_vector']
         validators = [
-            LinksValidator(fields=['name', 'description', 'video_url']),
-            serializers.UniqueTogetherValidator(fields=['name', 'description'], queryset=Lesson.objects.all())
+            LinksValidator(fields=['lesson_name', 'lesson_description', 'video_url']),
+            UniqueContentValidator(queryset=Lesson.objects.all())
+        ]
+
+
+class PreloadedSlugRelatedField(SlugRelatedField):
+    """
+    Resolves slugs from a map of slug -> matching objects filled once per request instead of a query per value.
+    The slug need not be unique, a value matching several objects is an error rather than a guess.
+    """
+    default_error_messages = {
+        'not_unique': 'Найдено несколько объектов с {slug_name}={value}.',
+    }
+
+    def __init__(self, **kwargs):
+        self.preloaded = None
+        super().__init__(**kwargs)
+
+    def preload(self, objects) -> None:
+        self.preloaded = {}
+        for obj in objects:
+            self.preloaded.setdefault(str(getattr(obj, self.slug_field)), []).append(obj)
+
+    def to_internal_value(self, data):
+        if self.preloaded is None:
+            return super().to_internal_value(data)
+        matches = self.preloaded.get(str(data))
+        if not matches:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=smart_str(data))
+        if len(matches) > 1:
+            self.fail('not_unique', slug_name=self.slug_field, value=smart_str(data))
+        return matches[0]
+
+
+class LessonBulkListSerializer(serializers.ListSerializer):
+
+    @staticmethod
+    def get_instance_ids(data) -> List[int]:
+        """Ids of the lessons a PATCH body changes, checked before they are used in a query."""
+        if not isinstance(data, list):
+            raise serializers.ValidationError('Ожидается список уроков')
+        ids = []
+        for item in data:
+            if not isinstance(item, dict) or 'id' not in item:
+                continue
+            try:
+                ids.append(serializers.IntegerField().run_validation(item['id']))
+            except serializers.ValidationError:
+                raise serializers.ValidationError(f'Некорректный id урока "{item["id"]}"')
+        return ids
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            names = {str(item['course']) for item in data if isinstance(item, dict) and 'course' in item}
+            self.child.fields['course'].preload(Course.objects.filter(course_name__in=names))
+        return super().to_internal_value(data)
+
+    def validate(self, attrs):
+        instances = {lesson.pk: lesson for lesson in self.instance or []}
+        pairs = []
+        for item in attrs:
+            if self.instance is not None and item.get('id') not in instances:
+                raise serializers.ValidationError(f'Урок {item.get("id")} не найден')
+            lesson = instances.get(item.get('id'))
+            pairs.append((
+                item.get('lesson_name', getattr(lesson, 'lesson_name', None)),
+                item.get('lesson_description', getattr(lesson, 'lesson_description', None)),
+            ))
+
+        hashes = [make_content_hash(name, description) for name, description in pairs]
+        if len(set(hashes)) != len(hashes):
+            raise serializers.ValidationError('Уроки в запросе повторяются')
+        if Lesson.objects.filter(content_hash__in=hashes).exclude(pk__in=instances).exists():
+            raise serializers.ValidationError('Урок с таким названием и описанием уже существует')
+        return attrs
+
+    def create(self, validated_data):
+        lessons = [Lesson(**{key: value for key, value in attrs.items() if key != 'id'}) for attrs in validated_data]
+        for lesson in lessons:
+            lesson.refresh_content_hash()
+        return Lesson.objects.bulk_create(lessons)
+
+    def update(self, instance, validated_data):
+        instances = {lesson.pk: lesson for lesson in instance}
+        updated_fields = {'updated_at', 'content_hash'}
+        now = timezone.now()
+        for attrs in validated_data:
+            lesson = instances[attrs.pop('id')]
+            for field, value in attrs.items():
+                setattr(lesson, field, value)
+                updated_fields.add(field)
+            lesson.updated_at = now
+            lesson.refresh_content_hash()
+        Lesson.objects.bulk_update(instance, updated_fields)
+        return instance
+
+
+class LessonBulkSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
+    course = PreloadedSlugRelatedField(slug_field='course_name', queryset=Course.objects.all())
+    lesson_preview_thumbnails = ThumbnailsField()
+
+    class Meta:
+        model = Lesson
+        exclude = ['content_hash', 'search_vector']
+        read_only_fields = ['owner']
+        list_serializer_class = LessonBulkListSerializer
+        validators = [
+            LinksValidator(fields=['lesson_name', 'lesson_description', 'video_url']),
         ]
 
 
 class LessonListSerializer(serializers.ModelSerializer):
+    lesson_preview_thumbnails = ThumbnailsField()
+
     class Meta:
         model = Lesson
-        fields = ['id', 'name', 'description', 'preview', 'video_url']
+        fields = ['id', 'lesson_name', 'lesson_description', 'lesson_preview', 'lesson_preview_thumbnails', 'video_url']
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     course = SlugRelatedField(slug_field='course_name', queryset=Course.objects.all())
     lesson = SlugRelatedField(slug_field='lesson_name', queryset=Lesson.objects.all())
     user = SlugRelatedField(slug_field='first_name', queryset=User.objects.all())
@@ -67,3 +213,44 @@ class SubscriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscription
         fields = '__all__'
+        validators = [
+            serializers.UniqueTogetherValidator(fields=['user', 'course'], queryset=Subscription.objects.all())
+        ]
+
+
+class SubscriptionActionSerializer(serializers.Serializer):
+    course = serializers.PrimaryKeyRelatedField(queryset=Course.objects.all())
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    type = serializers.ChoiceField(choices=['course', 'lesson'], required=False)
+
+
+class SearchResultSerializer(serializers.Serializer):
+    kind = serializers.CharField()
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    description = serializers.CharField()
+    course = serializers.IntegerField(source='lesson_course', allow_null=True)
+    rank = serializers.FloatField()
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    is_complete = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'size', 'offset', 'is_complete', 'created_at', 'updated_at']
+        read_only_fields = ['offset']
+
+    def validate_size(self, size):
+        max_size = settings.CHUNKED_UPLOAD_MAX_SIZE
+        if not 0 < size <= max_size:
+            raise serializers.ValidationError(f'Размер файла должен быть от 1 до {max_size} байт')
+        return size
+
+
+class UploadAttachSerializer(serializers.Serializer):
+    target = serializers.ChoiceField(choices=['course', 'lesson', 'user'])
+    id = serializers.IntegerField()
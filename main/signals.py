@@ -0,0 +1,91 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from main.caching import bump_version, invalidate_subscribed_course_ids
+from main.models import Course, Lesson, Payment, Subscription
+from main.paginators import table_count_key
+from main.search import index_objects, unindex_objects
+from main.thumbnails import needs_thumbnails
+from users.models import User
+
+
+def invalidate_bulk_changes(model) -> None:
+    # bulk_create/bulk_update do not send post_save, callers invalidate explicitly
+    cache.delete(table_count_key(model))
+    bump_version(model)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=Payment)
+def invalidate_table_count_on_create(sender, instance, created, **kwargs):
+    if created:
+        cache.delete(table_count_key(sender))
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=Payment)
+def invalidate_table_count_on_delete(sender, instance, **kwargs):
+    cache.delete(table_count_key(sender))
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=Subscription)
+def invalidate_response_cache(sender, instance, **kwargs):
+    bump_version(sender)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_cached_subscriptions(sender, instance, **kwargs):
+    invalidate_subscribed_course_ids(instance.user_id)
+
+
+@receiver(post_save, sender=Course)
+def schedule_stripe_sync(sender, instance, **kwargs):
+    # main.tasks imports modules that import this one
+    from main.tasks import sync_course_with_stripe
+
+    if not instance.differs_from_stripe():
+        return
+    transaction.on_commit(lambda: sync_course_with_stripe.delay(instance.pk))
+
+
+THUMBNAIL_SOURCES = {
+    Course: ('course_preview',),
+    Lesson: ('lesson_preview',),
+    User: ('avatar',),
+}
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=User)
+def schedule_thumbnails(sender, instance, **kwargs):
+    from main.tasks import generate_thumbnails
+
+    for field_name in THUMBNAIL_SOURCES[sender]:
+        if needs_thumbnails(instance, field_name):
+            transaction.on_commit(
+                lambda field_name=field_name: generate_thumbnails.delay(sender._meta.label, instance.pk, field_name)
+            )
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Lesson)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or set(instance.content_fields).intersection(update_fields):
+        index_objects(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Lesson)
+def remove_from_search_index(sender, instance, **kwargs):
+    unindex_objects(sender, [instance.pk])
@@ -0,0 +1,64 @@
+import logging
+
+from django.conf import settings
+from django.db.models import F, Q, QuerySet
+
+from main.models import Course
+from main.stripe_client import BaseStripeClient, StripeError, get_stripe_client
+
+logger = logging.getLogger(__name__)
+
+
+def get_stale_courses() -> QuerySet:
+    return Course.objects.filter(
+        Q(stripe_price_id__isnull=True) | Q(stripe_synced_at__isnull=True) | Q(stripe_synced_at__lt=F('updated_at'))
+    )
+
+
+def sync_course(course: Course, client: BaseStripeClient = None) -> bool:
+    """
+    Creates or updates the Stripe product of the course and creates a new price when the cost changed
+    (Stripe prices are immutable, the previous one is archived). Returns False if the course was already current.
+    """
+    if course.has_current_stripe_price():
+        return False
+    client = client or get_stripe_client()
+
+    if course.stripe_product_id:
+        product_id = client.update_product(course.stripe_product_id, {'name': course.course_name})['id']
+    else:
+        product_id = client.create_product({'name': course.course_name, 'metadata': {'course_id': course.pk}})['id']
+
+    price_id = course.stripe_price_id
+    if price_id is None or product_id != course.stripe_product_id or course.stripe_unit_amount != course.unit_amount:
+        price_id = client.create_price({
+            'product': product_id,
+            'unit_amount': course.unit_amount,
+            'currency': settings.STRIPE_CURRENCY,
+        })['id']
+        if course.stripe_price_id:
+            client.update_price(course.stripe_price_id, {'active': False})
+
+    # update() instead of save(): it doesn't touch updated_at, which the price is compared against
+    synced = {
+        'stripe_product_id': product_id,
+        'stripe_price_id': price_id,
+        'stripe_unit_amount': course.unit_amount,
+        'stripe_product_name': course.course_name,
+        'stripe_synced_at': course.updated_at,
+    }
+    Course.objects.filter(pk=course.pk).update(**synced)
+    for field, value in synced.items():
+        setattr(course, field, value)
+    return True
+
+
+def sync_catalog(courses: QuerySet = None, client: BaseStripeClient = None) -> int:
+    client = client or get_stripe_client()
+    synced = 0
+    for course in (get_stale_courses() if courses is None else courses).iterator():
+        try:
+            synced += sync_course(course, client)
+        except StripeError as error:
+            logger.error(f'Не удалось синхронизировать курс {course.pk} со Stripe: {error}')
+    return synced
@@ -0,0 +1,204 @@
+import asyncio
+import weakref
+from functools import cached_property, lru_cache
+from typing import Dict, Iterator, List, Tuple
+from urllib.parse import urlencode
+
+import httpx
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class StripeError(Exception):
+    pass
+
+
+def encode_params(params, prefix: str = '') -> List[Tuple[str, str]]:
+    # Stripe takes nested form fields: line_items[0][price_data][currency]=usd
+    if isinstance(params, bool):
+        return [(prefix, 'true' if params else 'false')]
+    if isinstance(params, dict):
+        items = params.items()
+    elif isinstance(params, (list, tuple)):
+        items = enumerate(params)
+    else:
+        return [(prefix, str(params))]
+    pairs = []
+    for key, value in items:
+        pairs.extend(encode_params(value, f'{prefix}[{key}]' if prefix else str(key)))
+    return pairs
+
+
+def build_line_item(course) -> Dict:
+    # the synced catalog price, inline price_data only until main.stripe_catalog catches up with the course
+    if course.has_current_stripe_price():
+        return {'price': course.stripe_price_id, 'quantity': 1}
+    return {
+        'price_data': {
+            'currency': settings.STRIPE_CURRENCY,
+            'unit_amount': course.unit_amount,
+            'product_data': {
+                'name': course.course_name
+            },
+        },
+        'quantity': 1,
+    }
+
+
+def build_checkout_session_params(course, user=None) -> Dict:
+    params = {
+        'payment_method_types': ['card'],
+        'line_items': [build_line_item(course)],
+        'metadata': {
+            'product_id': course.pk
+        },
+        'mode': 'payment',
+        'success_url': settings.CHECKOUT_DOMAIN + '/success/',
+        'cancel_url': settings.CHECKOUT_DOMAIN + '/cancel/',
+    }
+    # lets the webhook attach the payment to the user, see main.stripe_webhooks
+    if user is not None and user.is_authenticated:
+        params['client_reference_id'] = str(user.pk)
+    return params
+
+
+class BaseStripeClient:
+    """Stripe calls the project makes, settings.STRIPE_CLIENT selects the implementation."""
+
+    def create_checkout_session(self, params: Dict) -> Dict:
+        raise NotImplementedError
+
+    async def acreate_checkout_session(self, params: Dict) -> Dict:
+        raise NotImplementedError
+
+    def create_product(self, params: Dict) -> Dict:
+        raise NotImplementedError
+
+    def update_product(self, product_id: str, params: Dict) -> Dict:
+        raise NotImplementedError
+
+    def create_price(self, params: Dict) -> Dict:
+        raise NotImplementedError
+
+    def update_price(self, price_id: str, params: Dict) -> Dict:
+        raise NotImplementedError
+
+    def list_checkout_sessions(self, params: Dict) -> Iterator[Dict]:
+        """All sessions matching params, following has_more/starting_after page by page."""
+        raise NotImplementedError
+
+
+class HttpxStripeClient(BaseStripeClient):
+    """
+    Stripe REST API over pooled keep-alive connections with timeouts.
+    The async client and its concurrency limiter are kept per event loop,
+    an httpx.AsyncClient can't be shared between loops.
+    """
+
+    def __init__(self, api_base=None, api_key=None, timeout=None, max_connections=None, max_concurrency=None):
+        self.api_base = api_base or settings.STRIPE_API_BASE
+        self.api_key = api_key or settings.STRIPE_SECRET_KEY or ''
+        self.timeout = httpx.Timeout(timeout or settings.STRIPE_TIMEOUT, connect=settings.STRIPE_CONNECT_TIMEOUT)
+        self.limits = httpx.Limits(
+            max_connections=max_connections or settings.STRIPE_MAX_CONNECTIONS,
+            max_keepalive_connections=max_connections or settings.STRIPE_MAX_CONNECTIONS,
+        )
+        self.max_concurrency = max_concurrency or settings.STRIPE_MAX_CONCURRENCY
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    def get_client_options(self) -> Dict:
+        return {
+            'base_url': self.api_base,
+            'auth': (self.api_key, ''),
+            'timeout': self.timeout,
+            'limits': self.limits,
+        }
+
+    @cached_property
+    def client(self) -> httpx.Client:
+        return httpx.Client(**self.get_client_options())
+
+    def get_async_client(self) -> Tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        if loop not in self.async_clients:
+            self.async_clients[loop] = (
+                httpx.AsyncClient(**self.get_client_options()),
+                asyncio.Semaphore(self.max_concurrency),
+            )
+        return self.async_clients[loop]
+
+    @staticmethod
+    def build_request_options(params: Dict) -> Dict:
+        return {
+            'content': urlencode(encode_params(params)),
+            'headers': {'Content-Type': 'application/x-www-form-urlencoded'},
+        }
+
+    @staticmethod
+    def handle_response(response: httpx.Response) -> Dict:
+        if response.is_error:
+            try:
+                message = response.json()['error']['message']
+            except (ValueError, KeyError, TypeError):
+                message = response.text
+            raise StripeError(f'Stripe вернул {response.status_code}: {message}')
+        return response.json()
+
+    def request(self, path: str, params: Dict, method: str = 'POST') -> Dict:
+        try:
+            if method == 'GET':
+                response = self.client.get(path, params=encode_params(params))
+            else:
+                response = self.client.post(path, **self.build_request_options(params))
+        except httpx.HTTPError as error:
+            raise StripeError(f'Stripe недоступен: {error!r}')
+        return self.handle_response(response)
+
+    async def arequest(self, path: str, params: Dict) -> Dict:
+        client, limiter = self.get_async_client()
+        try:
+            async with limiter:
+                response = await client.post(path, **self.build_request_options(params))
+        except httpx.HTTPError as error:
+            raise StripeError(f'Stripe недоступен: {error!r}')
+        return self.handle_response(response)
+
+    def create_checkout_session(self, params: Dict) -> Dict:
+        return self.request('/v1/checkout/sessions', params)
+
+    async def acreate_checkout_session(self, params: Dict) -> Dict:
+        return await self.arequest('/v1/checkout/sessions', params)
+
+    def create_product(self, params: Dict) -> Dict:
+        return self.request('/v1/products', params)
+
+    def update_product(self, product_id: str, params: Dict) -> Dict:
+        return self.request(f'/v1/products/{product_id}', params)
+
+    def create_price(self, params: Dict) -> Dict:
+        return self.request('/v1/prices', params)
+
+    def update_price(self, price_id: str, params: Dict) -> Dict:
+        return self.request(f'/v1/prices/{price_id}', params)
+
+    def list_checkout_sessions(self, params: Dict) -> Iterator[Dict]:
+        params = {'limit': settings.STRIPE_PAGE_SIZE, **params}
+        while True:
+            page = self.request('/v1/checkout/sessions', params, method='GET')
+            yield from page['data']
+            if not page['has_more'] or not page['data']:
+                return
+            params = {**params, 'starting_after': page['data'][-1]['id']}
+
+
+@lru_cache(maxsize=None)
+def get_stripe_client() -> BaseStripeClient:
+    return import_string(settings.STRIPE_CLIENT)()
+
+
+@receiver(setting_changed)
+def reset_stripe_client(*, setting, **kwargs):
+    if setting.startswith('STRIPE_') or setting == 'CHECKOUT_DOMAIN':
+        get_stripe_client.cache_clear()
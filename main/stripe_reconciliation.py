@@ -0,0 +1,93 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from main.models import Payment, PaymentDiscrepancy, ReconciliationRun
+from main.stripe_client import BaseStripeClient, get_stripe_client
+
+logger = logging.getLogger(__name__)
+
+
+def iter_slices(start: datetime, end: datetime, step: timedelta) -> Iterator[Tuple[datetime, datetime]]:
+    while start < end:
+        yield start, min(start + step, end)
+        start += step
+
+
+class Reconciler:
+    """
+    Compares paid Stripe checkout sessions with Payment rows for a time window, amounts in the smallest
+    currency unit.
+    The window is walked in slices: per slice the payments are loaded into a map keyed on the session id,
+    the Stripe sessions are paged through and matched against it, so memory is bounded by one slice
+    no matter how long the window is. Discrepancies are written in batches.
+    """
+
+    def __init__(self, client: Optional[BaseStripeClient] = None, slice_size: Optional[timedelta] = None):
+        self.client = client or get_stripe_client()
+        self.slice_size = slice_size or settings.STRIPE_RECONCILIATION_SLICE
+        self.pending: List[PaymentDiscrepancy] = []
+
+    def add(self, run: ReconciliationRun, kind: str, session_id: str, **fields) -> None:
+        self.pending.append(PaymentDiscrepancy(run=run, kind=kind, stripe_session_id=session_id, **fields))
+        run.discrepancies_count += 1
+        if len(self.pending) >= settings.STRIPE_RECONCILIATION_BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        PaymentDiscrepancy.objects.bulk_create(self.pending)
+        self.pending = []
+
+    def load_payments(self, start: datetime, end: datetime) -> Dict[str, Tuple[int, int]]:
+        # amounts are compared in Stripe's smallest currency unit
+        return {
+            session_id: (pk, int(amount * 100))
+            for session_id, pk, amount in Payment.objects.filter(
+                date__gte=start, date__lt=end, stripe_session_id__isnull=False,
+            ).values_list('stripe_session_id', 'pk', 'amount').iterator()
+        }
+
+    def reconcile_slice(self, run: ReconciliationRun, start: datetime, end: datetime) -> None:
+        payments = self.load_payments(start, end)
+        run.payments_checked += len(payments)
+
+        sessions = self.client.list_checkout_sessions({
+            'created': {'gte': int(start.timestamp()), 'lt': int(end.timestamp())},
+        })
+        for session in sessions:
+            if session.get('payment_status') != 'paid':
+                continue
+            run.sessions_checked += 1
+            stripe_amount = int(session['amount_total'])
+            payment = payments.pop(session['id'], None)
+            if payment is None:
+                self.add(run, PaymentDiscrepancy.MISSING_PAYMENT, session['id'], stripe_amount=stripe_amount)
+            elif payment[1] != stripe_amount:
+                self.add(run, PaymentDiscrepancy.AMOUNT_MISMATCH, session['id'], payment_id=payment[0],
+                         stripe_amount=stripe_amount, payment_amount=payment[1])
+
+        # whatever is left in the map was never charged by Stripe
+        for session_id, (pk, amount) in payments.items():
+            self.add(run, PaymentDiscrepancy.MISSING_SESSION, session_id, payment_id=pk, payment_amount=amount)
+
+    def run(self, start: datetime, end: datetime) -> ReconciliationRun:
+        # Stripe filters on whole seconds, keep slice bounds on the same grid as the payment dates
+        start, end = start.replace(microsecond=0), end.replace(microsecond=0)
+        run = ReconciliationRun.objects.create(window_start=start, window_end=end)
+        for slice_start, slice_end in iter_slices(start, end, self.slice_size):
+            self.reconcile_slice(run, slice_start, slice_end)
+        self.flush()
+        run.finished_at = timezone.now()
+        run.save()
+        logger.info(f'{run}: сессий {run.sessions_checked}, платежей {run.payments_checked}, '
+                    f'расхождений {run.discrepancies_count}')
+        return run
+
+
+def get_default_window() -> Tuple[datetime, datetime]:
+    # the most recent events may still be in the webhook inbox, leave them to the next run
+    end = timezone.now() - settings.STRIPE_RECONCILIATION_DELAY
+    return end - settings.STRIPE_RECONCILIATION_WINDOW, end
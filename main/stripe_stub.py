@@ -0,0 +1,128 @@
+import hashlib
+import hmac
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# resource path -> (id prefix, object name)
+RESOURCES = {
+    'checkout/sessions': ('cs_test', 'checkout.session'),
+    'products': ('prod_test', 'product'),
+    'prices': ('price_test', 'price'),
+}
+
+
+def sign_payload(payload: str, secret: str, timestamp: int = None) -> str:
+    """Stripe-Signature header for a locally built webhook event."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+class StubStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        self.respond(self.path, dict(parse_qsl(body)), self.server.handle)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self.respond(url.path, dict(parse_qsl(url.query)), self.server.handle_list)
+
+    def respond(self, path, params, handler):
+        server = self.server
+        with server.lock:
+            server.requests.append({'path': path, 'method': self.command, 'params': params})
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        time.sleep(server.latency)
+        with server.lock:
+            server.active -= 1
+            status, payload = handler(path, params)
+
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubStripeServer(ThreadingHTTPServer):
+    """
+    Local stand-in for api.stripe.com: POST /v1/<resource> creates an object,
+    POST /v1/<resource>/<id> updates it and GET /v1/<resource> lists objects newest first
+    with created[gte]/created[lt], limit and starting_after. Every call answers after `latency` seconds.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency: float = 0):
+        super().__init__(('127.0.0.1', 0), StubStripeHandler)
+        self.latency = latency
+        self.requests = []
+        self.objects = {resource: {} for resource in RESOURCES}
+        self.ids = itertools.count(1)
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def handle(self, path, params):
+        path = path.removeprefix('/v1/')
+        resource = next((resource for resource in RESOURCES if path.startswith(resource)), None)
+        if resource is None:
+            return 404, {'error': {'message': f'Unrecognized request URL (/v1/{path})'}}
+
+        objects = self.objects[resource]
+        object_id = path.removeprefix(resource).strip('/')
+        if not object_id:
+            prefix, name = RESOURCES[resource]
+            object_id = f'{prefix}_{next(self.ids)}'
+            objects[object_id] = {'id': object_id, 'object': name}
+        elif object_id not in objects:
+            return 404, {'error': {'message': f'No such {resource}: {object_id}'}}
+        objects[object_id].update(params)
+        return 200, objects[object_id]
+
+    def handle_list(self, path, params):
+        resource = path.removeprefix('/v1/').strip('/')
+        if resource not in RESOURCES:
+            return 404, {'error': {'message': f'Unrecognized request URL ({path})'}}
+
+        objects = sorted(self.objects[resource].values(), key=lambda obj: (obj.get('created', 0), obj['id']),
+                         reverse=True)
+        if 'created[gte]' in params:
+            objects = [obj for obj in objects if obj.get('created', 0) >= int(params['created[gte]'])]
+        if 'created[lt]' in params:
+            objects = [obj for obj in objects if obj.get('created', 0) < int(params['created[lt]'])]
+        if 'starting_after' in params:
+            ids = [obj['id'] for obj in objects]
+            objects = objects[ids.index(params['starting_after']) + 1:]
+        limit = int(params.get('limit', 10))
+        return 200, {'object': 'list', 'data': objects[:limit], 'has_more': len(objects) > limit}
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+            self.ids = itertools.count(1)
+            for objects in self.objects.values():
+                objects.clear()
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,148 @@
+import json
+import logging
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import Course, Payment, StripeEvent
+from main.signals import invalidate_bulk_changes
+from main.stripe_client import StripeError
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookNotConfigured(StripeError):
+    pass
+
+
+def verify_event(payload: bytes, signature: Optional[str]) -> Dict:
+    # an empty secret would make any payload signed with an empty key pass verification
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        raise WebhookNotConfigured('STRIPE_WEBHOOK_SECRET не задан, события Stripe не принимаются')
+    try:
+        payload = payload.decode()
+        stripe.WebhookSignature.verify_header(
+            payload, signature or '', settings.STRIPE_WEBHOOK_SECRET, settings.STRIPE_WEBHOOK_TOLERANCE
+        )
+        event = json.loads(payload)
+    except (stripe.error.SignatureVerificationError, UnicodeDecodeError, ValueError) as error:
+        raise StripeError(f'Некорректное событие Stripe: {error}')
+    if not isinstance(event, dict) or 'id' not in event or 'type' not in event:
+        raise StripeError('Некорректное событие Stripe: нет id или type')
+    return event
+
+
+def store_event(event: Dict) -> None:
+    # redelivered events hit the unique event_id and are dropped here
+    StripeEvent.objects.bulk_create(
+        [StripeEvent(event_id=event['id'], type=event['type'], payload=event)],
+        ignore_conflicts=True,
+    )
+
+
+class EventError(Exception):
+    pass
+
+
+def get_session(event: StripeEvent) -> Dict:
+    try:
+        session = event.payload['data']['object']
+    except (KeyError, TypeError):
+        return {}
+    return session if isinstance(session, dict) else {}
+
+
+class CheckoutPaymentBuilder:
+    """Turns checkout.session.completed events into Payment rows, references are loaded once per batch."""
+
+    def __init__(self, events: List[StripeEvent]):
+        sessions = [get_session(event) for event in events if event.type == 'checkout.session.completed']
+        course_ids = {str((session.get('metadata') or {}).get('product_id')) for session in sessions}
+        self.courses = {
+            str(pk): pk for pk in Course.objects.filter(pk__in=[pk for pk in course_ids if pk.isdigit()])
+            .values_list('pk', flat=True)
+        }
+        user_ids = {str(session.get('client_reference_id')) for session in sessions}
+        self.users = {
+            str(pk): pk for pk in User.objects.filter(pk__in=[pk for pk in user_ids if pk.isdigit()])
+            .values_list('pk', flat=True)
+        }
+        emails = {(session.get('customer_details') or {}).get('email') for session in sessions}
+        self.users_by_email = dict(User.objects.filter(email__in=emails - {None}).values_list('email', 'pk'))
+
+    def build(self, event: StripeEvent) -> Payment:
+        session = get_session(event)
+        try:
+            session_id = session['id']
+            amount = session['amount_total']
+            created = session['created']
+        except KeyError as error:
+            raise EventError(f'В событии нет поля {error}')
+        if not isinstance(amount, int) or not isinstance(created, int):
+            raise EventError(f'Некорректная сумма или дата в сессии {session_id}')
+        if session.get('payment_status') not in (None, 'paid'):
+            raise EventError(f'Сессия {session_id} не оплачена')
+
+        user_id = self.users.get(str(session.get('client_reference_id'))) \
+            or self.users_by_email.get((session.get('customer_details') or {}).get('email'))
+        return Payment(
+            stripe_session_id=session_id,
+            date=datetime.fromtimestamp(created, tz=dt_timezone.utc),
+            # Stripe amounts are in the smallest currency unit, Payment.amount has two decimal places
+            amount=Decimal(amount).scaleb(-2),
+            method='STRIPE',
+            user_id=user_id,
+            owner_id=user_id,
+            course_id=self.courses.get(str((session.get('metadata') or {}).get('product_id'))),
+        )
+
+
+def process_batch(batch_size: int) -> int:
+    with transaction.atomic():
+        # skip_locked lets several consumers drain the inbox side by side on PostgreSQL
+        events = list(
+            StripeEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True).order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        builder = CheckoutPaymentBuilder(events)
+        payments: List[Payment] = []
+        failed: List[Tuple[int, str]] = []
+        for event in events:
+            if event.type != 'checkout.session.completed':
+                continue
+            try:
+                payments.append(builder.build(event))
+            except EventError as error:
+                failed.append((event.pk, str(error)))
+
+        # ignore_conflicts on the unique stripe_session_id keeps replays from creating a second payment
+        Payment.objects.bulk_create(payments, ignore_conflicts=True)
+        StripeEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=timezone.now())
+        for pk, error in failed:
+            logger.error(f'Событие Stripe {pk} не обработано: {error}')
+            StripeEvent.objects.filter(pk=pk).update(error=error)
+    if payments:
+        invalidate_bulk_changes(Payment)
+    return len(events)
+
+
+def drain_events(batch_size: Optional[int] = None, max_batches: Optional[int] = None) -> Tuple[int, bool]:
+    """Processes pending events batch by batch, returns how many and whether some were left for the next run."""
+    batch_size = batch_size or settings.STRIPE_EVENTS_BATCH_SIZE
+    max_batches = max_batches or settings.STRIPE_EVENTS_MAX_BATCHES
+    processed = 0
+    for _ in range(max_batches):
+        count = process_batch(batch_size)
+        processed += count
+        if count < batch_size:
+            return processed, False
+    return processed, StripeEvent.objects.filter(processed_at__isnull=True).exists()
@@ -1,53 +1,146 @@
 import logging
+from typing import Iterable, Iterator, List
 
-from celery import shared_task
+from celery import Task, shared_task
+from django.apps import apps
 from django.conf import settings
-from django.core.mail import send_mail
-from django.utils import timezone
+from django.core.cache import cache
+from django.core.mail import get_connection, send_mass_mail
 
-from .models import Course, Lesson
+from .caching import append_to_list, bump_version, pop_list
+from .models import Course, Subscription
+from .stripe_catalog import sync_catalog, sync_course
+from .stripe_client import StripeError
+from .stripe_reconciliation import Reconciler, get_default_window
+from .stripe_webhooks import drain_events
+from .thumbnails import update_thumbnails
+from .uploads import delete_stale_uploads
+from users.authentication import user_cache_key
+from users.models import User
 
 logger = logging.getLogger(__name__)
 
 
-def was_updated_recently(last_update: timezone.datetime) -> bool:
-    now = timezone.now()
-    lag = now - last_update
-    logger.info(f'Курс был обновлен {lag} сек назад')
-    return lag.total_seconds() < 60
+def chunked(iterable: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def fan_out_notifications(course_id: int, subject: str, message: str) -> None:
+    emails = Subscription.objects.filter(
+        course_id=course_id,
+        is_subscribed=True,
+    ).values_list('user__email', flat=True).iterator(chunk_size=settings.NOTIFICATION_CHUNK_SIZE)
+    for recipients in chunked(emails, settings.NOTIFICATION_CHUNK_SIZE):
+        send_notification_chunk.delay(subject, message, recipients)
 
 
 @shared_task
-def send_course_update_notifications(course_id: int) -> None:
+def send_notification_chunk(subject: str, message: str, recipients: List[str]) -> None:
+    logger.info(f'Отправка {len(recipients)} писем: {subject}')
+    messages = ((subject, message, settings.EMAIL_HOST_USER, [email]) for email in recipients)
+    try:
+        send_mass_mail(messages, connection=get_connection())
+    except Exception as error:
+        logger.error(f'Ошибка отправки писем: {error}')
+
+
+def pending_changes_key(course_id: int) -> str:
+    return f'course_update_notifications:{course_id}'
+
+
+def notification_scheduled_key(course_id: int) -> str:
+    return f'course_update_notifications:{course_id}:scheduled'
+
+
+def schedule_update_notification(course_id: int, change: str) -> None:
+    window = settings.NOTIFICATION_COALESCE_WINDOW
+    append_to_list(pending_changes_key(course_id), change, timeout=window * 2)
+    if cache.add(notification_scheduled_key(course_id), True, timeout=window * 2):
+        send_coalesced_update_notifications.apply_async((course_id,), countdown=window)
+
+
+@shared_task
+def send_coalesced_update_notifications(course_id: int) -> None:
+    # the marker goes first: a change appended after it is either taken below or schedules the next run
+    cache.delete(notification_scheduled_key(course_id))
+    changes = list(dict.fromkeys(pop_list(pending_changes_key(course_id))))
+    course = Course.get_by_id(course_id)
+    if course is not None and changes:
+        logger.info(f'Отправка {len(changes)} изменений курса {course_id}')
+        fan_out_notifications(
+            course.id,
+            subject='Обновление курса',
+            message='\n'.join([f'Курс "{course.course_name}" был обновлен:'] + [f'- {change}' for change in changes]),
+        )
+
+
+class StripeSyncTask(Task):
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        # called once the retries are used up
+        logger.error(f'Не удалось синхронизировать курс {args[0]} со Stripe: {exc}')
+
+
+@shared_task(base=StripeSyncTask, autoretry_for=(StripeError,), retry_backoff=True,
+             retry_kwargs={'max_retries': settings.STRIPE_SYNC_MAX_RETRIES})
+def sync_course_with_stripe(course_id: int) -> None:
     course = Course.get_by_id(course_id)
     if course is not None:
-        subscribers = course.subscriptions.filter(subscribed=True)
-        for subscription in subscribers:
-            try:
-                logger.info(f'Отправка письма для {subscribers}')
-                send_mail(
-                    subject='Обновление курса',
-                    message=f'Курс "{course.course_name}" был обновлен.',
-                    from_email=settings.EMAIL_HOST_USER,
-                    recipient_list=[subscription.user.email],
-                )
-            except Exception as error:
-                logger.error(f'Ошибка отправки письма: {error}')
+        sync_course(course)
+
+
+@shared_task
+def sync_stripe_catalog() -> int:
+    synced = sync_catalog()
+    logger.info(f'Синхронизировано со Stripe курсов: {synced}')
+    return synced
+
+
+STRIPE_EVENTS_DRAIN_KEY = 'stripe_events:drain_scheduled'
+
+
+def schedule_stripe_events_drain() -> None:
+    # one pending drain at a time, a burst of webhooks is picked up by the same run
+    if cache.add(STRIPE_EVENTS_DRAIN_KEY, True, timeout=settings.STRIPE_EVENTS_DRAIN_DELAY * 10):
+        process_stripe_events.apply_async(countdown=settings.STRIPE_EVENTS_DRAIN_DELAY)
+
+
+@shared_task
+def process_stripe_events() -> int:
+    cache.delete(STRIPE_EVENTS_DRAIN_KEY)
+    processed, has_more = drain_events()
+    logger.info(f'Обработано событий Stripe: {processed}')
+    if has_more:
+        schedule_stripe_events_drain()
+    return processed
+
+
+@shared_task
+def reconcile_stripe_payments() -> int:
+    run = Reconciler().run(*get_default_window())
+    return run.pk
+
+
+@shared_task
+def generate_thumbnails(model_label: str, pk: int, field_name: str) -> None:
+    model = apps.get_model(model_label)
+    if update_thumbnails(model, pk, field_name):
+        # cached list/retrieve responses carry the thumbnail urls
+        bump_version(model)
+        if model is User:
+            # update() sends no post_save, so users.signals doesn't drop the authenticated user
+            cache.delete(user_cache_key(pk))
 
 
 @shared_task
-def send_lesson_update_notifications(lesson_id: int) -> None:
-    lesson = Lesson.get_by_id(lesson_id)
-    if lesson is not None:
-        subscribers = lesson.course.subscriptions.filter(subscribed=True)
-        for subscription in subscribers:
-            try:
-                logger.info(f'Отправка письма для {subscribers}')
-                send_mail(
-                    subject='Обновление урока',
-                    message=f'Урок "{lesson.lesson_name}" был обновлен.',
-                    from_email=settings.EMAIL_HOST_USER,
-                    recipient_list=[subscription.user.email],
-                )
-            except Exception as error:
-                logger.error(f'Ошибка отправки письма: {error}')
+def delete_stale_upload_sessions() -> int:
+    deleted = delete_stale_uploads()
+    logger.info(f'Удалено незавершенных загрузок: {deleted}')
+    return deleted
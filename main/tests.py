@@ -1,9 +1,57 @@
+import asyncio
+import io
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+import json
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from PIL import Image
+
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import UnreadablePostError
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_init
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
 from rest_framework.reverse import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
 from rest_framework_simplejwt.tokens import AccessToken
-from main.models import Lesson, Course, Subscription
-from users.models import User
+from config.celery import app as celery_app
+from main.fast_lists import RowMapper
+from main.caching import append_to_list, get_redis_client, get_response_cache_stats, get_subscribed_course_ids, \
+    get_subscriptions_version, pop_list, subscriptions_key
+from main.importers import PaymentImporter, iter_rows
+from main.models import Lesson, Course, Payment, PaymentDiscrepancy, StripeEvent, Subscription, UploadSession, \
+    make_content_hash
+from main.permissions import IsCourseOrLessonOwner
+from main.paginators import table_count_key
+from main.stripe_catalog import sync_catalog, sync_course
+from main.stripe_reconciliation import Reconciler
+from main.stripe_client import BaseStripeClient, HttpxStripeClient, StripeError, encode_params, get_stripe_client
+from main.stripe_stub import StubStripeServer, sign_payload
+from main.stripe_webhooks import drain_events
+from main.thumbnails import render
+from main.uploads import OffsetConflict, append_chunk, delete_stale_uploads, part_path
+from main.search import SearchResults
+from main.serializers import CourseSerializer, LessonSerializer
+from main.validators import LinksValidator
+from main.views import LessonListAPIView, PaymentListAPIView
+from main.tasks import fan_out_notifications, schedule_update_notification, send_coalesced_update_notifications, \
+    reconcile_stripe_payments, generate_thumbnails, sync_course_with_stripe
+from users.authentication import CachedJWTAuthentication, user_cache_key
+from users.models import User, UserRoles
 
 
 class LessonTestCase(APITestCase):
@@ -242,3 +290,1933 @@ class SubscriptionTestCase(APITestCase):
                 "course": self.course.pk
             }
         )
+
+
+class CourseListQueryCountTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.com', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        # both measurements run with the user already in the auth cache
+        CachedJWTAuthentication().get_user(AccessToken.for_user(self.user))
+
+    def create_courses(self, count):
+        existing = Course.objects.count()
+        for index in range(existing, existing + count):
+            course = Course.objects.create(
+                course_name=f'Course {index}',
+                course_description=f'Description {index}',
+                owner=self.user,
+            )
+            Lesson.objects.create(course=course, lesson_name=f'Lesson {course.pk}', lesson_description='Text',
+                                  owner=self.user)
+            # the cached subscription set is invalidated on commit
+            with self.captureOnCommitCallbacks(execute=True):
+                Subscription.objects.create(user=self.user, course=course, is_subscribed=bool(index % 2))
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse('courses:courses-list'),
+                {'per_page': 200},
+                HTTP_AUTHORIZATION=self.token
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), response.json()
+
+    def test_course_list_query_count_is_constant(self):
+        self.create_courses(2)
+        small_page_queries, _ = self.count_list_queries()
+
+        self.create_courses(48)
+        large_page_queries, data = self.count_list_queries()
+
+        self.assertEqual(small_page_queries, large_page_queries)
+        self.assertEqual(data['count'], 50)
+        self.assertEqual(data['results'][0]['lessons_count'], 1)
+        self.assertEqual(len(data['results'][0]['lessons']), 1)
+        self.assertEqual(data['results'][0]['is_subscribed'], False)
+        self.assertEqual(data['results'][1]['is_subscribed'], True)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', NOTIFICATION_CHUNK_SIZE=2)
+class CourseUpdateNotificationTestCase(APITestCase):
+    def setUp(self):
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription')
+        for index in range(5):
+            user = User.objects.create(email=f'subscriber{index}@test.com', password='subscriber')
+            Subscription.objects.create(user=user, course=self.course, is_subscribed=True)
+        unsubscribed = User.objects.create(email='unsubscribed@test.com', password='unsubscribed')
+        Subscription.objects.create(user=unsubscribed, course=self.course, is_subscribed=False)
+        celery_app.conf.task_always_eager = True
+
+    def test_course_update_notifications(self):
+        with self.assertNumQueries(1):
+            fan_out_notifications(self.course.pk, 'Обновление курса', 'Курс "TestCourse" был обновлен.')
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            [f'subscriber{index}@test.com' for index in range(5)]
+        )
+
+    def tearDown(self):
+        celery_app.conf.task_always_eager = False
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    NOTIFICATION_COALESCE_WINDOW=300,
+)
+class CoalescedUpdateNotificationTestCase(APITestCase):
+    def setUp(self):
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription')
+        for index in range(2):
+            user = User.objects.create(email=f'subscriber{index}@test.com', password='subscriber')
+            Subscription.objects.create(user=user, course=self.course, is_subscribed=True)
+        celery_app.conf.task_always_eager = True
+
+    def test_updates_are_merged_into_one_notification(self):
+        with patch.object(send_coalesced_update_notifications, 'apply_async') as apply_async:
+            schedule_update_notification(self.course.pk, 'Курс "TestCourse"')
+            schedule_update_notification(self.course.pk, 'Урок "TestLesson"')
+            schedule_update_notification(self.course.pk, 'Курс "TestCourse"')
+
+        apply_async.assert_called_once_with((self.course.pk,), countdown=300)
+
+        send_coalesced_update_notifications(self.course.pk)
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(
+            mail.outbox[0].body,
+            'Курс "TestCourse" был обновлен:\n- Курс "TestCourse"\n- Урок "TestLesson"'
+        )
+
+        send_coalesced_update_notifications(self.course.pk)
+
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_change_after_sending_schedules_next_notification(self):
+        with patch.object(send_coalesced_update_notifications, 'apply_async') as apply_async:
+            schedule_update_notification(self.course.pk, 'Курс "TestCourse"')
+            send_coalesced_update_notifications(self.course.pk)
+            schedule_update_notification(self.course.pk, 'Урок "TestLesson"')
+
+        self.assertEqual(apply_async.call_count, 2)
+
+        send_coalesced_update_notifications(self.course.pk)
+
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(mail.outbox[2].body, 'Курс "TestCourse" был обновлен:\n- Урок "TestLesson"')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                                           'LOCATION': 'redis://localhost:6379/1'}})
+    def test_redis_list_is_appended_and_taken_atomically(self):
+        pipeline = MagicMock()
+        for command in ('rpush', 'expire', 'lrange', 'delete'):
+            getattr(pipeline, command).return_value = pipeline
+        pipeline.execute.return_value = [[b'first', 'второй'.encode()], 1]
+        client = MagicMock()
+        client.pipeline.return_value = pipeline
+
+        get_redis_client.cache_clear()
+        self.addCleanup(get_redis_client.cache_clear)
+
+        with patch('main.caching.Redis.from_url', return_value=client) as from_url:
+            append_to_list('changes', 'first', timeout=60)
+            values = pop_list('changes')
+
+        from_url.assert_called_once_with('redis://localhost:6379/1')
+
+        pipeline.rpush.assert_called_once_with(':1:changes', 'first')
+        pipeline.expire.assert_called_once_with(':1:changes', 60)
+        pipeline.lrange.assert_called_once_with(':1:changes', 0, -1)
+        pipeline.delete.assert_called_once_with(':1:changes')
+        self.assertEqual(values, ['first', 'второй'])
+
+    def tearDown(self):
+        celery_app.conf.task_always_eager = False
+
+
+class CursorPaginationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.com', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        for index in range(25):
+            Course.objects.create(
+                course_name=f'Course {index}',
+                course_description=f'Description {index}',
+                owner=self.user,
+            )
+            Payment.objects.create(user=self.user, owner=self.user, date=timezone.now(), amount=100, method='CASH')
+
+    def collect_pages(self, url):
+        ids = []
+        params = {'cursor': '', 'per_page': 10}
+        while url is not None:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, params, HTTP_AUTHORIZATION=self.token)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(any('COUNT(*)' in query['sql'] for query in context.captured_queries))
+            data = response.json()
+            self.assertNotIn('count', data)
+            ids += [item['id'] for item in data['results']]
+            url, params = data['next'], {}
+        return ids
+
+    def test_course_cursor_pagination(self):
+        ids = self.collect_pages(reverse('courses:courses-list'))
+
+        self.assertEqual(ids, list(Course.objects.order_by('-updated_at', '-id').values_list('id', flat=True)))
+
+    def test_course_page_number_pagination(self):
+        response = self.client.get(
+            reverse('courses:courses-list'),
+            {'per_page': 10},
+            HTTP_AUTHORIZATION=self.token
+        )
+
+        self.assertEqual(response.json()['count'], 25)
+        self.assertEqual(len(response.json()['results']), 10)
+
+    def test_payment_cursor_pagination(self):
+        ids = self.collect_pages(reverse('courses:payments_list'))
+
+        self.assertEqual(ids, list(Payment.objects.order_by('-date', '-id').values_list('id', flat=True)))
+
+    def test_payment_list_without_cursor(self):
+        response = self.client.get(
+            reverse('courses:payments_list'),
+            HTTP_AUTHORIZATION=self.token
+        )
+
+        self.assertEqual(len(response.json()), 25)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    APPROXIMATE_COUNT_THRESHOLD=5,
+)
+class ApproximateCountTestCase(APITestCase):
+    def setUp(self):
+        self.moderator = User.objects.create(email='moderator@test.com', password='moderator',
+                                             role=UserRoles.MODERATOR)
+        self.owner = User.objects.create(email='owner@test.com', password='owner')
+        for index in range(6):
+            Course.objects.create(
+                course_name=f'Course {index}',
+                course_description=f'Description {index}',
+                owner=self.owner,
+            )
+
+    def get_course_list(self, user):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse('courses:courses-list'),
+                HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json(), [query['sql'] for query in context.captured_queries]
+
+    def test_unfiltered_list_uses_cached_count(self):
+        data, _ = self.get_course_list(self.moderator)
+        self.assertEqual(data['count'], 6)
+        self.assertTrue(data['approximate'])
+
+        data, queries = self.get_course_list(self.moderator)
+        self.assertEqual(data['count'], 6)
+        self.assertFalse(any('COUNT(*)' in query for query in queries))
+
+        Course.objects.create(course_name='New', course_description='New', owner=self.owner)
+        data, _ = self.get_course_list(self.moderator)
+        self.assertEqual(data['count'], 7)
+
+    def test_pages_follow_rows_not_the_estimate(self):
+        url = reverse('courses:courses-list')
+        token = f'Bearer {AccessToken.for_user(self.moderator)}'
+        for estimate in (5, 100):
+            # drops the cached responses of the previous estimate as well
+            cache.clear()
+            cache.set(table_count_key(Course), estimate)
+
+            response = self.client.get(url, {'per_page': 1, 'page': 6}, HTTP_AUTHORIZATION=token)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['count'], estimate)
+            self.assertEqual(response.json()['results'][0]['course_name'], 'Course 5')
+            self.assertIsNone(response.json()['next'])
+            self.assertIsNotNone(response.json()['previous'])
+
+            response = self.client.get(url, {'per_page': 1, 'page': 5}, HTTP_AUTHORIZATION=token)
+            self.assertIn('page=6', response.json()['next'])
+
+            response = self.client.get(url, {'per_page': 1, 'page': 7}, HTTP_AUTHORIZATION=token)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_filtered_list_counts_exactly(self):
+        data, _ = self.get_course_list(self.owner)
+
+        self.assertEqual(data['count'], 6)
+        self.assertFalse(data['approximate'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ResponseCacheTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.com', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription',
+                                            owner=self.user)
+
+    def get(self, url):
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_course_list_is_cached_until_subscription_changes(self):
+        url = reverse('courses:courses-list')
+        stats = get_response_cache_stats('CourseViewSet')
+        first = self.get(url)
+
+        # a cache hit costs only the conditional GET aggregate, the user comes from the auth cache
+        with self.assertNumQueries(1):
+            second = self.get(url)
+
+        self.assertEqual(first, second)
+        self.assertEqual(
+            get_response_cache_stats('CourseViewSet'),
+            {'hits': stats['hits'] + 1, 'misses': stats['misses'] + 1}
+        )
+
+        Subscription.objects.create(user=self.user, course=self.course, is_subscribed=True)
+
+        self.assertTrue(self.get(url)['results'][0]['is_subscribed'])
+
+    def test_course_retrieve_is_invalidated_on_save(self):
+        url = reverse('courses:courses-detail', kwargs={'pk': self.course.pk})
+        self.get(url)
+
+        self.course.course_name = 'Renamed'
+        self.course.save()
+
+        self.assertEqual(self.get(url)['course_name'], 'Renamed')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConditionalGetTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.com', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription',
+                                            owner=self.user)
+
+    def test_course_list_not_modified(self):
+        url = reverse('courses:courses-list')
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.token)
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_AUTHORIZATION=self.token, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        Lesson.objects.create(course=self.course, lesson_name='Lesson', lesson_description='Text', owner=self.user)
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.token, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_course_retrieve_if_modified_since(self):
+        url = reverse('courses:courses-detail', kwargs={'pk': self.course.pk})
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.token)
+        last_modified = response['Last-Modified']
+
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.token, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_missing_course_is_not_found(self):
+        response = self.client.get(
+            reverse('courses:courses-detail', kwargs={'pk': self.course.pk + 1}),
+            HTTP_AUTHORIZATION=self.token,
+            HTTP_IF_NONE_MATCH='"anything"'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class LessonPermissionQueryCountTestCase(APITestCase):
+    def setUp(self):
+        self.owner = User.objects.create(email='owner@test.com', password='owner')
+        self.author = User.objects.create(email='author@test.com', password='author')
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription',
+                                            owner=self.owner)
+        self.lesson = Lesson.objects.create(course=self.course, lesson_name='Lesson', lesson_description='Text',
+                                            owner=self.owner)
+        Lesson.objects.create(course=self.course, lesson_name='Other', lesson_description='Text', owner=self.author)
+
+    def make_request(self, user):
+        request = Request(APIRequestFactory().delete('/'))
+        request.user = user
+        return request
+
+    def test_owner_permission_is_query_free(self):
+        lesson = Lesson.objects.select_related('course').get(pk=self.lesson.pk)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(IsCourseOrLessonOwner().has_object_permission(self.make_request(self.owner), None, lesson))
+
+    def test_course_author_ownership_is_memoized(self):
+        lesson = Lesson.objects.select_related('course').get(pk=self.lesson.pk)
+        request = self.make_request(self.author)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(IsCourseOrLessonOwner().has_object_permission(request, None, lesson))
+            self.assertTrue(IsCourseOrLessonOwner().has_object_permission(request, None, lesson))
+
+        stranger = User.objects.create(email='stranger@test.com', password='stranger')
+        self.assertFalse(IsCourseOrLessonOwner().has_object_permission(self.make_request(stranger), None, lesson))
+
+    def test_lesson_retrieve_query_count(self):
+        # JWT user lookup, conditional GET aggregate and the lesson joined with its course
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                reverse('courses:lesson_get', kwargs={'pk': self.lesson.pk}),
+                HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.owner)}'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['course'], self.course.course_name)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class LessonBulkTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.com', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        CachedJWTAuthentication().get_user(AccessToken.for_user(self.user))
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription',
+                                            owner=self.user)
+        self.other_course = Course.objects.create(course_name='OtherCourse', course_description='Other',
+                                                  owner=self.user)
+
+    def bulk_create(self, count, prefix='Lesson'):
+        data = [
+            {
+                'course': self.course.course_name if index % 2 else self.other_course.course_name,
+                'lesson_name': f'{prefix} {index}',
+                'lesson_description': f'Description {index}',
+            }
+            for index in range(count)
+        ]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('courses:lesson_bulk'), data=data, format='json',
+                                        HTTP_AUTHORIZATION=self.token)
+        return response, len(context.captured_queries)
+
+    def test_bulk_create(self):
+        response, _ = self.bulk_create(3)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Lesson.objects.filter(owner=self.user).count(), 3)
+        self.assertEqual(
+            [(lesson['lesson_name'], lesson['course']) for lesson in response.json()],
+            [('Lesson 0', 'OtherCourse'), ('Lesson 1', 'TestCourse'), ('Lesson 2', 'OtherCourse')]
+        )
+
+    def test_bulk_create_query_count_is_constant(self):
+        _, small_batch_queries = self.bulk_create(5, prefix='Small')
+        _, large_batch_queries = self.bulk_create(50, prefix='Large')
+
+        self.assertEqual(small_batch_queries, large_batch_queries)
+        self.assertEqual(Lesson.objects.count(), 55)
+
+    def test_bulk_create_rejects_duplicates(self):
+        self.bulk_create(2)
+        response, _ = self.bulk_create(3)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Lesson.objects.count(), 2)
+
+    def test_bulk_create_rejects_unknown_course(self):
+        response = self.client.post(
+            reverse('courses:lesson_bulk'),
+            data=[{'course': 'Missing', 'lesson_name': 'Lesson', 'lesson_description': 'Text'}],
+            format='json',
+            HTTP_AUTHORIZATION=self.token
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_rejects_ambiguous_course(self):
+        other = User.objects.create(email='other@test.com', password='other')
+        Course.objects.create(course_name='TestCourse', course_description='Чужой курс', owner=other)
+
+        response = self.client.post(
+            reverse('courses:lesson_bulk'),
+            data=[{'course': 'OtherCourse', 'lesson_name': 'Lesson 1', 'lesson_description': 'Text'},
+                  {'course': 'TestCourse', 'lesson_name': 'Lesson 2', 'lesson_description': 'Text'}],
+            format='json',
+            HTTP_AUTHORIZATION=self.token
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), [{}, {'course': ['Найдено несколько объектов с course_name=TestCourse.']}])
+        self.assertFalse(Lesson.objects.exists())
+
+    def test_bulk_update(self):
+        self.bulk_create(2)
+        lessons = list(Lesson.objects.order_by('pk'))
+        data = [{'id': lesson.pk, 'lesson_name': f'Renamed {lesson.pk}'} for lesson in lessons]
+
+        with patch('main.views.schedule_update_notification') as schedule:
+            response = self.client.patch(reverse('courses:lesson_bulk'), data=data, format='json',
+                                         HTTP_AUTHORIZATION=self.token)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(Lesson.objects.order_by('pk').values_list('lesson_name', flat=True)),
+            [f'Renamed {lesson.pk}' for lesson in lessons]
+        )
+        self.assertEqual(schedule.call_count, 2)
+
+    def test_bulk_update_rejects_invalid_id(self):
+        self.bulk_create(1)
+        data = [{'id': 'abc', 'lesson_name': 'Renamed'}]
+
+        response = self.client.patch(reverse('courses:lesson_bulk'), data=data, format='json',
+                                     HTTP_AUTHORIZATION=self.token)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), ['Некорректный id урока "abc"'])
+
+    def test_bulk_requests_use_fewer_queries_than_single_ones(self):
+        with CaptureQueriesContext(connection) as context:
+            for index in range(10):
+                self.client.post(reverse('courses:lesson_create'), format='json', HTTP_AUTHORIZATION=self.token,
+                                 data={'course': self.course.course_name, 'lesson_name': f'Single {index}',
+                                       'lesson_description': f'Description {index}'})
+        single_create_queries = len(context.captured_queries)
+        _, bulk_create_queries = self.bulk_create(10)
+
+        lessons = list(Lesson.objects.filter(lesson_name__startswith='Lesson'))
+        with patch('main.views.schedule_update_notification'):
+            with CaptureQueriesContext(connection) as context:
+                for lesson in lessons:
+                    self.client.patch(reverse('courses:lesson_update', args=[lesson.pk]), format='json',
+                                      HTTP_AUTHORIZATION=self.token, data={'lesson_name': f'Renamed {lesson.pk}'})
+            single_update_queries = len(context.captured_queries)
+            with CaptureQueriesContext(connection) as context:
+                self.client.patch(reverse('courses:lesson_bulk'), format='json', HTTP_AUTHORIZATION=self.token,
+                                  data=[{'id': lesson.pk, 'lesson_name': f'Bulk {lesson.pk}'} for lesson in lessons])
+            bulk_update_queries = len(context.captured_queries)
+
+        self.assertEqual(Lesson.objects.filter(lesson_name__startswith='Bulk').count(), 10)
+        self.assertLess(bulk_create_queries * 3, single_create_queries)
+        self.assertLess(bulk_update_queries * 3, single_update_queries)
+
+
+class PaymentExportTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.com', password='owner', first_name='Owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription')
+        for index in range(3):
+            Payment.objects.create(user=self.user, owner=self.user, course=self.course, date=timezone.now(),
+                                   amount=100 + index, method='CASH' if index else 'TRANSFER')
+        stranger = User.objects.create(email='stranger@test.com', password='stranger')
+        Payment.objects.create(user=stranger, owner=stranger, date=timezone.now(), amount=1, method='CASH')
+
+    def export(self, params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('courses:payments_export'), params, HTTP_AUTHORIZATION=self.token)
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, content, len(context.captured_queries)
+
+    def test_csv_export(self):
+        response, content, queries = self.export({'format': 'csv'})
+        lines = content.splitlines()
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(lines[0], 'id,date,amount,method,course,lesson,user,owner')
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].endswith(',102.00,CASH,TestCourse,,Owner,owner@test.com'))
+        # the JWT user lookup and one joined select
+        self.assertEqual(queries, 2)
+
+    def test_ndjson_export_with_filter(self):
+        _, content, _ = self.export({'format': 'ndjson', 'method': 'TRANSFER'})
+        rows = [json.loads(line) for line in content.splitlines()]
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['amount'], '100.00')
+        self.assertEqual(rows[0]['course'], 'TestCourse')
+        self.assertEqual(rows[0]['owner'], 'owner@test.com')
+
+
+class PaymentImportTestCase(APITestCase):
+    csv_rows = (
+        'date,amount,method,user,owner,course,lesson\n'
+        '2023-01-01T10:00:00Z,100,CASH,payer@test.com,,TestCourse,\n'
+        '2023-01-02T10:00:00Z,200,CARD,payer@test.com,,,\n'
+        '2023-01-03T10:00:00Z,300,TRANSFER,payer@test.com,moderator@test.com,,\n'
+        '2023-01-04T10:00:00Z,400,CASH,missing@test.com,,,\n'
+        '2023-01-05T10:00:00Z,500,CASH,payer@test.com,,TestCourse,\n'
+    )
+
+    def setUp(self):
+        self.payer = User.objects.create(email='payer@test.com', password='payer')
+        self.moderator = User.objects.create(email='moderator@test.com', password='moderator',
+                                             role=UserRoles.MODERATOR)
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription')
+
+    def test_import_in_batches(self):
+        rejects = io.StringIO()
+
+        # three lookup maps and two inserts for three valid rows
+        with self.assertNumQueries(5):
+            report = PaymentImporter(batch_size=2, reject_file=rejects).run(
+                iter_rows(io.StringIO(self.csv_rows), 'csv')
+            )
+
+        self.assertEqual((report['imported'], report['rejected'], report['offset']), (3, 2, 5))
+        self.assertEqual([reject['line'] for reject in report['rejects']], [1, 3])
+        self.assertEqual(len(rejects.getvalue().splitlines()), 2)
+        self.assertEqual(
+            list(Payment.objects.order_by('date').values_list('amount', 'owner__email', 'course__course_name')),
+            [(100, 'payer@test.com', 'TestCourse'), (300, 'moderator@test.com', None),
+             (500, 'payer@test.com', 'TestCourse')]
+        )
+
+    def test_resume_from_offset(self):
+        report = PaymentImporter(offset=4).run(iter_rows(io.StringIO(self.csv_rows), 'csv'))
+
+        self.assertEqual((report['imported'], report['rejected'], report['offset']), (1, 0, 5))
+        self.assertEqual(list(Payment.objects.values_list('amount', flat=True)), [500])
+
+    def test_lessons_are_resolved_within_their_course(self):
+        other_course = Course.objects.create(course_name='OtherCourse', course_description='OtherCourseDescription')
+        Course.objects.create(course_name='OtherCourse', course_description='Другое описание')
+        lesson = Lesson.objects.create(course=self.course, lesson_name='Введение', lesson_description='Первый')
+        Lesson.objects.create(course=other_course, lesson_name='Введение', lesson_description='Второй')
+        rows = (
+            'date,amount,method,user,owner,course,lesson\n'
+            '2023-01-01T10:00:00Z,100,CASH,payer@test.com,,TestCourse,Введение\n'
+            '2023-01-02T10:00:00Z,200,CASH,payer@test.com,,,Введение\n'
+            '2023-01-03T10:00:00Z,300,CASH,payer@test.com,,OtherCourse,\n'
+            '2023-01-04T10:00:00Z,400,CASH,payer@test.com,,TestCourse,Заключение\n'
+        )
+
+        report = PaymentImporter().run(iter_rows(io.StringIO(rows), 'csv'))
+
+        self.assertEqual((report['imported'], report['rejected']), (1, 3))
+        self.assertEqual([reject['error'] for reject in report['rejects']], [
+            'lesson "Введение" неоднозначен: найдено 2',
+            'course "OtherCourse" неоднозначен: найдено 2',
+            'lesson "Заключение" не найден',
+        ])
+        self.assertEqual(Payment.objects.get().lesson, lesson)
+
+    def test_invalid_rows_do_not_stop_the_import(self):
+        valid = {'date': '2023-01-01T10:00:00Z', 'method': 'CASH', 'user': 'payer@test.com'}
+        rows = '\n'.join([
+            json.dumps({**valid, 'amount': 100}),
+            '[1, 2]',
+            json.dumps({**valid, 'amount': 12.9}),
+            json.dumps({**valid, 'amount': True}),
+            json.dumps({**valid, 'amount': '1e3'}),
+            json.dumps({**valid, 'amount': '200'}),
+        ])
+
+        report = PaymentImporter().run(iter_rows(io.StringIO(rows), 'jsonl'))
+
+        self.assertEqual((report['imported'], report['rejected'], report['offset']), (2, 4, 6))
+        self.assertEqual([reject['error'] for reject in report['rejects']], [
+            'Строка должна быть объектом',
+            'Некорректная сумма "12.9"',
+            'Некорректная сумма "True"',
+            'Некорректная сумма "1e3"',
+        ])
+        self.assertEqual(sorted(Payment.objects.values_list('amount', flat=True)), [100, 200])
+
+    def test_import_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'payments.csv'
+            path.write_text(self.csv_rows, encoding='utf-8')
+            output = io.StringIO()
+            call_command('import_payments', str(path), rejects=str(Path(directory) / 'rejects.jsonl'), stdout=output)
+
+            report = json.loads(output.getvalue())
+            self.assertEqual((report['imported'], report['rejected']), (3, 2))
+            self.assertEqual(len((Path(directory) / 'rejects.jsonl').read_text(encoding='utf-8').splitlines()), 2)
+
+    def test_import_endpoint(self):
+        rows = '\n'.join([
+            json.dumps({'date': '2023-01-01T10:00:00Z', 'amount': 100, 'method': 'CASH', 'user': 'payer@test.com'}),
+            'not json',
+        ])
+        response = self.client.post(
+            reverse('courses:payments_import'),
+            {'file': SimpleUploadedFile('payments.jsonl', rows.encode())},
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.moderator)}'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.json()['imported'], response.json()['rejected']), (1, 1))
+        self.assertEqual(Payment.objects.get().owner, self.payer)
+
+    def test_import_endpoint_rejects_non_utf8(self):
+        response = self.client.post(
+            reverse('courses:payments_import'),
+            {'file': SimpleUploadedFile('payments.csv', self.csv_rows.encode() + 'Оплата'.encode('cp1251'))},
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.moderator)}'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'file': 'Файл должен быть в кодировке UTF-8'})
+        self.assertFalse(Payment.objects.exists())
+
+    def test_import_endpoint_requires_moderator(self):
+        response = self.client.post(
+            reverse('courses:payments_import'),
+            {'file': SimpleUploadedFile('payments.csv', self.csv_rows.encode())},
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.payer)}'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class LinksValidatorTestCase(SimpleTestCase):
+    def setUp(self):
+        self.validator = LinksValidator(fields=['lesson_description', 'video_url'])
+
+    def test_allowed_domains(self):
+        self.validator({
+            'lesson_description': 'Смотрите www.youtube.com/watch?v=1 и m.youtube.com, e.g. без ссылок',
+            'video_url': 'https://youtu.be/abc',
+        })
+
+    def test_forbidden_link(self):
+        with self.assertRaises(ValidationError):
+            self.validator({'lesson_description': 'Подробнее на https://evil.com/youtube.com', 'video_url': None})
+
+    def test_lookalike_domain(self):
+        with self.assertRaises(ValidationError):
+            self.validator({'lesson_description': 'notyoutube.com'})
+
+    @override_settings(ALLOWED_LINK_DOMAINS=['example.com'])
+    def test_allow_list_from_settings(self):
+        self.validator({'lesson_description': 'docs.example.com'})
+
+        with self.assertRaises(ValidationError):
+            self.validator({'lesson_description': 'youtube.com'})
+
+    def test_links_after_punctuation(self):
+        for text in ('Подробнее...evil.com', 'Текст.evil.com', 'x.evil.com.99'):
+            with self.assertRaises(ValidationError):
+                self.validator({'lesson_description': text})
+
+    def test_internationalized_domains(self):
+        for text in ('Подробнее на пример.рф', 'сайт.Пример.РФ/курс', 'xn--e1afmkfd.xn--p1ai', 'münchen.de'):
+            with self.assertRaises(ValidationError):
+                self.validator({'lesson_description': text})
+
+        self.validator({'lesson_description': 'Например, т.е. и т.д. без ссылок'})
+
+    def test_pathological_input_is_linear(self):
+        # label chains without a top-level domain used to be rescanned from every label
+        for text in ('a1.' * 50000 + '-', 'a.' * 50000 + '1', 'x' + '.a' * 50000 + '.-'):
+            started = time.perf_counter()
+            self.validator({'lesson_description': text})
+            self.assertLess(time.perf_counter() - started, 0.5)
+
+    def test_benchmark_command(self):
+        output = io.StringIO()
+        call_command('benchmark_links_validator', sizes=[1000], repeat=1, stdout=output)
+
+        self.assertIn('1000', output.getvalue())
+        self.assertIn('худший случай', output.getvalue())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ContentHashTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.com', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(course_name='TestCourse', course_description='Описание' * 1000,
+                                            owner=self.user)
+
+    def test_hash_is_maintained_on_save(self):
+        self.assertEqual(self.course.content_hash, make_content_hash('TestCourse', 'Описание' * 1000))
+
+        self.course.course_name = 'Renamed'
+        self.course.save(update_fields=['course_name'])
+        self.course.refresh_from_db()
+
+        self.assertEqual(self.course.content_hash, make_content_hash('Renamed', 'Описание' * 1000))
+
+    def test_duplicate_course_is_rejected_by_hash(self):
+        data = {'course_name': 'TestCourse', 'course_description': 'Описание' * 1000}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('courses:courses-list'), data=data, HTTP_AUTHORIZATION=self.token)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn('content_hash', response.json())
+        unique_check = [query['sql'] for query in context.captured_queries if 'content_hash' in query['sql']]
+        self.assertEqual(len(unique_check), 1)
+        self.assertNotIn('course_description', unique_check[0].split('WHERE')[1])
+
+    def test_course_create(self):
+        data = {'course_name': 'NewCourse', 'course_description': 'Описание'}
+        response = self.client.post(reverse('courses:courses-list'), data=data, HTTP_AUTHORIZATION=self.token)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('content_hash', response.json())
+        self.assertEqual(
+            Course.objects.get(pk=response.json()['id']).content_hash,
+            make_content_hash('NewCourse', 'Описание')
+        )
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SubscriptionToggleTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='student@test.com', password='student')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription',
+                                            owner=self.user)
+
+    def toggle(self, action):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse(f'courses:subscription-{action}'),
+                data={'course': self.course.pk},
+                HTTP_AUTHORIZATION=self.token
+            )
+
+    def test_subscribe_is_idempotent(self):
+        for _ in range(3):
+            response = self.toggle('subscribe')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), {'course': self.course.pk, 'is_subscribed': True})
+
+        self.assertEqual(Subscription.objects.filter(user=self.user, course=self.course).count(), 1)
+        self.assertEqual(get_subscribed_course_ids(self.user.pk), {self.course.pk})
+
+    def test_unsubscribe_is_idempotent(self):
+        self.toggle('subscribe')
+        for _ in range(2):
+            response = self.toggle('unsubscribe')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), {'course': self.course.pk, 'is_subscribed': False})
+
+        subscription = Subscription.objects.get(user=self.user, course=self.course)
+        self.assertFalse(subscription.is_subscribed)
+        self.assertEqual(get_subscribed_course_ids(self.user.pk), set())
+
+    def test_unknown_course(self):
+        response = self.client.post(
+            reverse('courses:subscription-subscribe'),
+            data={'course': self.course.pk + 1},
+            HTTP_AUTHORIZATION=self.token
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_toggle_drops_cached_set(self):
+        get_subscribed_course_ids(self.user.pk)
+
+        self.toggle('subscribe')
+        self.assertEqual(get_subscribed_course_ids(self.user.pk), {self.course.pk})
+
+        self.toggle('unsubscribe')
+        self.assertEqual(get_subscribed_course_ids(self.user.pk), set())
+
+    def test_set_read_before_toggle_is_not_served_after_it(self):
+        version = get_subscriptions_version(self.user.pk)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('courses:subscription-subscribe'), data={'course': self.course.pk},
+                             HTTP_AUTHORIZATION=self.token)
+        # nothing changes for readers until the toggle commits
+        self.assertEqual(get_subscriptions_version(self.user.pk), version)
+
+        # a request that loaded the rows before the toggle stores them late
+        cache.set(subscriptions_key(self.user.pk, version), set())
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(get_subscribed_course_ids(self.user.pk), {self.course.pk})
+
+    def test_course_list_reads_subscriptions_from_cache(self):
+        self.toggle('subscribe')
+        get_subscribed_course_ids(self.user.pk)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('courses:courses-list'), HTTP_AUTHORIZATION=self.token)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()['results'][0]['is_subscribed'])
+        self.assertFalse([query for query in context.captured_queries if 'main_subscription' in query['sql']])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class QueryPlanTestCase(APITestCase):
+    """Explains the queries the main endpoints actually run, so a dropped or unused index fails here."""
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.com', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription',
+                                            owner=self.user)
+        Lesson.objects.create(course=self.course, lesson_name='Lesson', lesson_description='Text', owner=self.user)
+        Payment.objects.create(user=self.user, owner=self.user, course=self.course, date=timezone.now(), amount=100,
+                               method='CASH')
+        Subscription.objects.create(user=self.user, course=self.course, is_subscribed=True)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # the test tables are tiny, make the planner prefer indexes like it would on real data
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+            else:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+    def capture_select(self, table, request):
+        with CaptureQueriesContext(connection) as context:
+            request()
+        for query in context.captured_queries:
+            sql = query['sql']
+            if sql.startswith('SELECT') and f'FROM "{table}"' in sql and 'COUNT(*)' not in sql and 'MAX(' not in sql:
+                return sql
+        self.fail(f'{table} was not queried')
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def assertPlanUses(self, sql, index_name):
+        plan = self.explain(sql)
+        self.assertIn(index_name, plan, plan)
+
+    def test_lesson_list_plan(self):
+        sql = self.capture_select('main_lesson', lambda: self.get(reverse('courses:lesson_list'), {'cursor': ''}))
+
+        self.assertPlanUses(sql, 'lesson_owner_updated_at_idx')
+
+    def test_course_list_plan(self):
+        sql = self.capture_select('main_course', lambda: self.get(reverse('courses:courses-list'), {'cursor': ''}))
+
+        self.assertPlanUses(sql, 'course_owner_updated_at_idx')
+
+    def test_payment_list_plan(self):
+        sql = self.capture_select('main_payment', lambda: self.get(reverse('courses:payments_list'), {'cursor': ''}))
+
+        self.assertPlanUses(sql, 'payment_owner_date_idx')
+
+    def test_payment_list_by_course_plan(self):
+        moderator = User.objects.create(email='moderator@test.com', password='moderator', role=UserRoles.MODERATOR)
+        self.token = f'Bearer {AccessToken.for_user(moderator)}'
+        sql = self.capture_select(
+            'main_payment',
+            lambda: self.get(reverse('courses:payments_list'), {'cursor': '', 'course': self.course.pk})
+        )
+
+        self.assertPlanUses(sql, 'payment_course_date_idx')
+
+    def test_subscriber_fan_out_plan(self):
+        with patch('main.tasks.send_notification_chunk.delay'):
+            sql = self.capture_select(
+                'main_subscription', lambda: fan_out_notifications(self.course.pk, 'Обновление курса', '')
+            )
+
+        self.assertPlanUses(sql, 'subscription_course_active_idx')
+
+
+class FixedStripeClient(BaseStripeClient):
+
+    def create_checkout_session(self, params):
+        return {'id': 'cs_fixed'}
+
+    async def acreate_checkout_session(self, params):
+        return {'id': 'cs_fixed'}
+
+
+class StubStripeTestCase(APITestCase):
+    """Runs the Stripe client against main.stripe_stub instead of api.stripe.com."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stripe = StubStripeServer().__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stripe.__exit__()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.stripe.reset()
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription',
+                                            cost=1500)
+        settings_override = self.settings(STRIPE_API_BASE=self.stripe.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class StripeCheckoutTestCase(StubStripeTestCase):
+
+    def test_encode_params(self):
+        self.assertEqual(
+            encode_params({'line_items': [{'price_data': {'unit_amount': 100}, 'quantity': 1}], 'mode': 'payment'}),
+            [('line_items[0][price_data][unit_amount]', '100'), ('line_items[0][quantity]', '1'), ('mode', 'payment')]
+        )
+
+    def test_sync_checkout(self):
+        response = self.client.post(reverse('create-checkout-session', kwargs={'pk': self.course.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'id': 'cs_test_1'})
+        params = self.stripe.requests[0]['params']
+        self.assertEqual(params['line_items[0][price_data][unit_amount]'], '150000')
+        self.assertEqual(params['line_items[0][price_data][product_data][name]'], 'TestCourse')
+        self.assertEqual(params['metadata[product_id]'], str(self.course.pk))
+
+    def test_async_checkout(self):
+        response = self.client.post(reverse('async-create-checkout-session', kwargs={'pk': self.course.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'id': 'cs_test_1'})
+        self.assertEqual(self.stripe.requests[0]['path'], '/v1/checkout/sessions')
+
+    def test_async_checkout_unknown_course(self):
+        response = self.client.post(reverse('async-create-checkout-session', kwargs={'pk': self.course.pk + 1}))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(self.stripe.requests)
+
+    def test_stripe_unavailable(self):
+        with self.settings(STRIPE_API_BASE='http://127.0.0.1:9'):
+            for name in ('create-checkout-session', 'async-create-checkout-session'):
+                response = self.client.post(reverse(name, kwargs={'pk': self.course.pk}))
+                self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+                self.assertIn('error', response.json())
+
+    def test_concurrency_is_limited(self):
+        client = HttpxStripeClient(api_base=self.stripe.url, max_concurrency=2)
+        self.stripe.latency = 0.05
+        self.addCleanup(setattr, self.stripe, 'latency', 0)
+        self.stripe.max_active = 0
+
+        async def checkout_many():
+            return await asyncio.gather(*(client.acreate_checkout_session({'mode': 'payment'}) for _ in range(6)))
+
+        sessions = asyncio.run(checkout_many())
+
+        self.assertEqual(len({session['id'] for session in sessions}), 6)
+        self.assertEqual(self.stripe.max_active, 2)
+
+    @override_settings(STRIPE_CLIENT='main.tests.FixedStripeClient')
+    def test_client_is_pluggable(self):
+        self.assertIsInstance(get_stripe_client(), FixedStripeClient)
+        response = self.client.post(reverse('async-create-checkout-session', kwargs={'pk': self.course.pk}))
+
+        self.assertEqual(response.json(), {'id': 'cs_fixed'})
+        self.assertFalse(self.stripe.requests)
+
+
+class StripeCatalogTestCase(StubStripeTestCase):
+
+    def paths(self):
+        return [request['path'] for request in self.stripe.requests]
+
+    def test_sync_creates_product_and_price(self):
+        self.assertTrue(sync_course(self.course))
+
+        self.course.refresh_from_db()
+        self.assertTrue(self.course.has_current_stripe_price())
+        self.assertEqual(self.paths(), ['/v1/products', '/v1/prices'])
+        price = self.stripe.objects['prices'][self.course.stripe_price_id]
+        self.assertEqual(price['product'], self.course.stripe_product_id)
+        self.assertEqual(price['unit_amount'], '150000')
+
+    def test_current_course_is_skipped(self):
+        sync_course(self.course)
+        self.stripe.reset()
+
+        self.assertFalse(sync_course(Course.objects.get(pk=self.course.pk)))
+        self.assertEqual(sync_catalog(), 0)
+        self.assertFalse(self.stripe.requests)
+
+    def test_cost_change_creates_new_price(self):
+        sync_course(self.course)
+        old_price_id = self.course.stripe_price_id
+        self.course.cost = 2000
+        self.course.save()
+        self.assertFalse(self.course.has_current_stripe_price())
+        self.stripe.requests.clear()
+
+        self.assertEqual(sync_catalog(), 1)
+
+        self.course.refresh_from_db()
+        self.assertNotEqual(self.course.stripe_price_id, old_price_id)
+        self.assertEqual(self.course.stripe_unit_amount, 200000)
+        self.assertEqual(self.stripe.objects['prices'][old_price_id]['active'], 'false')
+        self.assertEqual(
+            self.paths(),
+            [f'/v1/products/{self.course.stripe_product_id}', '/v1/prices', f'/v1/prices/{old_price_id}']
+        )
+
+    def test_name_change_keeps_price(self):
+        sync_course(self.course)
+        price_id = self.course.stripe_price_id
+        self.course.course_name = 'Renamed'
+        self.course.save()
+        self.stripe.requests.clear()
+
+        sync_catalog()
+
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.stripe_price_id, price_id)
+        self.assertEqual(self.paths(), [f'/v1/products/{self.course.stripe_product_id}'])
+        self.assertEqual(self.stripe.objects['products'][self.course.stripe_product_id]['name'], 'Renamed')
+
+    def test_checkout_uses_synced_price(self):
+        sync_course(self.course)
+
+        self.client.post(reverse('create-checkout-session', kwargs={'pk': self.course.pk}))
+
+        params = self.stripe.requests[-1]['params']
+        self.assertEqual(params['line_items[0][price]'], self.course.stripe_price_id)
+        self.assertNotIn('line_items[0][price_data][unit_amount]', params)
+
+    def test_course_save_schedules_sync(self):
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            course = Course.objects.create(course_name='Another', course_description='Text', cost=100)
+
+        course.refresh_from_db()
+        self.assertTrue(course.has_current_stripe_price())
+
+    def test_only_name_and_cost_changes_schedule_sync(self):
+        sync_course(self.course)
+
+        with patch('main.tasks.sync_course_with_stripe.delay') as delay, patch('main.tasks.generate_thumbnails.delay'):
+            for field, value in (('course_description', 'Новое описание'), ('course_preview', 'main/course/x.png'),
+                                 ('course_name', 'Renamed'), ('cost', 2000)):
+                with self.captureOnCommitCallbacks(execute=True):
+                    setattr(self.course, field, value)
+                    self.course.save()
+
+        self.assertEqual(delay.call_count, 2)
+
+    def test_sync_task_retries_and_logs_failure(self):
+        with patch('main.tasks.sync_course', side_effect=StripeError('Stripe недоступен')) as sync, \
+                self.assertLogs('main.tasks', level='ERROR') as logs:
+            result = sync_course_with_stripe.apply((self.course.pk,))
+
+        self.assertTrue(result.failed())
+        self.assertEqual(sync.call_count, settings.STRIPE_SYNC_MAX_RETRIES + 1)
+        self.assertIn('Stripe недоступен', logs.output[0])
+
+    def test_command(self):
+        out = io.StringIO()
+        with self.settings(STRIPE_API_BASE='http://127.0.0.1:9'):
+            call_command('sync_stripe_catalog', stdout=out)
+        self.assertIn('Синхронизировано курсов: 0', out.getvalue())
+
+        call_command('sync_stripe_catalog', '--course', str(self.course.pk), stdout=out)
+        self.assertIn('Синхронизировано курсов: 1', out.getvalue())
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='payer@test.com', password='payer')
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription',
+                                            cost=1500)
+
+    def make_event(self, number, session_id=None, **session):
+        session = {
+            'id': session_id or f'cs_test_{number}',
+            'object': 'checkout.session',
+            'amount_total': 150000,
+            'created': 1700000000,
+            'payment_status': 'paid',
+            'client_reference_id': str(self.user.pk),
+            'metadata': {'product_id': str(self.course.pk)},
+            **session,
+        }
+        return {'id': f'evt_{number}', 'type': 'checkout.session.completed', 'data': {'object': session}}
+
+    def store_events(self, events):
+        StripeEvent.objects.bulk_create(
+            [StripeEvent(event_id=event['id'], type=event['type'], payload=event) for event in events]
+        )
+
+    def post_event(self, event, secret='whsec_test'):
+        payload = json.dumps(event)
+        return self.client.post(
+            reverse('stripe-webhook'),
+            data=payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=sign_payload(payload, secret),
+        )
+
+    def test_event_is_stored(self):
+        for _ in range(2):
+            response = self.post_event(self.make_event(1))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        event = StripeEvent.objects.get()
+        self.assertEqual((event.event_id, event.type, event.processed_at), ('evt_1', 'checkout.session.completed', None))
+        self.assertFalse(Payment.objects.exists())
+
+    def test_invalid_signature(self):
+        response = self.post_event(self.make_event(1), secret='whsec_other')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    @override_settings(STRIPE_WEBHOOK_SECRET='')
+    def test_missing_secret_refuses_events(self):
+        response = self.post_event(self.make_event(1), secret='')
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_amount_with_cents_is_recorded(self):
+        self.store_events([self.make_event(1, amount_total=1999)])
+
+        self.assertEqual(drain_events(), (1, False))
+
+        self.assertEqual(Payment.objects.get().amount, Decimal('19.99'))
+        self.assertIsNone(StripeEvent.objects.get().error)
+
+    def test_events_become_payments(self):
+        self.store_events([self.make_event(1), self.make_event(2, client_reference_id=None)])
+
+        self.assertEqual(drain_events(), (2, False))
+
+        payments = Payment.objects.order_by('stripe_session_id')
+        self.assertEqual(
+            [(payment.stripe_session_id, payment.amount, payment.method, payment.user_id, payment.course_id)
+             for payment in payments],
+            [('cs_test_1', 1500, 'STRIPE', self.user.pk, self.course.pk), ('cs_test_2', 1500, 'STRIPE', None,
+                                                                           self.course.pk)]
+        )
+        self.assertFalse(StripeEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_replayed_session_creates_one_payment(self):
+        self.store_events([self.make_event(1)])
+        drain_events()
+        self.store_events([self.make_event(2, session_id='cs_test_1')])
+        drain_events()
+
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_bad_and_other_events_are_marked(self):
+        self.store_events([
+            self.make_event(1, amount_total=None),
+            {'id': 'evt_2', 'type': 'customer.created', 'data': {'object': {}}},
+            {'id': 'evt_3', 'type': 'checkout.session.completed', 'data': None},
+            self.make_event(4),
+        ])
+
+        self.assertEqual(drain_events(), (4, False))
+
+        self.assertEqual(Payment.objects.count(), 1)
+        errors = dict(StripeEvent.objects.values_list('event_id', 'error'))
+        self.assertIsNotNone(errors['evt_1'])
+        self.assertIsNone(errors['evt_2'])
+        self.assertIsNotNone(errors['evt_3'])
+
+    def test_burst_is_drained_in_batches(self):
+        self.store_events([self.make_event(number) for number in range(1000)])
+
+        self.assertEqual(drain_events(batch_size=300, max_batches=2), (600, True))
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(drain_events(batch_size=300), (400, False))
+
+        self.assertEqual(Payment.objects.count(), 1000)
+        self.assertLess(len(context.captured_queries), 30)
+
+    def test_webhook_schedules_drain(self):
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_event(self.make_event(1))
+
+        self.assertEqual(Payment.objects.get().stripe_session_id, 'cs_test_1')
+
+
+class StripeReconciliationTestCase(StubStripeTestCase):
+    start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+    def add_session(self, session_id, offset, amount=1500, payment_status='paid', amount_total=None):
+        self.stripe.objects['checkout/sessions'][session_id] = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'created': int((self.start + offset).timestamp()),
+            'amount_total': amount * 100 if amount_total is None else amount_total,
+            'payment_status': payment_status,
+        }
+
+    def add_payment(self, session_id, offset, amount=1500):
+        return Payment.objects.create(stripe_session_id=session_id, date=self.start + offset, amount=amount,
+                                      method='STRIPE', course=self.course)
+
+    def reconcile(self, hours=3):
+        return Reconciler(slice_size=timedelta(hours=1)).run(self.start, self.start + timedelta(hours=hours))
+
+    def test_discrepancies(self):
+        self.add_session('cs_matched', timedelta(minutes=10))
+        self.add_payment('cs_matched', timedelta(minutes=10))
+        self.add_session('cs_amount', timedelta(hours=1, minutes=5), amount=2000)
+        amount_payment = self.add_payment('cs_amount', timedelta(hours=1, minutes=5))
+        self.add_session('cs_no_payment', timedelta(hours=2))
+        lost_payment = self.add_payment('cs_no_session', timedelta(hours=2, minutes=30))
+        self.add_session('cs_unpaid', timedelta(minutes=20), payment_status='unpaid')
+        self.add_session('cs_outside', timedelta(hours=5))
+        Payment.objects.create(date=self.start, amount=100, method='CASH')
+
+        run = self.reconcile()
+
+        self.assertEqual((run.sessions_checked, run.payments_checked, run.discrepancies_count), (3, 3, 3))
+        self.assertIsNotNone(run.finished_at)
+        self.assertEqual(
+            sorted(run.discrepancies.values_list('kind', 'stripe_session_id', 'payment', 'stripe_amount',
+                                                 'payment_amount')),
+            [
+                (PaymentDiscrepancy.AMOUNT_MISMATCH, 'cs_amount', amount_payment.pk, 200000, 150000),
+                (PaymentDiscrepancy.MISSING_PAYMENT, 'cs_no_payment', None, 150000, None),
+                (PaymentDiscrepancy.MISSING_SESSION, 'cs_no_session', lost_payment.pk, None, 150000),
+            ]
+        )
+
+    def test_cent_difference_is_a_mismatch(self):
+        self.add_session('cs_cents', timedelta(minutes=10), amount_total=1999)
+        payment = self.add_payment('cs_cents', timedelta(minutes=10), amount=Decimal('19.98'))
+
+        run = self.reconcile(hours=1)
+
+        self.assertEqual(
+            list(run.discrepancies.values_list('kind', 'payment', 'stripe_amount', 'payment_amount')),
+            [(PaymentDiscrepancy.AMOUNT_MISMATCH, payment.pk, 1999, 1998)]
+        )
+
+    @override_settings(STRIPE_PAGE_SIZE=2)
+    def test_sessions_are_paged(self):
+        for number in range(5):
+            self.add_session(f'cs_{number}', timedelta(minutes=number))
+            self.add_payment(f'cs_{number}', timedelta(minutes=number))
+
+        run = self.reconcile(hours=1)
+
+        self.assertEqual((run.sessions_checked, run.discrepancies_count), (5, 0))
+        pages = [request for request in self.stripe.requests if request['method'] == 'GET']
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(pages[1]['params']['starting_after'], 'cs_3')
+
+    def test_slice_boundaries(self):
+        for minutes in (0, 59, 60, 179):
+            self.add_session(f'cs_{minutes}', timedelta(minutes=minutes))
+            self.add_payment(f'cs_{minutes}', timedelta(minutes=minutes))
+
+        run = self.reconcile()
+
+        self.assertEqual((run.sessions_checked, run.payments_checked, run.discrepancies_count), (4, 4, 0))
+        self.assertEqual(len([request for request in self.stripe.requests if request['method'] == 'GET']), 3)
+
+    def test_task_uses_recent_window(self):
+        now = timezone.now().replace(microsecond=0)
+        self.start = now - timedelta(hours=5)
+        self.add_session('cs_recent', timedelta())
+
+        run_id = reconcile_stripe_payments()
+
+        discrepancy = PaymentDiscrepancy.objects.get(run_id=run_id)
+        self.assertEqual(discrepancy.stripe_session_id, 'cs_recent')
+
+
+def make_image(name='preview.png', size=(1200, 600), color='red', mode='RGB'):
+    buffer = io.BytesIO()
+    Image.new(mode, size, color).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ThumbnailTestCase(APITestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        # the courses created here are not synced with Stripe
+        stripe_sync = patch('main.tasks.sync_course_with_stripe.delay')
+        stripe_sync.start()
+        self.addCleanup(stripe_sync.stop)
+
+        self.user = User.objects.create(email='owner@test.com', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def create_course(self, name='TestCourse', **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            course = Course.objects.create(course_name=name, course_description=f'{name} description',
+                                           owner=self.user, **fields)
+        course.refresh_from_db()
+        return course
+
+    def save(self, instance):
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.save()
+        instance.refresh_from_db()
+
+    def test_renditions_are_generated(self):
+        course = self.create_course(course_preview=make_image())
+
+        renditions = course.course_preview_thumbnails['renditions']
+        self.assertEqual(sorted(renditions, key=int), ['160', '480', '960'])
+        self.assertEqual(course.course_preview_thumbnails['source'], course.course_preview.name)
+        for width, formats in renditions.items():
+            self.assertEqual(sorted(formats), ['jpeg', 'webp'])
+            with default_storage.open(formats['webp']) as stream, Image.open(stream) as image:
+                self.assertEqual((image.format, image.width, image.height), ('WEBP', int(width), int(width) // 2))
+
+        response = self.client.get(reverse('courses:courses-detail', kwargs={'pk': course.pk}),
+                                   HTTP_AUTHORIZATION=self.token)
+        urls = response.json()['course_preview_thumbnails']
+        self.assertEqual(urls['160']['jpeg'], f'http://testserver/media/{renditions["160"]["jpeg"]}')
+
+    def test_small_image_is_not_upscaled(self):
+        course = self.create_course(course_preview=make_image(size=(100, 50)))
+
+        with default_storage.open(course.course_preview_thumbnails['renditions']['960']['jpeg']) as stream:
+            self.assertEqual(Image.open(stream).size, (100, 50))
+
+    def test_transparent_image_gets_white_jpeg_background(self):
+        course = self.create_course(course_preview=make_image(size=(200, 100), color=(0, 0, 0, 0), mode='RGBA'))
+
+        formats = course.course_preview_thumbnails['renditions']['160']
+        with default_storage.open(formats['jpeg']) as stream, Image.open(stream) as image:
+            self.assertTrue(all(channel > 250 for channel in image.getpixel((80, 40))), image.getpixel((80, 40)))
+        with default_storage.open(formats['webp']) as stream, Image.open(stream) as image:
+            self.assertEqual(image.getpixel((80, 40))[3], 0)
+
+    def test_same_image_is_not_encoded_again(self):
+        course = self.create_course(course_preview=make_image())
+        thumbnails = course.course_preview_thumbnails
+
+        with patch('main.thumbnails.render', wraps=render) as rendered:
+            course.course_preview = make_image(name='again.png')
+            self.save(course)
+            other = self.create_course(name='OtherCourse', course_preview=make_image(name='other.png'))
+
+        rendered.assert_not_called()
+        self.assertEqual(course.course_preview_thumbnails['renditions'], thumbnails['renditions'])
+        self.assertEqual(course.course_preview_thumbnails['source'], course.course_preview.name)
+        self.assertEqual(other.course_preview_thumbnails['renditions'], thumbnails['renditions'])
+
+    def test_new_image_replaces_renditions(self):
+        course = self.create_course(course_preview=make_image())
+        thumbnails = course.course_preview_thumbnails
+
+        course.course_preview = make_image(color='blue')
+        self.save(course)
+
+        self.assertNotEqual(course.course_preview_thumbnails['hash'], thumbnails['hash'])
+
+        course.course_preview = None
+        self.save(course)
+        self.assertEqual(course.course_preview_thumbnails, {})
+
+    def test_save_without_upload_is_skipped(self):
+        course = self.create_course(course_preview=make_image())
+
+        with patch('main.tasks.generate_thumbnails.delay') as delay:
+            course.course_name = 'Renamed'
+            self.save(course)
+
+        delay.assert_not_called()
+
+    def test_broken_image(self):
+        broken = SimpleUploadedFile('broken.png', b'not an image', content_type='image/png')
+
+        course = self.create_course(course_preview=broken)
+
+        self.assertEqual(course.course_preview_thumbnails['renditions'], {})
+        self.assertEqual(course.course_preview_thumbnails['source'], course.course_preview.name)
+
+    def test_decompression_bomb(self):
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            course = self.create_course(course_preview=make_image())
+
+        self.assertEqual(course.course_preview_thumbnails['renditions'], {})
+        self.assertEqual(course.course_preview_thumbnails['source'], course.course_preview.name)
+
+    def test_avatar_thumbnails_drop_cached_user(self):
+        self.user.avatar = make_image(name='avatar.png')
+        with patch('main.tasks.generate_thumbnails.delay'):
+            self.save(self.user)
+        CachedJWTAuthentication().get_user(AccessToken.for_user(self.user))
+
+        generate_thumbnails('users.User', self.user.pk, 'avatar')
+
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+    def test_lesson_and_avatar(self):
+        course = self.create_course()
+        with self.captureOnCommitCallbacks(execute=True):
+            lesson = Lesson.objects.create(course=course, lesson_name='Lesson', lesson_description='Text',
+                                           owner=self.user, lesson_preview=make_image())
+        self.user.avatar = make_image(name='avatar.png', color='green')
+        self.save(self.user)
+
+        lesson.refresh_from_db()
+        self.assertIn('160', lesson.lesson_preview_thumbnails['renditions'])
+        self.assertIn('160', self.user.avatar_thumbnails['renditions'])
+
+        response = self.client.get(reverse('courses:lesson_list'), HTTP_AUTHORIZATION=self.token)
+        self.assertIn('webp', response.json()['results'][0]['lesson_preview_thumbnails']['480'])
+
+
+class DroppedStream:
+    """Request body of a client that disconnects after `limit` bytes."""
+
+    def __init__(self, data, limit):
+        self.stream = io.BytesIO(data[:limit])
+
+    def read(self, size):
+        chunk = self.stream.read(size)
+        if not chunk:
+            raise UnreadablePostError('connection reset')
+        return chunk
+
+
+@override_settings(CHUNKED_UPLOAD_READ_SIZE=128)
+class ChunkedUploadTestCase(APITestCase):
+
+    def setUp(self):
+        for setting in ('MEDIA_ROOT', 'CHUNKED_UPLOAD_DIR'):
+            directory = tempfile.TemporaryDirectory()
+            self.addCleanup(directory.cleanup)
+            settings_override = self.settings(**{setting: directory.name})
+            settings_override.enable()
+            self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create(email='owner@test.com', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription',
+                                            owner=self.user)
+        self.image = make_image(size=(600, 400)).read()
+
+    def start(self, size=None, token=None):
+        response = self.client.post(
+            reverse('courses:upload_create'),
+            data={'filename': 'preview.png', 'size': len(self.image) if size is None else size},
+            HTTP_AUTHORIZATION=token or self.token
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.json()['id']
+
+    def send(self, upload_id, offset, data):
+        return self.client.patch(
+            reverse('courses:upload_detail', kwargs={'pk': upload_id}),
+            data=data,
+            content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset),
+            HTTP_AUTHORIZATION=self.token
+        )
+
+    def attach(self, upload_id, target='course', pk=None):
+        return self.client.post(
+            reverse('courses:upload_attach', kwargs={'pk': upload_id}),
+            data={'target': target, 'id': self.course.pk if pk is None else pk},
+            HTTP_AUTHORIZATION=self.token
+        )
+
+    def test_upload_in_chunks_and_attach(self):
+        upload_id = self.start()
+        part = part_path(UploadSession.objects.get())
+        for offset in range(0, len(self.image), 500):
+            response = self.send(upload_id, offset, self.image[offset:offset + 500])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['offset'], min(offset + 500, len(self.image)))
+        self.assertTrue(response.json()['is_complete'])
+
+        response = self.attach(upload_id)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.course.refresh_from_db()
+        with self.course.course_preview.open('rb') as stream:
+            self.assertEqual(stream.read(), self.image)
+        self.assertIn(self.course.course_preview.url, response.json()['course_preview'])
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(part.exists())
+
+    def test_resume_after_conflicting_offset(self):
+        upload_id = self.start()
+        half = len(self.image) // 2
+        self.send(upload_id, 0, self.image[:half])
+
+        # the client lost the response and retries the first part
+        response = self.send(upload_id, 0, self.image[:half])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.json()['offset'], half)
+
+        response = self.client.get(reverse('courses:upload_detail', kwargs={'pk': upload_id}),
+                                   HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.json()['offset'], half)
+
+        response = self.send(upload_id, half, self.image[half:])
+        self.assertTrue(response.json()['is_complete'])
+        self.assertEqual(self.attach(upload_id).status_code, status.HTTP_200_OK)
+
+    def test_resume_after_dropped_connection(self):
+        upload_id = self.start()
+        half = len(self.image) // 2
+
+        session = append_chunk(upload_id, DroppedStream(self.image, half), 0)
+        self.assertEqual(session.offset, half)
+
+        # bytes of a request that died before its offset was stored are dropped
+        with part_path(session).open('ab') as part:
+            part.write(b'garbage')
+        response = self.send(upload_id, half, self.image[half:])
+
+        self.assertTrue(response.json()['is_complete'])
+        self.assertEqual(part_path(session).read_bytes(), self.image)
+
+    def test_chunk_finished_by_another_request_while_streaming(self):
+        upload_id = self.start()
+        half = len(self.image) // 2
+        self.send(upload_id, 0, self.image[:half])
+
+        class RacingStream(io.BytesIO):
+            def read(stream, size):
+                # the row is not locked while the body is read, a retry of the same chunk completes meanwhile
+                if stream.tell() == 0:
+                    self.send(upload_id, half, self.image[half:])
+                return super().read(size)
+
+        with self.assertRaises(OffsetConflict):
+            append_chunk(upload_id, RacingStream(self.image[half:]), half)
+
+        self.assertEqual(UploadSession.objects.get().offset, len(self.image))
+        self.assertEqual(part_path(UploadSession.objects.get()).read_bytes(), self.image)
+
+    def test_chunk_beyond_size(self):
+        upload_id = self.start(size=10)
+
+        response = self.send(upload_id, 5, b'0123456789')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(UploadSession.objects.get().offset, 0)
+
+    def test_attach_checks(self):
+        upload_id = self.start()
+        self.send(upload_id, 0, self.image[:100])
+        self.assertEqual(self.attach(upload_id).status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.send(upload_id, 100, self.image[100:])
+        other = User.objects.create(email='other@test.com', password='other')
+        foreign_course = Course.objects.create(course_name='Foreign', course_description='Text', owner=other)
+        self.assertEqual(self.attach(upload_id, pk=foreign_course.pk).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.attach(upload_id, target='user', pk=other.pk).status_code, status.HTTP_403_FORBIDDEN)
+
+        other_token = f'Bearer {AccessToken.for_user(other)}'
+        response = self.client.get(reverse('courses:upload_detail', kwargs={'pk': upload_id}),
+                                   HTTP_AUTHORIZATION=other_token)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertEqual(self.attach(upload_id, target='user', pk=self.user.pk).status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.avatar.name.startswith('users/'))
+
+    def test_attach_rejects_non_images(self):
+        self.image = b'not an image at all'
+        upload_id = self.start()
+        self.send(upload_id, 0, self.image)
+
+        response = self.attach(upload_id)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.course.course_preview)
+
+    def test_attach_rejects_decompression_bombs(self):
+        upload_id = self.start()
+        self.send(upload_id, 0, self.image)
+
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            response = self.attach(upload_id)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), ['Изображение слишком большое'])
+        self.course.refresh_from_db()
+        self.assertFalse(self.course.course_preview)
+
+    def test_stale_uploads_are_deleted(self):
+        upload_id = self.start()
+        self.send(upload_id, 0, self.image[:100])
+        session = UploadSession.objects.get()
+        UploadSession.objects.filter(pk=upload_id).update(updated_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(delete_stale_uploads(), 1)
+
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(part_path(session).exists())
+
+
+class SearchTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.com', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(course_name='Python для начинающих', owner=self.user,
+                                            course_description='Основы программирования')
+        self.lesson = Lesson.objects.create(course=self.course, lesson_name='Списки', owner=self.user,
+                                            lesson_description='Работа со списками в Python')
+        self.other = User.objects.create(email='other@test.com', password='other')
+        Course.objects.create(course_name='Python для профи', course_description='Чужой курс', owner=self.other)
+
+    def search(self, token=None, **params):
+        response = self.client.get(reverse('courses:search'), data=params, HTTP_AUTHORIZATION=token or self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_results_are_ranked(self):
+        data = self.search(q='python')
+
+        self.assertEqual(data['count'], 2)
+        # a match in the name outranks a match in the description
+        self.assertEqual([(item['kind'], item['id']) for item in data['results']],
+                         [('course', self.course.pk), ('lesson', self.lesson.pk)])
+        self.assertEqual(data['results'][1]['course'], self.course.pk)
+        self.assertGreater(data['results'][0]['rank'], data['results'][1]['rank'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.course.course_name = 'Django'
+        self.course.save()
+        self.assertEqual(self.search(q='django')['count'], 1)
+        self.assertEqual([item['kind'] for item in self.search(q='python')['results']], ['lesson'])
+
+        self.lesson.delete()
+        self.assertEqual(self.search(q='python')['count'], 0)
+
+    def test_bulk_lessons_are_indexed(self):
+        self.client.post(reverse('courses:lesson_bulk'), format='json', HTTP_AUTHORIZATION=self.token, data=[
+            {'course': self.course.course_name, 'lesson_name': 'Словари', 'lesson_description': 'Ключи'},
+        ])
+        lesson = Lesson.objects.get(lesson_name='Словари')
+        with patch('main.views.schedule_update_notification'):
+            self.client.patch(reverse('courses:lesson_bulk'), format='json', HTTP_AUTHORIZATION=self.token, data=[
+                {'id': self.lesson.pk, 'lesson_name': 'Кортежи'},
+            ])
+
+        self.assertEqual([item['id'] for item in self.search(q='словари')['results']], [lesson.pk])
+        self.assertEqual([item['id'] for item in self.search(q='кортежи')['results']], [self.lesson.pk])
+
+    def test_scope_type_and_pagination(self):
+        moderator = User.objects.create(email='moderator@test.com', password='moderator', role=UserRoles.MODERATOR)
+        moderator_token = f'Bearer {AccessToken.for_user(moderator)}'
+
+        self.assertEqual(self.search(token=moderator_token, q='python')['count'], 3)
+        self.assertEqual(self.search(token=moderator_token, q='python', type='course')['count'], 2)
+
+        data = self.search(token=moderator_token, q='python', per_page=2, page=2)
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(len(data['results']), 1)
+
+    def test_postgres_queryset_compiles(self):
+        from django.db.backends.postgresql.base import DatabaseWrapper
+
+        postgres = DatabaseWrapper({**connection.settings_dict, 'ENGINE': 'django.db.backends.postgresql'})
+        queryset = SearchResults('python', owner=self.user).get_queryset()
+
+        sql, params = queryset.query.get_compiler(connection=postgres).as_sql()
+
+        self.assertIn('UNION ALL', sql)
+        self.assertIn('"main_lesson"."course_id" AS "lesson_course"', sql)
+        self.assertIn('ts_rank', sql)
+
+    def test_query_validation(self):
+        response = self.client.get(reverse('courses:search'), HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(self.search(q='"*:()')['count'], 0)
+
+
+class SparseFieldsetTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.com', password='owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        CachedJWTAuthentication().get_user(AccessToken.for_user(self.user))
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription',
+                                            owner=self.user)
+        for index in range(3):
+            Lesson.objects.create(course=self.course, lesson_name=f'Lesson {index}', owner=self.user,
+                                  lesson_description=f'Long description {index} ' * 100)
+            Payment.objects.create(user=self.user, owner=self.user, course=self.course, date=timezone.now(),
+                                   amount=100, method='CASH')
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, data=params, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sql = [query['sql'] for query in context.captured_queries]
+        return response, sql
+
+    def select_from(self, sql, table):
+        return next(query for query in sql if f'FROM "{table}"' in query and 'COUNT(' not in query)
+
+    def test_lesson_list_fields(self):
+        full_response, _ = self.get(reverse('courses:lesson_list'))
+        response, sql = self.get(reverse('courses:lesson_list'), fields='id,lesson_name')
+
+        self.assertEqual([set(lesson) for lesson in response.json()['results']], [{'id', 'lesson_name'}] * 3)
+        self.assertLess(len(response.content), len(full_response.content) / 10)
+        query = self.select_from(sql, 'main_lesson')
+        self.assertNotIn('lesson_description', query)
+        self.assertNotIn('JOIN', query)
+
+    def test_lesson_list_exclude(self):
+        response, sql = self.get(reverse('courses:lesson_list'), exclude='lesson_description')
+
+        lesson = response.json()['results'][0]
+        self.assertNotIn('lesson_description', lesson)
+        self.assertEqual(lesson['course'], 'TestCourse')
+        query = self.select_from(sql, 'main_lesson')
+        self.assertNotIn('lesson_description', query)
+        self.assertNotIn('course_description', query)
+        self.assertIn('JOIN "main_course"', query)
+
+    def test_cursor_pagination_with_fields(self):
+        response, _ = self.get(reverse('courses:lesson_list'), fields='lesson_name', cursor='', per_page=2)
+        next_url = response.json()['next']
+
+        response = self.client.get(next_url, HTTP_AUTHORIZATION=self.token)
+
+        self.assertEqual(response.json()['results'], [{'lesson_name': 'Lesson 0'}])
+
+    def test_course_list_skips_unused_lookups(self):
+        _, full_sql = self.get(reverse('courses:courses-list'))
+        response, sql = self.get(reverse('courses:courses-list'), fields='id,course_name')
+
+        self.assertEqual(response.json()['results'], [{'id': self.course.pk, 'course_name': 'TestCourse'}])
+        self.assertLess(len(sql), len(full_sql))
+        self.assertFalse([query for query in sql if 'main_lesson' in query])
+
+    def test_payment_relations_are_joined(self):
+        _, sql = self.get(reverse('courses:payments_list'))
+        self.assertFalse([query for query in sql if query.startswith('SELECT') and 'FROM "main_course"' in query])
+
+        response, sql = self.get(reverse('courses:payments_list'), fields='id,amount')
+        self.assertEqual(set(response.json()[0]), {'id', 'amount'})
+        self.assertNotIn('JOIN', self.select_from(sql, 'main_payment'))
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse('courses:lesson_list'), data={'fields': 'id,password'},
+                                   HTTP_AUTHORIZATION=self.token)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('password', response.json()['fields'])
+
+
+class FastListParityTestCase(APITestCase):
+    """The values() path of the lesson and payment lists must return exactly what the serializers return."""
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.com', password='owner', first_name='Owner')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        self.course = Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription',
+                                            owner=self.user)
+        self.lessons = [
+            Lesson.objects.create(course=self.course, lesson_name='Plain', lesson_description='Text',
+                                  owner=self.user),
+            Lesson.objects.create(course=self.course, lesson_name='With media', lesson_description='Text 2',
+                                  owner=self.user, video_url='https://youtu.be/abc',
+                                  lesson_preview='main/lesson/preview.png'),
+        ]
+        Lesson.objects.filter(pk=self.lessons[1].pk).update(lesson_preview_thumbnails={
+            'source': 'main/lesson/preview.png', 'hash': 'abc',
+            'renditions': {'160': {'webp': 'thumbnails/ab/abc/160.webp'}},
+        })
+        Payment.objects.create(user=self.user, owner=self.user, course=self.course, date=timezone.now(),
+                               amount=100, method='CASH')
+        Payment.objects.create(user=self.user, owner=self.user, lesson=self.lessons[0], date=timezone.now(),
+                               amount=10, method='TRANSFER')
+        Payment.objects.create(owner=self.user, date=timezone.now(), amount=5, method='STRIPE',
+                               stripe_session_id='cs_test_1')
+
+    def get(self, view, url, fast, **params):
+        cache.clear()
+        with patch.object(view, 'fast_list', fast):
+            response = self.client.get(url, data=params, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def assertParity(self, view, url, **params):
+        fast = self.get(view, url, True, **params)
+        self.assertEqual(fast, self.get(view, url, False, **params))
+        return fast
+
+    def test_lesson_list(self):
+        data = self.assertParity(LessonListAPIView, reverse('courses:lesson_list'))
+
+        lesson = next(item for item in data['results'] if item['id'] == self.lessons[1].pk)
+        self.assertEqual(lesson['course'], 'TestCourse')
+        self.assertTrue(lesson['lesson_preview'].startswith('http://testserver/'))
+        self.assertTrue(lesson['lesson_preview_thumbnails']['160']['webp'].endswith('/160.webp'))
+
+    def test_lesson_list_cursor_and_fieldsets(self):
+        url = reverse('courses:lesson_list')
+        first_page = self.assertParity(LessonListAPIView, url, cursor='', per_page=1)
+        self.assertParity(LessonListAPIView, first_page['next'])
+        self.assertParity(LessonListAPIView, url, fields='lesson_name,course')
+        self.assertParity(LessonListAPIView, url, exclude='lesson_description,lesson_preview_thumbnails')
+
+    def test_payment_list(self):
+        url = reverse('courses:payments_list')
+        data = self.assertParity(PaymentListAPIView, url)
+        self.assertEqual({payment['course'] for payment in data}, {'TestCourse', None})
+
+        self.assertParity(PaymentListAPIView, url, cursor='', per_page=2)
+        self.assertParity(PaymentListAPIView, url, fields='id,lesson,user', method='TRANSFER')
+
+    def test_no_model_instances_are_created(self):
+        created = []
+        receiver = lambda sender, **kwargs: created.append(sender)  # noqa: E731
+        for model in (Lesson, Payment):
+            post_init.connect(receiver, sender=model)
+            self.addCleanup(post_init.disconnect, receiver, sender=model)
+
+        self.get(LessonListAPIView, reverse('courses:lesson_list'), True)
+        self.get(PaymentListAPIView, reverse('courses:payments_list'), True)
+
+        self.assertEqual(created, [])
+
+    def test_unsupported_serializer_falls_back(self):
+        request = Request(APIRequestFactory().get('/'))
+        request.user = self.user
+
+        self.assertIsNone(RowMapper.compile(CourseSerializer(context={'request': request})))
+        self.assertIsNotNone(RowMapper.compile(LessonSerializer(context={'request': request})))
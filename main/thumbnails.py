@@ -0,0 +1,92 @@
+import hashlib
+import io
+import logging
+from typing import Dict
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnails_field_name(field_name: str) -> str:
+    return f'{field_name}_thumbnails'
+
+
+def file_hash(field_file) -> str:
+    digest = hashlib.sha256()
+    with field_file.open('rb') as stream:
+        for chunk in stream.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def rendition_name(source_hash: str, width: int, extension: str) -> str:
+    # named after the content, so the same image uploaded twice shares its renditions
+    return f'thumbnails/{source_hash[:2]}/{source_hash}/{width}.{extension}'
+
+
+def render(image: Image.Image, width: int, image_format: str) -> ContentFile:
+    rendition = image.copy()
+    rendition.thumbnail((width, width * 10), Image.Resampling.LANCZOS)
+    if image_format == 'JPEG' and rendition.mode != 'RGB':
+        # JPEG has no alpha channel, transparent pixels would turn black without a background
+        background = Image.new('RGBA', rendition.size, 'white')
+        rendition = Image.alpha_composite(background, rendition.convert('RGBA')).convert('RGB')
+    buffer = io.BytesIO()
+    rendition.save(buffer, format=image_format, quality=settings.THUMBNAIL_QUALITY, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_renditions(field_file, source_hash: str) -> Dict[str, Dict[str, str]]:
+    renditions = {}
+    image = None
+    for width in settings.THUMBNAIL_WIDTHS:
+        for extension, image_format in settings.THUMBNAIL_FORMATS.items():
+            name = rendition_name(source_hash, width, extension)
+            if not default_storage.exists(name):
+                if image is None:
+                    with field_file.open('rb') as stream:
+                        image = ImageOps.exif_transpose(Image.open(stream))
+                        image.load()
+                    if image.mode not in ('RGB', 'RGBA'):
+                        image = image.convert('RGBA')
+                default_storage.save(name, render(image, width, image_format))
+            renditions.setdefault(str(width), {})[extension] = name
+    return renditions
+
+
+def needs_thumbnails(instance, field_name: str) -> bool:
+    field_file = getattr(instance, field_name)
+    thumbnails = getattr(instance, thumbnails_field_name(field_name)) or {}
+    return (field_file.name or None) != thumbnails.get('source')
+
+
+def update_thumbnails(model, pk: int, field_name: str) -> bool:
+    """
+    Stores {'source', 'hash', 'renditions'} of the current upload in <field>_thumbnails, returns False
+    if they were already current. Content seen before (same hash) is not decoded or encoded again.
+    """
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not needs_thumbnails(instance, field_name):
+        return False
+
+    field_file = getattr(instance, field_name)
+    thumbnails = getattr(instance, thumbnails_field_name(field_name)) or {}
+    if not field_file:
+        thumbnails = {}
+    else:
+        source_hash = file_hash(field_file)
+        if source_hash != thumbnails.get('hash'):
+            try:
+                thumbnails = {'hash': source_hash, 'renditions': generate_renditions(field_file, source_hash)}
+            except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as error:
+                logger.error(f'Не удалось уменьшить {field_file.name}: {error}')
+                thumbnails = {'hash': source_hash, 'renditions': {}}
+        thumbnails['source'] = field_file.name
+
+    # update() leaves updated_at alone and doesn't send post_save back into the pipeline
+    model.objects.filter(pk=pk).update(**{thumbnails_field_name(field_name): thumbnails})
+    return True
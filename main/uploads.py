@@ -0,0 +1,118 @@
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.http import UnreadablePostError
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from main.models import Course, Lesson, UploadSession
+from users.models import User, UserRoles
+
+logger = logging.getLogger(__name__)
+
+# target name in the attach request -> model and image field the upload goes to
+UPLOAD_TARGETS = {
+    'course': (Course, 'course_preview'),
+    'lesson': (Lesson, 'lesson_preview'),
+    'user': (User, 'avatar'),
+}
+
+
+class OffsetConflict(Exception):
+
+    def __init__(self, session: UploadSession):
+        super().__init__(f'Ожидалось смещение {session.offset}')
+        self.session = session
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def part_path(session: UploadSession) -> Path:
+    return Path(settings.CHUNKED_UPLOAD_DIR) / f'{session.pk}.part'
+
+
+def receive_chunk(session: UploadSession, stream, part) -> int:
+    """Copies the request body to `part` and returns how many bytes arrived before the client dropped."""
+    received = 0
+    try:
+        while stream is not None:
+            chunk = stream.read(settings.CHUNKED_UPLOAD_READ_SIZE)
+            if not chunk:
+                break
+            if session.offset + received + len(chunk) > session.size:
+                raise UploadTooLarge(f'Получено больше {session.size} байт')
+            part.write(chunk)
+            received += len(chunk)
+    except (UnreadablePostError, OSError) as error:
+        logger.warning(f'Загрузка {session.pk} прервана на {session.offset + received} байт: {error}')
+    return received
+
+
+def append_chunk(session_id, stream, offset: int) -> UploadSession:
+    """
+    Streams the request body to a temporary file without holding any lock, then appends it to the part file
+    under a short row lock. Whatever arrived before the client dropped is kept, so the next chunk can continue
+    from the returned session.offset.
+    """
+    session = UploadSession.objects.get(pk=session_id)
+    if offset != session.offset:
+        raise OffsetConflict(session)
+
+    path = part_path(session)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryFile(dir=path.parent) as chunk:
+        received = receive_chunk(session, stream, chunk)
+        chunk.seek(0)
+
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().get(pk=session_id)
+            # another request for the same offset may have finished while this one was streaming
+            if offset != session.offset:
+                raise OffsetConflict(session)
+            with path.open('ab') as part:
+                # drop bytes of an earlier request that never made it into session.offset
+                part.truncate(session.offset)
+                shutil.copyfileobj(chunk, part)
+            session.offset += received
+            session.save(update_fields=['offset', 'updated_at'])
+    return session
+
+
+def can_attach(user: User, instance) -> bool:
+    if isinstance(instance, User):
+        return instance.pk == user.pk
+    return instance.owner_id == user.pk or user.role == UserRoles.MODERATOR
+
+
+def attach_upload(session: UploadSession, instance, field_name: str) -> None:
+    path = part_path(session)
+    with path.open('rb') as part:
+        try:
+            with Image.open(part) as image:
+                image.verify()
+        except Image.DecompressionBombError:
+            raise ValueError('Изображение слишком большое')
+        except (UnidentifiedImageError, OSError):
+            raise ValueError('Файл не является изображением')
+        part.seek(0)
+        # the storage copies the part file chunk by chunk, it is never read into memory at once
+        getattr(instance, field_name).save(session.filename, File(part), save=True)
+    path.unlink()
+    session.delete()
+
+
+def delete_stale_uploads() -> int:
+    stale = UploadSession.objects.filter(updated_at__lt=timezone.now() - settings.CHUNKED_UPLOAD_TTL)
+    deleted = 0
+    for session in stale.iterator():
+        part_path(session).unlink(missing_ok=True)
+        session.delete()
+        deleted += 1
+    return deleted
@@ -2,7 +2,9 @@ from django.urls import path
 from main.apps import MainConfig
 from rest_framework.routers import DefaultRouter
 from main.views import CourseViewSet, LessonCreateAPIView, LessonListAPIView, LessonRetrieveAPIView, \
-    LessonUpdateAPIView, LessonDestroyAPIView, PaymentRetrieveAPIView, PaymentListAPIView, SubscriptionViewSet
+    LessonUpdateAPIView, LessonDestroyAPIView, PaymentRetrieveAPIView, PaymentListAPIView, SubscriptionViewSet, \
+    LessonBulkAPIView, PaymentExportAPIView, PaymentImportAPIView, UploadSessionCreateAPIView, UploadSessionAPIView, \
+    UploadAttachAPIView, SearchAPIView
 
 app_name = MainConfig.name
 
@@ -13,12 +15,21 @@ router.register(r'subscription', SubscriptionViewSet, basename='subscription')
 
 urlpatterns = [
     path('lesson/create/', LessonCreateAPIView.as_view(), name='lesson_create'),
+    path('lesson/bulk/', LessonBulkAPIView.as_view(), name='lesson_bulk'),
     path('lesson/', LessonListAPIView.as_view(), name='lesson_list'),
     path('lesson/<int:pk>', LessonRetrieveAPIView.as_view(), name='lesson_get'),
     path('lesson/update/<int:pk>/', LessonUpdateAPIView.as_view(), name='lesson_update'),
     path('lesson/delete/<int:pk>/', LessonDestroyAPIView.as_view(), name='lesson_delete'),
 
     path('payments/', PaymentListAPIView.as_view(), name='payments_list'),
+    path('payments/export/', PaymentExportAPIView.as_view(), name='payments_export'),
+    path('payments/import/', PaymentImportAPIView.as_view(), name='payments_import'),
     path('payments/<int:pk>/', PaymentRetrieveAPIView.as_view(), name='payments_get'),
 
+    path('search/', SearchAPIView.as_view(), name='search'),
+
+    path('uploads/', UploadSessionCreateAPIView.as_view(), name='upload_create'),
+    path('uploads/<uuid:pk>/', UploadSessionAPIView.as_view(), name='upload_detail'),
+    path('uploads/<uuid:pk>/attach/', UploadAttachAPIView.as_view(), name='upload_attach'),
+
 ] + router.urls
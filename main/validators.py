@@ -1,21 +1,80 @@
-from rest_framework.serializers import ValidationError
 import re
+from functools import lru_cache
+from typing import FrozenSet, Iterable, Iterator, Optional, Tuple
+
+from django.conf import settings
+from rest_framework.serializers import ValidationError
+
+from main.models import make_content_hash
+
+# dot-separated chains like www.youtube.com or пример.рф. Labels can't overlap and matches only start at
+# a label edge, so every character is scanned a bounded number of times, whatever the input
+LINK_PATTERN = re.compile(r'(?<![\w-])[\w-]+(?:\.[\w-]+)+')
+# letters of any script, or the punycode form of an internationalized domain: рф, xn--p1ai
+TLD_PATTERN = re.compile(r'[^\W\d_]{2,}|xn--[a-z0-9-]+', re.IGNORECASE)
+
+
+def iter_hosts(text: str) -> Iterator[str]:
+    for match in LINK_PATTERN.finditer(text):
+        labels = match.group().split('.')
+        # the host ends at the last label that can be a top-level domain: "youtube.com." or "site.com.1"
+        for end in range(len(labels) - 1, 0, -1):
+            if TLD_PATTERN.fullmatch(labels[end]):
+                yield '.'.join(labels[:end + 1])
+                break
+
+
+@lru_cache(maxsize=None)
+def build_domain_index(domains: Tuple[str, ...]) -> FrozenSet[str]:
+    return frozenset(domain.lower().removeprefix('www.') for domain in domains)
+
+
+def is_allowed_host(host: str, allowed: FrozenSet[str]) -> bool:
+    # a host is allowed when it or any of its parent domains is in the index: m.youtube.com -> youtube.com
+    labels = host.lower().split('.')
+    return any('.'.join(labels[index:]) in allowed for index in range(len(labels) - 1))
 
 
 class LinksValidator:
 
-    def __init__(self, fields):
+    def __init__(self, fields, allowed_domains: Optional[Iterable[str]] = None):
         self.fields = fields
+        self.allowed_domains = build_domain_index(tuple(allowed_domains)) if allowed_domains is not None else None
 
     def __call__(self, value):
         for field in self.fields:
-            text = value.get(field, '')
+            text = value.get(field) or ''
             if self.has_external_links(text):
                 raise ValidationError('Forbidden link')
 
+    def get_allowed_domains(self) -> FrozenSet[str]:
+        if self.allowed_domains is not None:
+            return self.allowed_domains
+        return build_domain_index(tuple(settings.ALLOWED_LINK_DOMAINS))
+
     def has_external_links(self, text):
-        links = re.findall(r'(?:https?://|www\.)?([^\s./?#]+)(?:\.[^\s./?#]+)', text)
-        for link in links:
-            if 'youtube.com' not in link:
+        allowed = self.get_allowed_domains()
+        for host in iter_hosts(text):
+            if not is_allowed_host(host, allowed):
                 return True
         return False
+
+
+class UniqueContentValidator:
+    """Name + description uniqueness checked through the indexed content_hash column."""
+    requires_context = True
+
+    def __init__(self, queryset, message='Запись с таким названием и описанием уже существует'):
+        self.queryset = queryset
+        self.message = message
+
+    def __call__(self, attrs, serializer):
+        instance = serializer.instance
+        values = [attrs.get(field, getattr(instance, field, None)) for field in self.queryset.model.content_fields]
+        if None in values:
+            return
+        queryset = self.queryset.filter(content_hash=make_content_hash(*values))
+        if instance is not None:
+            queryset = queryset.exclude(pk=instance.pk)
+        if queryset.exists():
+            raise ValidationError(self.message, code='unique')
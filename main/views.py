@@ -1,41 +1,94 @@
+import codecs
+import io
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django.views.generic import TemplateView
-from rest_framework import viewsets, generics
+from django.db import transaction
+from rest_framework import viewsets, generics, status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import OrderingFilter
 
-from main.models import Course, Lesson, Payment, Subscription
-from main.serializers import CourseSerializer, LessonSerializer, PaymentSerializer, SubscriptionSerializer
-from rest_framework.exceptions import PermissionDenied
+from main.fast_lists import FastListMixin
+from main.fieldsets import SparseFieldsetMixin
+from main.importers import PaymentImporter, iter_rows
+from main.uploads import UPLOAD_TARGETS, OffsetConflict, UploadTooLarge, append_chunk, attach_upload, can_attach
+from main.models import Course, Lesson, Payment, Subscription, UploadSession
+from main.serializers import CourseSerializer, LessonSerializer, LessonBulkSerializer, LessonBulkListSerializer, \
+    PaymentSerializer, SubscriptionSerializer, SubscriptionActionSerializer, UploadSessionSerializer, \
+    UploadAttachSerializer, SearchQuerySerializer, SearchResultSerializer
+from main.search import SearchResults, index_objects
+from main.signals import invalidate_bulk_changes
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from main.permissions import IsModeratorOrReadOnly, IsCourseOrLessonOwner, IsPaymentOwner, IsCourseOwner
 from users.models import UserRoles
-from main.paginators import LessonsPaginator
+from main.caching import CachedResponseMixin, ConditionalGetMixin, bump_version, get_subscribed_course_ids, \
+    invalidate_subscribed_course_ids
+from main.renderers import CSVStreamRenderer, NDJSONStreamRenderer
+from main.paginators import LessonsPaginator, CursorOrPageNumberPaginator, PaymentsPaginator
 from rest_framework.serializers import Serializer
 
-import stripe
+from main.stripe_client import StripeError, build_checkout_session_params, get_stripe_client
+from main.stripe_webhooks import WebhookNotConfigured, store_event, verify_event
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.views import View
 from .models import Course
 
 import logging
-from datetime import datetime
-from .tasks import was_updated_recently, send_course_update_notifications, send_lesson_update_notifications
+from .tasks import schedule_update_notification, schedule_stripe_events_drain
 
 logger = logging.getLogger(__name__)
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(SparseFieldsetMixin, ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     serializer_class = CourseSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOwner]
-    pagination_class = LessonsPaginator
+    pagination_class = CursorOrPageNumberPaginator
+    cache_dependencies = (Course, Lesson, Subscription)
+    fieldset_always_load = ('updated_at',)
 
-    def get_queryset(self):
+    def get_response_cache_scope(self):
+        # is_subscribed differs between users, so course responses are never shared
+        return f'{self.request.user.role}:{self.request.user.pk}'
+
+    def get_scoped_queryset(self):
         if self.request.user.role == UserRoles.MODERATOR:
             return Course.objects.all()
         else:
             return Course.objects.filter(owner=self.request.user)
 
+    def get_conditional_queryset(self):
+        return self.filter_queryset(self.get_scoped_queryset())
+
+    def get_queryset(self):
+        # a correlated subquery instead of Count('lesson') keeps the outer query ungrouped,
+        # so the (owner, updated_at) index can serve both the filter and the ordering
+        queryset = self.get_scoped_queryset().order_by('pk')
+        if self.includes_field('lessons_count'):
+            lessons_count = Lesson.objects.filter(course=OuterRef('pk')).order_by().values('course').annotate(
+                count=Count('pk'),
+            ).values('count')
+            queryset = queryset.annotate(lessons_count=Coalesce(Subquery(lessons_count), 0))
+        if self.includes_field('lessons'):
+            queryset = queryset.prefetch_related(Prefetch('lesson_set', queryset=Lesson.objects.order_by('pk')))
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.includes_field('is_subscribed'):
+            context['subscribed_course_ids'] = get_subscribed_course_ids(self.request.user.pk)
+        return context
+
     def perform_create(self, serializer):
         if self.request.user.role == UserRoles.MODERATOR:
             raise PermissionDenied("Вы не можете создавать курсы")
@@ -50,11 +103,8 @@ class CourseViewSet(viewsets.ModelViewSet):
         instance.delete()
 
     def perform_update(self, serializer: Serializer) -> None:
-        instance = self.get_object()
-        last_course_update = instance.updated_at
         instance = serializer.save()
-        if not was_updated_recently(last_course_update):
-            send_course_update_notifications.delay(instance.id)
+        schedule_update_notification(instance.id, f'Курс "{instance.course_name}"')
 
 
 class LessonCreateAPIView(generics.CreateAPIView):
@@ -70,28 +120,70 @@ class LessonCreateAPIView(generics.CreateAPIView):
         new_lesson.save()
 
 
-class LessonListAPIView(generics.ListAPIView):
+class LessonBulkAPIView(generics.GenericAPIView):
+    serializer_class = LessonBulkSerializer
+    permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOrLessonOwner]
+
+    def get_queryset(self):
+        if self.request.user.role == UserRoles.MODERATOR:
+            return Lesson.objects.select_related('course')
+        else:
+            return Lesson.objects.filter(owner=self.request.user).select_related('course')
+
+    def post(self, request, *args, **kwargs):
+        if self.request.user.role == UserRoles.MODERATOR:
+            raise PermissionDenied("Вы не можете создать урок")
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            lessons = serializer.save(owner=self.request.user)
+            index_objects(Lesson, [lesson.pk for lesson in lessons])
+        invalidate_bulk_changes(Lesson)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def patch(self, request, *args, **kwargs):
+        ids = LessonBulkListSerializer.get_instance_ids(request.data)
+        lessons = list(self.get_queryset().filter(pk__in=ids))
+        for lesson in lessons:
+            self.check_object_permissions(request, lesson)
+        serializer = self.get_serializer(lessons, data=request.data, many=True, partial=True)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            serializer.save()
+            index_objects(Lesson, [lesson.pk for lesson in lessons])
+        invalidate_bulk_changes(Lesson)
+        for course_id, lesson_name in {(lesson.course_id, lesson.lesson_name) for lesson in lessons}:
+            schedule_update_notification(course_id, f'Урок "{lesson_name}"')
+        return Response(serializer.data)
+
+
+class LessonListAPIView(SparseFieldsetMixin, ConditionalGetMixin, CachedResponseMixin, FastListMixin,
+                        generics.ListAPIView):
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOrLessonOwner]
-    pagination_class = LessonsPaginator
+    pagination_class = CursorOrPageNumberPaginator
+    cache_dependencies = (Lesson, Course)
+    fieldset_always_load = ('updated_at',)
+    fast_list_keys = ('updated_at',)
 
     def get_queryset(self):
         if self.request.user.role == UserRoles.MODERATOR:
-            return Lesson.objects.all()
+            return Lesson.objects.select_related('course')
         else:
-            return Lesson.objects.filter(owner=self.request.user)
+            return Lesson.objects.filter(owner=self.request.user).select_related('course')
 
 
-class LessonRetrieveAPIView(generics.RetrieveAPIView):
+class LessonRetrieveAPIView(ConditionalGetMixin, CachedResponseMixin, generics.RetrieveAPIView):
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOrLessonOwner]
     pagination_class = LessonsPaginator
+    cache_dependencies = (Lesson, Course)
 
     def get_queryset(self):
         if self.request.user.role == UserRoles.MODERATOR:
-            return Lesson.objects.all()
+            return Lesson.objects.select_related('course')
         else:
-            return Lesson.objects.filter(owner=self.request.user)
+            return Lesson.objects.filter(owner=self.request.user).select_related('course')
 
 
 class LessonUpdateAPIView(generics.UpdateAPIView):
@@ -101,9 +193,13 @@ class LessonUpdateAPIView(generics.UpdateAPIView):
 
     def get_queryset(self):
         if self.request.user.role == UserRoles.MODERATOR:
-            return Lesson.objects.all()
+            return Lesson.objects.select_related('course')
         else:
-            return Lesson.objects.filter(owner=self.request.user)
+            return Lesson.objects.filter(owner=self.request.user).select_related('course')
+
+    def perform_update(self, serializer: Serializer) -> None:
+        instance = serializer.save()
+        schedule_update_notification(instance.course_id, f'Урок "{instance.lesson_name}"')
 
 
 class LessonDestroyAPIView(generics.DestroyAPIView):
@@ -112,9 +208,9 @@ class LessonDestroyAPIView(generics.DestroyAPIView):
 
     def get_queryset(self):
         if self.request.user.role == UserRoles.MODERATOR:
-            return Lesson.objects.all()
+            return Lesson.objects.select_related('course')
         else:
-            return Lesson.objects.filter(owner=self.request.user)
+            return Lesson.objects.filter(owner=self.request.user).select_related('course')
 
     def perform_destroy(self, instance):
         if self.request.user.role == UserRoles.MODERATOR:
@@ -122,13 +218,33 @@ class LessonDestroyAPIView(generics.DestroyAPIView):
         instance.delete()
 
 
-class PaymentListAPIView(generics.ListAPIView):
+class SearchAPIView(generics.GenericAPIView):
+    serializer_class = SearchResultSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = LessonsPaginator
+
+    def get(self, request, *args, **kwargs):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        kind = query.validated_data.get('type')
+        # the same scope as the course and lesson lists
+        owner = None if request.user.role == UserRoles.MODERATOR else request.user
+        results = SearchResults(query.validated_data['q'], owner=owner, kinds=[kind] if kind else None)
+        page = self.paginate_queryset(results)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+
+class PaymentListAPIView(SparseFieldsetMixin, FastListMixin, generics.ListAPIView):
 
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsPaymentOwner]
+    pagination_class = PaymentsPaginator
     filter_backends = [DjangoFilterBackend, OrderingFilter]
-    filter_fields = ('course', 'lesson', 'owner', 'method',)
+    filterset_fields = ('course', 'lesson', 'owner', 'method',)
     ordering_fields = ('payment_date',)
+    ordering = ('-date', '-id')
+    fieldset_always_load = ('date',)
+    fast_list_keys = ('date',)
 
     def get_queryset(self):
         if self.request.user.role == UserRoles.MODERATOR:
@@ -137,6 +253,132 @@ class PaymentListAPIView(generics.ListAPIView):
             return Payment.objects.filter(owner=self.request.user)
 
 
+class PaymentExportAPIView(PaymentListAPIView):
+    renderer_classes = [CSVStreamRenderer, NDJSONStreamRenderer]
+    pagination_class = None
+    export_fields = {
+        'id': 'id',
+        'date': 'date',
+        'amount': 'amount',
+        'method': 'method',
+        'course': 'course__course_name',
+        'lesson': 'lesson__lesson_name',
+        'user': 'user__first_name',
+        'owner': 'owner__email',
+    }
+
+    def get_fieldset(self):
+        # the export has its own columns and reads them with values()
+        return None
+
+    def list(self, request, *args, **kwargs):
+        rows = self.filter_queryset(self.get_queryset()).values(
+            **{f'export_{name}': F(lookup) for name, lookup in self.export_fields.items()}
+        ).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+        rows = ({name: row[f'export_{name}'] for name in self.export_fields} for row in rows)
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(rows, list(self.export_fields)),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}',
+        )
+        response['Content-Disposition'] = f'attachment; filename="payments.{renderer.format}"'
+        return response
+
+
+class PaymentImportAPIView(APIView):
+    permission_classes = [IsAuthenticated, IsModeratorOrReadOnly]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'Файл не передан'})
+        file_format = request.data.get('file_format') or upload.name.rsplit('.', 1)[-1]
+        if file_format not in ('csv', 'jsonl'):
+            raise ValidationError({'file_format': 'Поддерживаются csv и jsonl'})
+        try:
+            offset = int(request.data.get('offset', 0))
+            batch_size = int(request.data['batch_size']) if request.data.get('batch_size') else None
+        except ValueError:
+            raise ValidationError('offset и batch_size должны быть числами')
+
+        # checked up front, a decoding error in the middle of the run would leave part of the file imported
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            for chunk in upload.chunks():
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            raise ValidationError({'file': 'Файл должен быть в кодировке UTF-8'})
+        upload.seek(0)
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+        report = PaymentImporter(batch_size=batch_size, offset=offset).run(iter_rows(stream, file_format))
+        logger.info(f'Импорт платежей: {report["imported"]} строк, {report["rows_per_second"]} строк/с')
+        return Response(report)
+
+
+class UploadSessionCreateAPIView(generics.CreateAPIView):
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+
+class UploadSessionAPIView(APIView):
+    """
+    GET reports how many bytes arrived, PATCH appends the raw request body at the Upload-Offset header.
+    A mismatching offset answers 409 with the current one, so a client can resume after a failure.
+    """
+    permission_classes = [IsAuthenticated]
+    # the body is streamed to disk in append_chunk, never parsed
+    parser_classes = []
+
+    def get_object(self):
+        return get_object_or_404(UploadSession, pk=self.kwargs['pk'], owner=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        return Response(UploadSessionSerializer(self.get_object()).data)
+
+    def patch(self, request, *args, **kwargs):
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            raise ValidationError({'Upload-Offset': 'Заголовок должен содержать смещение части в байтах'})
+        session = self.get_object()
+        if offset + int(request.META.get('CONTENT_LENGTH') or 0) > session.size:
+            raise ValidationError('Часть выходит за пределы объявленного размера файла')
+
+        try:
+            session = append_chunk(session.pk, request.stream, offset)
+        except OffsetConflict as conflict:
+            return Response(UploadSessionSerializer(conflict.session).data, status=status.HTTP_409_CONFLICT)
+        except UploadTooLarge as error:
+            raise ValidationError(str(error))
+        return Response(UploadSessionSerializer(session).data)
+
+
+class UploadAttachAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        session = get_object_or_404(UploadSession, pk=self.kwargs['pk'], owner=request.user)
+        serializer = UploadAttachSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not session.is_complete:
+            raise ValidationError(f'Файл загружен не полностью: {session.offset} из {session.size} байт')
+
+        model, field_name = UPLOAD_TARGETS[serializer.validated_data['target']]
+        instance = get_object_or_404(model, pk=serializer.validated_data['id'])
+        if not can_attach(request.user, instance):
+            raise PermissionDenied('Вы не можете изменять этот объект')
+        try:
+            attach_upload(session, instance, field_name)
+        except ValueError as error:
+            raise ValidationError(str(error))
+        return Response({field_name: request.build_absolute_uri(getattr(instance, field_name).url)})
+
+
 class PaymentRetrieveAPIView(generics.RetrieveAPIView):
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsPaymentOwner]
@@ -156,45 +398,86 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
     queryset = Subscription.objects.all()
     lookup_field = 'id'
 
-    def subscription_create(self, serializer):
-        new_subscription = serializer.save(user=self.request.user)
-        new_subscription.save()
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def set_subscription(self, request, is_subscribed: bool) -> Response:
+        serializer = SubscriptionActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        course = serializer.validated_data['course']
+        if is_subscribed:
+            Subscription.objects.bulk_create(
+                [Subscription(user=request.user, course=course, is_subscribed=True)],
+                update_conflicts=True,
+                unique_fields=['user', 'course'],
+                update_fields=['is_subscribed'],
+            )
+        else:
+            Subscription.objects.filter(user=request.user, course=course).update(is_subscribed=False)
+        invalidate_subscribed_course_ids(request.user.pk)
+        bump_version(Subscription)
+        return Response({'course': course.pk, 'is_subscribed': is_subscribed})
 
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def subscribe(self, request):
+        return self.set_subscription(request, True)
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def unsubscribe(self, request):
+        return self.set_subscription(request, False)
 
 
 class CreateCheckoutSessionView(View):
     def post(self, request, *args, **kwargs):
-        product_id = self.kwargs["pk"]
-        product = Course.objects.get(id=product_id)
-        YOUR_DOMAIN = "http://127.0.0.1:8000"
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[
-                {
-                    'price_data': {
-                        'currency': 'usd',
-                        'unit_amount': product.price,
-                        'product_data': {
-                            'name': product.name
-                        },
-                    },
-                    'quantity': 1,
-                },
-            ],
-            metadata={
-                "product_id": product.id
-            },
-            mode='payment',
-            success_url=YOUR_DOMAIN + '/success/',
-            cancel_url=YOUR_DOMAIN + '/cancel/',
-        )
+        course = get_object_or_404(Course, pk=self.kwargs['pk'])
+        try:
+            checkout_session = get_stripe_client().create_checkout_session(
+                build_checkout_session_params(course, request.user)
+            )
+        except StripeError as error:
+            return JsonResponse({'error': str(error)}, status=status.HTTP_502_BAD_GATEWAY)
         return JsonResponse({
-            'id': checkout_session.id
+            'id': checkout_session['id']
         })
 
 
+class AsyncCreateCheckoutSessionView(View):
+    """CreateCheckoutSessionView that doesn't hold a worker while Stripe answers, serve it with config/asgi.py."""
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            course = await Course.objects.aget(pk=self.kwargs['pk'])
+        except (Course.DoesNotExist, ValueError):
+            raise Http404
+        try:
+            # request.user is lazy and may hit the session store, resolve it off the event loop
+            params = await sync_to_async(build_checkout_session_params)(course, request.user)
+            checkout_session = await get_stripe_client().acreate_checkout_session(params)
+        except StripeError as error:
+            return JsonResponse({'error': str(error)}, status=status.HTTP_502_BAD_GATEWAY)
+        return JsonResponse({
+            'id': checkout_session['id']
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class StripeWebhookView(View):
+    """Only verifies and stores the event, Payments are created by main.tasks.process_stripe_events."""
+
+    def post(self, request, *args, **kwargs):
+        try:
+            event = verify_event(request.body, request.headers.get('Stripe-Signature'))
+        except WebhookNotConfigured as error:
+            logger.error(str(error))
+            return JsonResponse({'error': 'Прием событий Stripe не настроен'},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except StripeError as error:
+            return JsonResponse({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        store_event(event)
+        transaction.on_commit(schedule_stripe_events_drain)
+        return JsonResponse({'received': True})
+
+
 class SuccessView(TemplateView):
     template_name = "success.html"
 
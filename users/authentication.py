@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from users.models import User
+
+# what requests read from request.user, the password hash and profile fields stay in the database
+CACHED_USER_FIELDS = ('id', 'email', 'role', 'is_active', 'is_staff', 'is_superuser')
+
+
+def user_cache_key(user_id) -> str:
+    return f'auth_user:{user_id}'
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that keeps CACHED_USER_FIELDS of the user in the cache for AUTH_USER_CACHE_TIMEOUT,
+    so authenticated reads don't query users_user. Entries are dropped on User save/delete (see users.signals).
+    The user is rebuilt with the other fields deferred: they are loaded on access and save() writes only
+    the cached ones.
+    """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        key = user_cache_key(user_id)
+        fields = cache.get(key)
+        if fields is None:
+            # only active users get past the parent checks, so everything cached is allowed in
+            user = super().get_user(validated_token)
+            fields = {name: getattr(user, name) for name in CACHED_USER_FIELDS}
+            cache.set(key, fields, settings.AUTH_USER_CACHE_TIMEOUT)
+            return user
+        # from_db() expects the values in the order of the model fields
+        names = [field.attname for field in User._meta.concrete_fields if field.attname in fields]
+        return User.from_db(DEFAULT_DB_ALIAS, names, [fields[name] for name in names])
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='user',
+            options={'verbose_name': 'пользователь', 'verbose_name_plural': 'пользователи'},
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='username',
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, upload_to='users', verbose_name='Аватар'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='city',
+            field=models.CharField(blank=True, max_length=20, null=True, verbose_name='Город'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='phone',
+            field=models.CharField(blank=True, max_length=20, null=True, verbose_name='Телефон'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='role',
+            field=models.CharField(choices=[('member', 'member'), ('moderator', 'moderator')], default='member', max_length=9),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='email',
+            field=models.EmailField(max_length=30, unique=True, verbose_name='Почта'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_user_options_remove_user_username_user_avatar_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_thumbnails',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Уменьшенные аватары'),
+        ),
+    ]
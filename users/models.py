@@ -20,6 +20,7 @@ class User(AbstractUser):
     phone = models.CharField(max_length=20, verbose_name='Телефон', **NULLABLE)
     city = models.CharField(max_length=20, verbose_name='Город', **NULLABLE)
     avatar = models.ImageField(upload_to='users', verbose_name='Аватар', **NULLABLE)
+    avatar_thumbnails = models.JSONField(default=dict, editable=False, verbose_name='Уменьшенные аватары')
     role = models.CharField(max_length=9, choices=UserRoles.choices, default=UserRoles.MEMBER)
 
     USERNAME_FIELD = "email"
@@ -1,10 +1,12 @@
 from rest_framework import serializers
 from users.models import User
 from main.models import Payment
-from main.serializers import PaymentForOwnerSerializer
+from main.serializers import PaymentForOwnerSerializer, ThumbnailsField
 
 
 class UserSerializer(serializers.ModelSerializer):
+    avatar_thumbnails = ThumbnailsField()
+
     class Meta:
         model = User
         fields = '__all__'
@@ -1,3 +1,87 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from main.models import Course
+from users.authentication import CachedJWTAuthentication, user_cache_key
+from users.models import User, UserRoles
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachedJWTAuthenticationTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='member@test.com', password='member')
+        self.token = f'Bearer {AccessToken.for_user(self.user)}'
+        Course.objects.create(course_name='TestCourse', course_description='TestCourseDescription', owner=self.user)
+
+    def get_courses(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('courses:courses-list'), HTTP_AUTHORIZATION=self.token)
+        user_queries = [query for query in context.captured_queries if 'users_user' in query['sql']]
+        return response, user_queries
+
+    def test_user_is_read_from_cache(self):
+        response, user_queries = self.get_courses()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(user_queries), 1)
+
+        response, user_queries = self.get_courses()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(user_queries, [])
+
+    def test_password_hash_is_not_cached(self):
+        self.user.set_password('member')
+        self.user.save()
+        self.get_courses()
+
+        cached = cache.get(user_cache_key(self.user.pk))
+        self.assertEqual(cached, {'id': self.user.pk, 'email': 'member@test.com', 'role': UserRoles.MEMBER,
+                                  'is_active': True, 'is_staff': False, 'is_superuser': False})
+
+        user = CachedJWTAuthentication().get_user(AccessToken.for_user(self.user))
+        self.assertEqual(user.get_deferred_fields(), {'password', 'first_name', 'last_name', 'phone', 'city', 'avatar',
+                                                      'avatar_thumbnails', 'last_login', 'date_joined'})
+        user.save()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('member'))
+
+    def test_role_change_invalidates_cache(self):
+        self.get_courses()
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+
+        response = self.client.patch(
+            reverse('users:user_update', kwargs={'pk': self.user.pk}),
+            data={'role': UserRoles.MODERATOR},
+            HTTP_AUTHORIZATION=self.token
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+        _, user_queries = self.get_courses()
+        self.assertEqual(len(user_queries), 1)
+        self.assertEqual(cache.get(user_cache_key(self.user.pk))['role'], UserRoles.MODERATOR)
+
+    def test_inactive_user_is_rejected(self):
+        self.get_courses()
+        self.user.is_active = False
+        self.user.save()
+
+        response, _ = self.get_courses()
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+    def test_deleted_user_is_rejected(self):
+        self.get_courses()
+        self.user.delete()
+
+        response, _ = self.get_courses()
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)